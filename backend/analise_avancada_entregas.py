@@ -4,69 +4,340 @@ Análise Avançada de Dados - Expresso Itaporanga
 Sistema de análise de dados para insights operacionais e estratégicos
 """
 
-import sqlite3
+import argparse
 import pandas as pd
 import matplotlib.pyplot as plt
 from datetime import datetime, timedelta
+from sqlalchemy import create_engine, inspect, text, bindparam, DateTime
+from sqlalchemy.exc import DBAPIError
+from collections import Counter
 import json
 import os
+import sqlite3
+import time
 
 # Configuração de estilo para gráficos
 plt.style.use('default')
 plt.rcParams['figure.figsize'] = (10, 6)
 
+CAMINHO_BANCO_PADRAO = '/home/ubuntu/site_integrado_expresso/src/instance/expresso_itaporanga.db'
+CAMINHO_RELATORIO = '/home/ubuntu/relatorio_analise_completa.json'
+CAMINHO_ESTADO_PADRAO = '/home/ubuntu/estado_analise_entregas.db'
+
+# Mesmos nomes de Series.dt.day_name(), independentes do locale
+DIAS_SEMANA = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+
+# Mês (AAAA-MM) de uma coluna de data, por dialeto
+MES_DIALETO = {
+    'sqlite': "strftime('%Y-%m', {coluna})",
+    'postgresql': "to_char(date_trunc('month', {coluna}), 'YYYY-MM')"
+}
+
+# Expressões por dialeto para agregar no banco (dia da semana: 0 = domingo nos dois)
+EXPRESSOES_DIALETO = {
+    'sqlite': {
+        'dia_semana': "CAST(strftime('%w', data_criacao) AS INTEGER)",
+        'mes': MES_DIALETO['sqlite'].format(coluna='data_criacao'),
+        'horas': '(julianday(data_atualizacao) - julianday(data_criacao)) * 24'
+    },
+    'postgresql': {
+        'dia_semana': 'CAST(EXTRACT(DOW FROM data_criacao) AS INTEGER)',
+        'mes': MES_DIALETO['postgresql'].format(coluna='data_criacao'),
+        'horas': 'EXTRACT(EPOCH FROM (data_atualizacao - data_criacao)) / 3600.0'
+    }
+}
+
+# Snapshot Parquet (exportar_snapshot_entregas.py): uma partição mes=AAAA-MM por tabela
+CAMINHO_SNAPSHOT_PADRAO = '/home/ubuntu/snapshot_entregas'
+COLUNAS_ENTREGA = ['remetente_cidade', 'destinatario_cidade', 'tipo_produto', 'peso', 'valor_declarado',
+                   'status', 'data_criacao', 'data_atualizacao']
+COLUNAS_ETAPAS = ['status_anterior', 'status', 'duracao_segundos']
+
+CONSULTA_ETAPAS = """
+SELECT
+    status_anterior,
+    status,
+    COUNT(*) AS total,
+    AVG(duracao_segundos) / 3600.0 AS media_horas
+FROM status_evento
+{where}
+GROUP BY status_anterior, status
+"""
+
+# Leitura em lotes com tipos compactos (cidades, produto e status como category); cada lote é
+# somado em AgregadosEntregas e descartado, então a memória não cresce com o número de entregas
+TAMANHO_LOTE_PADRAO = 50000
+COLUNAS_CATEGORIA = ['remetente_cidade', 'destinatario_cidade', 'tipo_produto', 'status']
+TIPOS_COLUNAS = {
+    **{coluna: 'category' for coluna in COLUNAS_CATEGORIA},
+    'peso': 'float32',
+    'valor_declarado': 'float32'
+}
+
+def url_banco(origem=None):
+    """URL do SQLAlchemy a partir de um caminho SQLite, de uma URL ou de DATABASE_URL"""
+    origem = origem or os.environ.get('DATABASE_URL') or CAMINHO_BANCO_PADRAO
+    if '://' not in origem:
+        return f'sqlite:///{origem}'
+    if origem.startswith('postgres://'):
+        origem = origem.replace('postgres://', 'postgresql://', 1)
+    return origem
+
+def filtro_periodo(coluna, data_inicio, data_fim):
+    """Cláusula WHERE e parâmetros do período (datas inclusivas, AAAA-MM-DD ou datetime)"""
+    condicoes = []
+    parametros = {}
+    if data_inicio is not None:
+        condicoes.append(f'{coluna} >= :data_inicio')
+        parametros['data_inicio'] = pd.Timestamp(data_inicio).normalize().to_pydatetime()
+    if data_fim is not None:
+        condicoes.append(f'{coluna} < :data_fim')
+        parametros['data_fim'] = (pd.Timestamp(data_fim).normalize() + timedelta(days=1)).to_pydatetime()
+    clausula = ('WHERE ' + ' AND '.join(condicoes)) if condicoes else ''
+    return clausula, parametros
+
+def consulta_com_periodo(sql, parametros):
+    """text() com os parâmetros de data tipados, para o SQLite comparar no mesmo formato gravado"""
+    consulta = text(sql)
+    if parametros:
+        consulta = consulta.bindparams(*(bindparam(nome, type_=DateTime()) for nome in parametros))
+    return consulta
+
+def abrir_snapshot(diretorio, tabela, coluna_data, data_inicio=None, data_fim=None):
+    """Dataset de uma tabela do snapshot (com mmap) e o filtro que só lê as partições do período"""
+    # pyarrow só é necessário para quem usa o snapshot
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    from pyarrow import fs
+    
+    caminho = os.path.abspath(os.path.join(diretorio, tabela))
+    if not os.path.isdir(caminho):
+        raise FileNotFoundError(f'Snapshot sem a tabela {tabela}: {caminho}')
+    
+    dataset = ds.dataset(
+        caminho, format='parquet', filesystem=fs.LocalFileSystem(use_mmap=True),
+        partitioning=ds.partitioning(pa.schema([('mes', pa.string())]), flavor='hive')
+    )
+    
+    _, parametros = filtro_periodo(coluna_data, data_inicio, data_fim)
+    filtro = None
+    if 'data_inicio' in parametros:
+        filtro = (ds.field('mes') >= parametros['data_inicio'].strftime('%Y-%m')) & \
+            (ds.field(coluna_data) >= parametros['data_inicio'])
+    if 'data_fim' in parametros:
+        condicao = (ds.field('mes') <= (parametros['data_fim'] - timedelta(days=1)).strftime('%Y-%m')) & \
+            (ds.field(coluna_data) < parametros['data_fim'])
+        filtro = condicao if filtro is None else filtro & condicao
+    return dataset, filtro
+
+def ler_snapshot(diretorio, tabela, colunas, coluna_data, data_inicio=None, data_fim=None):
+    """Lê só as colunas pedidas de uma tabela do snapshot, com mmap e só as partições do período"""
+    dataset, filtro = abrir_snapshot(diretorio, tabela, coluna_data, data_inicio, data_fim)
+    if not dataset.files:
+        return None
+    return dataset.to_table(columns=colunas, filter=filtro).to_pandas()
+
+def lotes_snapshot(diretorio, tabela, colunas, coluna_data, data_inicio=None, data_fim=None,
+                   tamanho_lote=TAMANHO_LOTE_PADRAO):
+    """Como ler_snapshot, mas em DataFrames de até `tamanho_lote` linhas"""
+    dataset, filtro = abrir_snapshot(diretorio, tabela, coluna_data, data_inicio, data_fim)
+    for lote in dataset.to_batches(columns=colunas, filter=filtro, batch_size=tamanho_lote):
+        if lote.num_rows:
+            yield lote.to_pandas()
+
+def salvar_relatorio(resultados):
+    """Grava o relatório em JSON para os gráficos"""
+    with open(CAMINHO_RELATORIO, 'w', encoding='utf-8') as f:
+        json.dump(resultados, f, indent=2, ensure_ascii=False)
+
+class Welford:
+    """Média e variância acumuladas (algoritmo de Welford), com remoção de valores"""
+    
+    def __init__(self, n=0, media=0.0, m2=0.0):
+        self.n = n
+        self.media = media
+        self.m2 = m2
+    
+    def adicionar(self, x):
+        self.n += 1
+        delta = x - self.media
+        self.media += delta / self.n
+        self.m2 += delta * (x - self.media)
+    
+    def remover(self, x):
+        """Desfaz um adicionar(x) anterior"""
+        if self.n <= 1:
+            self.n, self.media, self.m2 = 0, 0.0, 0.0
+            return
+        self.n -= 1
+        delta = x - self.media
+        self.media -= delta / self.n
+        self.m2 = max(self.m2 - delta * (x - self.media), 0.0)
+    
+    def combinar(self, n, media, m2):
+        """Junta o acumulado de outro conjunto de valores (fórmula de Chan)"""
+        if n == 0:
+            return
+        total = self.n + n
+        delta = media - self.media
+        self.media += delta * n / total
+        self.m2 += m2 + delta * delta * self.n * n / total
+        self.n = total
+    
+    def desvio(self):
+        """Desvio padrão amostral (mesmo ddof=1 do pandas)"""
+        return (self.m2 / (self.n - 1)) ** 0.5 if self.n > 1 else None
+    
+    def para_lista(self):
+        return [self.n, self.media, self.m2]
+
+class AgregadosEntregas:
+    """Agregados do relatório somados lote a lote: só eles ficam na memória, não as entregas"""
+    
+    def __init__(self):
+        self.total = 0
+        self.status = Counter()
+        self.produtos = Counter()
+        self.rotas = Counter()
+        self.dias_semana = Counter()
+        self.meses = Counter()
+        self.data_minima = None
+        self.data_maxima = None
+        self.tempo = Welford()
+        self.tempo_por_status = {}
+        # Linhas com valor, soma (float64) por coluna
+        self.somas = {'valor_declarado': [0, 0.0], 'peso': [0, 0.0]}
+        # Entregas com valor e peso: linhas, soma do valor e do peso; por produto: linhas e soma do valor
+        self.valor_peso = [0, 0.0, 0.0]
+        self.valor_por_produto = {}
+    
+    @staticmethod
+    def contar(serie):
+        """value_counts sem as categorias ausentes do lote"""
+        return {chave: int(total) for chave, total in serie.value_counts().items() if total}
+    
+    def somar_lote(self, lote):
+        """Funde um lote de entregas (tipos de TIPOS_COLUNAS e tempo_processamento) nos agregados"""
+        self.total += len(lote)
+        self.status.update(self.contar(lote['status']))
+        self.produtos.update(self.contar(lote['tipo_produto']))
+        rotas = lote.groupby(['remetente_cidade', 'destinatario_cidade'], observed=True).size()
+        self.rotas.update({f'{origem} → {destino}': int(total) for (origem, destino), total in rotas.items() if total})
+        self.dias_semana.update(self.contar(lote['data_criacao'].dt.day_name()))
+        self.meses.update(self.contar(lote['data_criacao'].dt.strftime('%Y-%m')))
+        
+        minima, maxima = lote['data_criacao'].min(), lote['data_criacao'].max()
+        if not pd.isna(minima):
+            self.data_minima = minima if self.data_minima is None else min(self.data_minima, minima)
+            self.data_maxima = maxima if self.data_maxima is None else max(self.data_maxima, maxima)
+        
+        tempo = lote['tempo_processamento']
+        self.tempo.combinar(int(tempo.count()), float(tempo.mean()) if tempo.count() else 0.0,
+                            float(((tempo - tempo.mean()) ** 2).sum()))
+        por_status = lote.groupby('status', observed=True)['tempo_processamento'].agg(['count', 'mean', 'var', 'min', 'max'])
+        for status, linha in por_status.iterrows():
+            if not linha['count']:
+                continue
+            acumulado = self.tempo_por_status.setdefault(status, [Welford(), linha['min'], linha['max']])
+            m2 = linha['var'] * (linha['count'] - 1) if linha['count'] > 1 else 0.0
+            acumulado[0].combinar(int(linha['count']), float(linha['mean']), float(m2))
+            acumulado[1] = min(acumulado[1], linha['min'])
+            acumulado[2] = max(acumulado[2], linha['max'])
+        
+        # Colunas guardadas em float32; somas acumuladas em float64
+        for coluna, soma in self.somas.items():
+            valores = lote[coluna].astype('float64')
+            soma[0] += int(valores.count())
+            soma[1] += float(valores.sum())
+        limpo = lote.dropna(subset=['valor_declarado', 'peso']).astype({'valor_declarado': 'float64', 'peso': 'float64'})
+        self.valor_peso[0] += len(limpo)
+        self.valor_peso[1] += float(limpo['valor_declarado'].sum())
+        self.valor_peso[2] += float(limpo['peso'].sum())
+        for produto, linha in limpo.groupby('tipo_produto', observed=True)['valor_declarado'].agg(['count', 'sum']).iterrows():
+            acumulado = self.valor_por_produto.setdefault(produto, [0, 0.0])
+            acumulado[0] += int(linha['count'])
+            acumulado[1] += float(linha['sum'])
+    
+    @staticmethod
+    def serie(contador):
+        """Contagem como Series, da maior para a menor (empates em ordem alfabética)"""
+        itens = sorted(contador.items(), key=lambda item: (-item[1], item[0]))
+        return pd.Series(dict(itens), dtype='int64')
+
 class AnalisadorEntregas:
-    def __init__(self, db_path):
-        self.db_path = db_path
-        self.df_entregas = None
+    def __init__(self, db_path=None, data_inicio=None, data_fim=None, tamanho_lote=TAMANHO_LOTE_PADRAO,
+                 snapshot=None):
+        self.db_url = url_banco(db_path)
+        self.engine = create_engine(self.db_url)
+        self.data_inicio = data_inicio
+        self.data_fim = data_fim
+        self.tamanho_lote = tamanho_lote
+        self.snapshot = snapshot
+        self.agregados = None
         self.carregar_dados()
     
+    def lotes_entregas(self):
+        """Entregas do período em lotes com tipos compactos e o tempo de processamento em horas"""
+        if self.snapshot:
+            lotes = lotes_snapshot(self.snapshot, 'entrega', COLUNAS_ENTREGA, 'data_criacao',
+                                   self.data_inicio, self.data_fim, self.tamanho_lote)
+        else:
+            lotes = self.lotes_banco()
+        for lote in lotes:
+            lote = lote.astype({**TIPOS_COLUNAS, 'data_criacao': 'datetime64[ns]', 'data_atualizacao': 'datetime64[ns]'})
+            lote['tempo_processamento'] = (
+                lote['data_atualizacao'] - lote['data_criacao']
+            ).dt.total_seconds() / 3600
+            yield lote
+    
+    def lotes_banco(self):
+        """Lotes da consulta das entregas do período"""
+        where, parametros = filtro_periodo('data_criacao', self.data_inicio, self.data_fim)
+        query = f"""
+        SELECT 
+            remetente_cidade,
+            destinatario_cidade,
+            tipo_produto,
+            peso,
+            valor_declarado,
+            status,
+            data_criacao,
+            data_atualizacao
+        FROM entrega
+        {where}
+        """
+        
+        # stream_results: cursor no servidor no Postgres, sem trazer tudo para a memória
+        with self.engine.connect().execution_options(stream_results=True) as conexao:
+            yield from pd.read_sql_query(
+                consulta_com_periodo(query, parametros), conexao, params=parametros,
+                chunksize=self.tamanho_lote, dtype=TIPOS_COLUNAS,
+                parse_dates=['data_criacao', 'data_atualizacao']
+            )
+    
     def carregar_dados(self):
-        """Carrega dados do banco SQLite para DataFrame pandas"""
+        """Soma as entregas do período lote a lote: cada lote é descartado depois de agregado"""
+        origem = ' do snapshot' if self.snapshot else ''
         try:
-            conn = sqlite3.connect(self.db_path)
-            query = """
-            SELECT 
-                id,
-                codigo_rastreamento,
-                remetente_nome,
-                remetente_cidade,
-                destinatario_nome,
-                destinatario_cidade,
-                tipo_produto,
-                peso,
-                valor_declarado,
-                status,
-                data_criacao,
-                data_atualizacao
-            FROM entrega
-            ORDER BY data_criacao DESC
-            """
+            inicio = time.perf_counter()
+            agregados = AgregadosEntregas()
+            for lote in self.lotes_entregas():
+                agregados.somar_lote(lote)
+            self.agregados = agregados
             
-            self.df_entregas = pd.read_sql_query(query, conn)
-            
-            # Converter datas
-            self.df_entregas['data_criacao'] = pd.to_datetime(self.df_entregas['data_criacao'])
-            self.df_entregas['data_atualizacao'] = pd.to_datetime(self.df_entregas['data_atualizacao'])
-            
-            # Calcular tempo de processamento
-            self.df_entregas['tempo_processamento'] = (
-                self.df_entregas['data_atualizacao'] - self.df_entregas['data_criacao']
-            ).dt.total_seconds() / 3600  # em horas
-            
-            conn.close()
-            print(f"✅ Dados carregados: {len(self.df_entregas)} entregas")
+            print(f"✅ Dados carregados{origem}: {agregados.total} entregas em lotes de até {self.tamanho_lote} "
+                  f"linhas ({(time.perf_counter() - inicio) * 1000:.0f}ms)")
             
         except Exception as e:
-            print(f"❌ Erro ao carregar dados: {e}")
+            print(f"❌ Erro ao carregar dados{origem}: {e}")
     
     def analise_distribuicao_status(self):
         """Análise da distribuição de status das entregas"""
         print("\n📊 ANÁLISE DE DISTRIBUIÇÃO DE STATUS")
         print("=" * 50)
         
-        status_counts = self.df_entregas['status'].value_counts()
-        status_percentual = (status_counts / len(self.df_entregas) * 100).round(2)
+        status_counts = AgregadosEntregas.serie(self.agregados.status)
+        status_percentual = (status_counts / self.agregados.total * 100).round(2)
         
         for status, count in status_counts.items():
             percentual = status_percentual[status]
@@ -79,8 +350,8 @@ class AnalisadorEntregas:
         print("\n📦 ANÁLISE DE PRODUTOS TRANSPORTADOS")
         print("=" * 50)
         
-        produtos_counts = self.df_entregas['tipo_produto'].value_counts()
-        produtos_percentual = (produtos_counts / len(self.df_entregas) * 100).round(2)
+        produtos_counts = AgregadosEntregas.serie(self.agregados.produtos)
+        produtos_percentual = (produtos_counts / self.agregados.total * 100).round(2)
         
         for produto, count in produtos_counts.items():
             percentual = produtos_percentual[produto]
@@ -93,16 +364,11 @@ class AnalisadorEntregas:
         print("\n🗺️  ANÁLISE DE ROTAS")
         print("=" * 50)
         
-        # Criar coluna de rota
-        self.df_entregas['rota'] = (
-            self.df_entregas['remetente_cidade'] + ' → ' + 
-            self.df_entregas['destinatario_cidade']
-        )
-        
-        rotas_counts = self.df_entregas['rota'].value_counts()
+        # Contadas pelos pares de cidades em cada lote; empates em ordem alfabética
+        rotas_counts = AgregadosEntregas.serie(self.agregados.rotas)
         
         for rota, count in rotas_counts.head(5).items():
-            percentual = (count / len(self.df_entregas) * 100)
+            percentual = (count / self.agregados.total * 100)
             print(f"{rota:<30}: {count:>3} entregas ({percentual:>5.1f}%)")
         
         return rotas_counts
@@ -113,16 +379,14 @@ class AnalisadorEntregas:
         print("=" * 50)
         
         # Entregas por dia da semana
-        self.df_entregas['dia_semana'] = self.df_entregas['data_criacao'].dt.day_name()
-        dias_counts = self.df_entregas['dia_semana'].value_counts()
+        dias_counts = AgregadosEntregas.serie(self.agregados.dias_semana)
         
         print("Entregas por dia da semana:")
         for dia, count in dias_counts.items():
             print(f"{dia:<10}: {count:>3} entregas")
         
         # Entregas por mês
-        self.df_entregas['mes'] = self.df_entregas['data_criacao'].dt.strftime('%Y-%m')
-        meses_counts = self.df_entregas['mes'].value_counts().sort_index()
+        meses_counts = AgregadosEntregas.serie(self.agregados.meses).sort_index()
         
         print("\nEntregas por mês:")
         for mes, count in meses_counts.items():
@@ -135,45 +399,94 @@ class AnalisadorEntregas:
         print("\n⚡ ANÁLISE DE PERFORMANCE")
         print("=" * 50)
         
-        # Tempo médio de processamento por status
-        tempo_por_status = self.df_entregas.groupby('status')['tempo_processamento'].agg([
-            'mean', 'median', 'std', 'min', 'max'
-        ]).round(2)
+        # Tempo por status, combinado entre os lotes (a mediana exigiria a coluna inteira)
+        tempo_por_status = pd.DataFrame(
+            [{'mean': acumulado.media, 'std': acumulado.desvio(), 'min': minimo, 'max': maximo}
+             for acumulado, minimo, maximo in self.agregados.tempo_por_status.values()],
+            index=pd.Index(list(self.agregados.tempo_por_status), name='status'),
+            columns=['mean', 'std', 'min', 'max'], dtype='float64'
+        ).sort_index().round(2)
         
         print("Tempo de processamento por status (em horas):")
         print(tempo_por_status)
         
         # Estatísticas gerais
-        total_entregas = len(self.df_entregas)
-        entregues = len(self.df_entregas[self.df_entregas['status'] == 'entregue'])
+        total_entregas = self.agregados.total
+        entregues = self.agregados.status.get('entregue', 0)
         taxa_sucesso = (entregues / total_entregas * 100)
         
         print(f"\n📈 INDICADORES GERAIS:")
         print(f"Total de entregas: {total_entregas}")
         print(f"Entregas concluídas: {entregues}")
         print(f"Taxa de sucesso: {taxa_sucesso:.1f}%")
-        print(f"Tempo médio de processamento: {self.df_entregas['tempo_processamento'].mean():.1f}h")
+        print(f"Tempo médio de processamento: {self.tempo_medio():.1f}h")
         
         return tempo_por_status
     
+    def tempo_medio(self):
+        """Média do tempo de processamento (NaN sem entregas com as duas datas, como no pandas)"""
+        return self.agregados.tempo.media if self.agregados.tempo.n else float('nan')
+    
+    def analise_etapas(self):
+        """Tempo médio em cada etapa a partir do histórico de status (tabela status_evento)"""
+        print("\n⏱️  ANÁLISE POR ETAPA")
+        print("=" * 50)
+        
+        where, parametros = filtro_periodo('data_evento', self.data_inicio, self.data_fim)
+        query = CONSULTA_ETAPAS.format(where=where)
+        
+        try:
+            if self.snapshot:
+                etapas = self.etapas_snapshot()
+            else:
+                with self.engine.connect() as conexao:
+                    etapas = pd.read_sql_query(consulta_com_periodo(query, parametros), conexao, params=parametros)
+        except (DBAPIError, FileNotFoundError):
+            print("Histórico de status não disponível neste banco")
+            return pd.DataFrame(columns=['status_anterior', 'status', 'total', 'media_horas'])
+        
+        for _, etapa in etapas.iterrows():
+            print(f"{etapa['status_anterior']} → {etapa['status']:<12}: {etapa['total']:>3} mudanças, "
+                  f"média de {etapa['media_horas']:.1f}h")
+        
+        return etapas
+    
+    def etapas_snapshot(self):
+        """Mesma agregação de CONSULTA_ETAPAS sobre o status_evento do snapshot"""
+        eventos = ler_snapshot(self.snapshot, 'status_evento', COLUNAS_ETAPAS, 'data_evento',
+                               self.data_inicio, self.data_fim)
+        if eventos is None or eventos.empty:
+            return pd.DataFrame(columns=['status_anterior', 'status', 'total', 'media_horas'])
+        
+        etapas = eventos.groupby(['status_anterior', 'status'], observed=True, dropna=False).agg(
+            total=('status', 'size'), media_horas=('duracao_segundos', 'mean')
+        ).reset_index()
+        etapas['media_horas'] = etapas['media_horas'] / 3600.0
+        # Transição sem status anterior (criação) fica None, como no resultado da consulta
+        for coluna in ('status_anterior', 'status'):
+            etapas[coluna] = etapas[coluna].astype(object).where(etapas[coluna].notna(), None)
+        return etapas
+    
     def analise_valor_peso(self):
         """Análise de valor declarado e peso das entregas"""
         print("\n💰 ANÁLISE DE VALOR E PESO")
         print("=" * 50)
         
-        # Remover valores nulos
-        df_clean = self.df_entregas.dropna(subset=['valor_declarado', 'peso'])
+        # Só entregas com valor e peso, somadas em float64 lote a lote
+        linhas, valor_total, peso_total = self.agregados.valor_peso
         
-        if len(df_clean) > 0:
-            print(f"Valor declarado médio: R$ {df_clean['valor_declarado'].mean():.2f}")
-            print(f"Valor declarado total: R$ {df_clean['valor_declarado'].sum():.2f}")
-            print(f"Peso médio: {df_clean['peso'].mean():.2f} kg")
-            print(f"Peso total: {df_clean['peso'].sum():.2f} kg")
+        if linhas > 0:
+            print(f"Valor declarado médio: R$ {valor_total / linhas:.2f}")
+            print(f"Valor declarado total: R$ {valor_total:.2f}")
+            print(f"Peso médio: {peso_total / linhas:.2f} kg")
+            print(f"Peso total: {peso_total:.2f} kg")
             
             # Análise por tipo de produto
-            valor_por_produto = df_clean.groupby('tipo_produto')['valor_declarado'].agg([
-                'mean', 'sum', 'count'
-            ]).round(2)
+            valor_por_produto = pd.DataFrame(
+                [{'mean': soma / contagem, 'sum': soma, 'count': contagem}
+                 for contagem, soma in self.agregados.valor_por_produto.values()],
+                index=pd.Index(list(self.agregados.valor_por_produto), name='tipo_produto')
+            ).sort_index().round(2)
             
             print("\nValor por tipo de produto:")
             print(valor_por_produto)
@@ -186,7 +499,11 @@ class AnalisadorEntregas:
         print("🚚 RELATÓRIO COMPLETO DE ANÁLISE - EXPRESSO ITAPORANGA")
         print("="*60)
         print(f"Data da análise: {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}")
-        print(f"Período analisado: {self.df_entregas['data_criacao'].min().strftime('%d/%m/%Y')} a {self.df_entregas['data_criacao'].max().strftime('%d/%m/%Y')}")
+        if self.agregados is None or self.agregados.total == 0:
+            print("Nenhuma entrega encontrada no período")
+            return None
+        if self.agregados.data_minima is not None:
+            print(f"Período analisado: {self.agregados.data_minima.strftime('%d/%m/%Y')} a {self.agregados.data_maxima.strftime('%d/%m/%Y')}")
         
         # Executar todas as análises
         status_dist = self.analise_distribuicao_status()
@@ -194,46 +511,474 @@ class AnalisadorEntregas:
         rotas_dist = self.analise_rotas()
         dias_counts, meses_counts = self.analise_temporal()
         performance = self.analise_performance()
+        etapas = self.analise_etapas()
         self.analise_valor_peso()
         
         # Salvar resultados em JSON
+        somas = self.agregados.somas
         resultados = {
             'data_analise': datetime.now().isoformat(),
-            'total_entregas': len(self.df_entregas),
+            'total_entregas': self.agregados.total,
             'distribuicao_status': status_dist.to_dict(),
             'distribuicao_produtos': produtos_dist.to_dict(),
             'rotas_principais': rotas_dist.head(5).to_dict(),
             'entregas_por_dia_semana': dias_counts.to_dict(),
             'entregas_por_mes': meses_counts.to_dict(),
+            'latencia_etapas': etapas.round(2).to_dict('records'),
             'indicadores': {
-                'taxa_sucesso': (len(self.df_entregas[self.df_entregas['status'] == 'entregue']) / len(self.df_entregas) * 100),
-                'tempo_medio_processamento': float(self.df_entregas['tempo_processamento'].mean()),
-                'total_valor_declarado': float(self.df_entregas['valor_declarado'].sum()) if not self.df_entregas['valor_declarado'].isna().all() else 0,
-                'peso_total': float(self.df_entregas['peso'].sum()) if not self.df_entregas['peso'].isna().all() else 0
+                'taxa_sucesso': (self.agregados.status.get('entregue', 0) / self.agregados.total * 100),
+                'tempo_medio_processamento': float(self.tempo_medio()),
+                'total_valor_declarado': somas['valor_declarado'][1] if somas['valor_declarado'][0] else 0,
+                'peso_total': somas['peso'][1] if somas['peso'][0] else 0
             }
         }
         
         # Salvar em arquivo JSON
-        with open('/home/ubuntu/relatorio_analise_completa.json', 'w', encoding='utf-8') as f:
-            json.dump(resultados, f, indent=2, ensure_ascii=False)
+        salvar_relatorio(resultados)
+        
+        print(f"\n✅ Relatório salvo em: {CAMINHO_RELATORIO}")
+        
+        return resultados
+
+class AnalisadorSQL:
+    """Mesmo relatório de AnalisadorEntregas com GROUP BY no banco: só linhas agregadas saem do servidor"""
+    
+    def __init__(self, db_path=None, data_inicio=None, data_fim=None):
+        self.engine = create_engine(url_banco(db_path))
+        self.data_inicio = data_inicio
+        self.data_fim = data_fim
+        self.expressoes = EXPRESSOES_DIALETO.get(self.engine.dialect.name, EXPRESSOES_DIALETO['postgresql'])
+    
+    def consultar(self, conexao, sql, coluna='data_criacao', tipos=None):
+        """Executa uma consulta agregada restrita ao período"""
+        where, parametros = filtro_periodo(coluna, self.data_inicio, self.data_fim)
+        consulta = consulta_com_periodo(sql.format(where=where, **self.expressoes), parametros)
+        if tipos:
+            consulta = consulta.columns(**tipos)
+        return conexao.execute(consulta, parametros).all()
+    
+    def contagem(self, conexao, coluna):
+        """Contagem por valor de uma coluna, da maior para a menor"""
+        return dict(self.consultar(conexao, f"""
+            SELECT {coluna}, COUNT(*) AS total
+            FROM entrega
+            {{where}}
+            GROUP BY {coluna}
+            HAVING {coluna} IS NOT NULL
+            ORDER BY total DESC, {coluna}
+        """))
+    
+    def indicadores(self, conexao):
+        """Totais, somas e médias numa única varredura"""
+        return self.consultar(conexao, """
+            SELECT
+                COUNT(*) AS total,
+                COALESCE(SUM(CASE WHEN status = 'entregue' THEN 1 ELSE 0 END), 0) AS entregues,
+                AVG({horas}) AS tempo_medio,
+                COALESCE(SUM(valor_declarado), 0) AS valor_total,
+                COALESCE(SUM(peso), 0) AS peso_total,
+                MIN(data_criacao) AS primeira,
+                MAX(data_criacao) AS ultima
+            FROM entrega
+            {where}
+        """, tipos={'primeira': DateTime(), 'ultima': DateTime()})[0]
+    
+    def rotas(self, conexao, limite=5):
+        """Rotas mais usadas, agrupando pelos pares de cidades"""
+        linhas = self.consultar(conexao, f"""
+            SELECT remetente_cidade, destinatario_cidade, COUNT(*) AS total
+            FROM entrega
+            {{where}}
+            GROUP BY remetente_cidade, destinatario_cidade
+            HAVING remetente_cidade IS NOT NULL AND destinatario_cidade IS NOT NULL
+            ORDER BY total DESC, remetente_cidade, destinatario_cidade
+            LIMIT {int(limite)}
+        """)
+        return {f'{origem} → {destino}': total for origem, destino, total in linhas}
+    
+    def dias_semana(self, conexao):
+        """Entregas por dia da semana (strftime/EXTRACT devolvem 0 para domingo)"""
+        linhas = self.consultar(conexao, """
+            SELECT {dia_semana} AS dia, COUNT(*) AS total
+            FROM entrega
+            {where}
+            GROUP BY dia
+            ORDER BY total DESC, dia
+        """)
+        return {DIAS_SEMANA[(int(dia) + 6) % 7]: total for dia, total in linhas if dia is not None}
+    
+    def meses(self, conexao):
+        """Entregas por mês (AAAA-MM), em ordem cronológica"""
+        linhas = self.consultar(conexao, """
+            SELECT {mes} AS mes, COUNT(*) AS total
+            FROM entrega
+            {where}
+            GROUP BY mes
+            ORDER BY mes
+        """)
+        return {mes: total for mes, total in linhas if mes is not None}
+    
+    def etapas(self, conexao):
+        """Latência por transição de status, se o banco tiver o histórico (última consulta da conexão)"""
+        try:
+            linhas = self.consultar(conexao, CONSULTA_ETAPAS, coluna='data_evento')
+        except DBAPIError:
+            print("Histórico de status não disponível neste banco")
+            return []
+        return [
+            {
+                'status_anterior': anterior,
+                'status': status,
+                'total': total,
+                'media_horas': round(float(media), 2) if media is not None else None
+            }
+            for anterior, status, total, media in linhas
+        ]
+    
+    def gerar_relatorio_completo(self):
+        """Gera o relatório com as mesmas chaves de AnalisadorEntregas.gerar_relatorio_completo"""
+        inicio = time.perf_counter()
+        print("\n" + "="*60)
+        print("🚚 RELATÓRIO COMPLETO DE ANÁLISE (SQL) - EXPRESSO ITAPORANGA")
+        print("="*60)
+        print(f"Data da análise: {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}")
         
-        print(f"\n✅ Relatório salvo em: /home/ubuntu/relatorio_analise_completa.json")
+        with self.engine.connect() as conexao:
+            indicadores = self.indicadores(conexao)
+            if not indicadores.total:
+                print("Nenhuma entrega encontrada no período")
+                return None
+            print(f"Período analisado: {indicadores.primeira.strftime('%d/%m/%Y')} a {indicadores.ultima.strftime('%d/%m/%Y')}")
+            
+            resultados = {
+                'data_analise': datetime.now().isoformat(),
+                'total_entregas': indicadores.total,
+                'distribuicao_status': self.contagem(conexao, 'status'),
+                'distribuicao_produtos': self.contagem(conexao, 'tipo_produto'),
+                'rotas_principais': self.rotas(conexao),
+                'entregas_por_dia_semana': self.dias_semana(conexao),
+                'entregas_por_mes': self.meses(conexao),
+                'latencia_etapas': self.etapas(conexao),
+                'indicadores': {
+                    'taxa_sucesso': indicadores.entregues / indicadores.total * 100,
+                    'tempo_medio_processamento': float(indicadores.tempo_medio) if indicadores.tempo_medio is not None else None,
+                    'total_valor_declarado': float(indicadores.valor_total),
+                    'peso_total': float(indicadores.peso_total)
+                }
+            }
+        
+        print(f"Total de entregas: {indicadores.total}")
+        print(f"Taxa de sucesso: {resultados['indicadores']['taxa_sucesso']:.1f}%")
+        print(f"Agregações concluídas em {time.perf_counter() - inicio:.2f}s")
+        
+        salvar_relatorio(resultados)
         
+        print(f"\n✅ Relatório salvo em: {CAMINHO_RELATORIO}")
+        return resultados
+
+class AnalisadorIncremental:
+    """Mantém agregados parciais num arquivo de estado e só processa entregas novas ou alteradas"""
+    
+    # Releitura antes da marca d'água, para linhas gravadas por transações que confirmaram depois
+    MARGEM_RELEITURA = timedelta(minutes=5)
+    LOTE_ESTADO = 500
+    
+    def __init__(self, db_path=None, caminho_estado=CAMINHO_ESTADO_PADRAO, tamanho_lote=TAMANHO_LOTE_PADRAO):
+        self.engine = create_engine(url_banco(db_path))
+        self.tamanho_lote = tamanho_lote
+        self.estado = sqlite3.connect(caminho_estado)
+        # Última contribuição de cada entrega (status e tempo), para retirar quando ela mudar
+        self.estado.execute(
+            'CREATE TABLE IF NOT EXISTS contribuicao (id INTEGER PRIMARY KEY, status TEXT, tempo REAL)'
+        )
+        # Eventos já somados dentro da janela de releitura de status_evento
+        self.estado.execute('CREATE TABLE IF NOT EXISTS evento_contado (id INTEGER PRIMARY KEY, data_evento TEXT)')
+        self.estado.execute('CREATE TABLE IF NOT EXISTS agregado (chave TEXT PRIMARY KEY, valor TEXT)')
+        self.carregar_estado()
+    
+    def carregar_estado(self):
+        """Lê os agregados salvos (ou começa do zero)"""
+        linha = self.estado.execute("SELECT valor FROM agregado WHERE chave = 'estado'").fetchone()
+        dados = json.loads(linha[0]) if linha else {}
+        
+        self.marca_atualizacao = dados.get('marca_atualizacao')
+        self.marca_evento = dados.get('marca_evento')
+        self.total = dados.get('total', 0)
+        self.status = Counter(dados.get('status', {}))
+        self.produtos = Counter(dados.get('produtos', {}))
+        self.rotas = Counter(dados.get('rotas', {}))
+        self.dias_semana = Counter(dados.get('dias_semana', {}))
+        self.meses = Counter(dados.get('meses', {}))
+        self.somas = dados.get('somas', {'valor_declarado': 0.0, 'peso': 0.0})
+        self.tempo = Welford(*dados.get('tempo', []))
+        self.tempo_por_status = {status: Welford(*valores) for status, valores in dados.get('tempo_por_status', {}).items()}
+        self.etapas = {tuple(chave): valores for *chave, valores in dados.get('etapas', [])}
+        if 'ultimo_evento_id' in dados:
+            # Estado da versão que lia status_evento por id: as etapas são somadas de novo
+            self.etapas = {}
+    
+    def salvar_estado(self):
+        """Grava os agregados junto com as contribuições, na mesma transação"""
+        dados = {
+            'marca_atualizacao': self.marca_atualizacao,
+            'marca_evento': self.marca_evento,
+            'total': self.total,
+            'status': self.status,
+            'produtos': self.produtos,
+            'rotas': self.rotas,
+            'dias_semana': self.dias_semana,
+            'meses': self.meses,
+            'somas': self.somas,
+            'tempo': self.tempo.para_lista(),
+            'tempo_por_status': {status: w.para_lista() for status, w in self.tempo_por_status.items()},
+            'etapas': [[anterior, status, valores] for (anterior, status), valores in self.etapas.items()]
+        }
+        self.estado.execute(
+            "INSERT OR REPLACE INTO agregado (chave, valor) VALUES ('estado', ?)",
+            (json.dumps(dados, ensure_ascii=False),)
+        )
+        self.estado.commit()
+    
+    def contribuicoes_anteriores(self, ids):
+        """Status e tempo já contabilizados para as entregas informadas"""
+        anteriores = {}
+        for inicio in range(0, len(ids), self.LOTE_ESTADO):
+            bloco = ids[inicio:inicio + self.LOTE_ESTADO]
+            marcadores = ','.join('?' * len(bloco))
+            for id_entrega, status, tempo in self.estado.execute(
+                f'SELECT id, status, tempo FROM contribuicao WHERE id IN ({marcadores})', bloco
+            ):
+                anteriores[id_entrega] = (status, tempo)
+        return anteriores
+    
+    def aplicar_lote(self, linhas):
+        """Funde um lote de entregas novas ou alteradas nos agregados; devolve quantas não tinham as duas datas"""
+        anteriores = self.contribuicoes_anteriores([linha.id for linha in linhas])
+        contribuicoes = []
+        sem_datas = 0
+        
+        for linha in linhas:
+            # Sem uma das datas a entrega conta nos totais, mas fica fora do tempo (NaN no pandas)
+            tempo = None
+            if linha.data_criacao is not None and linha.data_atualizacao is not None:
+                tempo = (linha.data_atualizacao - linha.data_criacao).total_seconds() / 3600
+            anterior = anteriores.get(linha.id)
+            
+            if anterior is None:
+                # Entrega nova: campos que não mudam entram uma única vez
+                self.total += 1
+                if linha.tipo_produto is not None:
+                    self.produtos[linha.tipo_produto] += 1
+                if linha.remetente_cidade is not None and linha.destinatario_cidade is not None:
+                    self.rotas[f'{linha.remetente_cidade} → {linha.destinatario_cidade}'] += 1
+                if linha.data_criacao is not None:
+                    self.dias_semana[DIAS_SEMANA[linha.data_criacao.weekday()]] += 1
+                    self.meses[linha.data_criacao.strftime('%Y-%m')] += 1
+                for campo in ('valor_declarado', 'peso'):
+                    if getattr(linha, campo) is not None:
+                        self.somas[campo] += getattr(linha, campo)
+            else:
+                # Entrega alterada: retirar a contribuição anterior de status e tempo
+                status_anterior, tempo_anterior = anterior
+                if status_anterior is not None:
+                    self.status[status_anterior] -= 1
+                if tempo_anterior is not None:
+                    self.tempo.remover(tempo_anterior)
+                    if status_anterior is not None:
+                        self.tempo_por_status[status_anterior].remover(tempo_anterior)
+            
+            if linha.status is not None:
+                self.status[linha.status] += 1
+            if tempo is None:
+                sem_datas += 1
+            else:
+                self.tempo.adicionar(tempo)
+                if linha.status is not None:
+                    self.tempo_por_status.setdefault(linha.status, Welford()).adicionar(tempo)
+            contribuicoes.append((linha.id, linha.status, tempo))
+            
+            # Entregas sem data_atualizacao não avançam a marca (e só são lidas na primeira execução)
+            if linha.data_atualizacao is not None:
+                marca = linha.data_atualizacao.isoformat()
+                if self.marca_atualizacao is None or marca > self.marca_atualizacao:
+                    self.marca_atualizacao = marca
+        
+        self.estado.executemany('INSERT OR REPLACE INTO contribuicao (id, status, tempo) VALUES (?, ?, ?)', contribuicoes)
+        return sem_datas
+    
+    def eventos_contados(self, ids):
+        """Ids de status_evento já somados nas etapas"""
+        contados = set()
+        for inicio in range(0, len(ids), self.LOTE_ESTADO):
+            bloco = ids[inicio:inicio + self.LOTE_ESTADO]
+            marcadores = ','.join('?' * len(bloco))
+            contados.update(id_evento for (id_evento,) in self.estado.execute(
+                f'SELECT id FROM evento_contado WHERE id IN ({marcadores})', bloco
+            ))
+        return contados
+    
+    def atualizar_etapas(self, conexao):
+        """Soma os eventos desde a marca d'água de data_evento
+        
+        Ids de sequência são alocados antes do commit: um evento com id menor pode aparecer depois
+        de outros. Por isso a releitura é por data, com a mesma margem das entregas, e os ids já
+        somados dentro da janela ficam em evento_contado.
+        """
+        if not inspect(conexao).has_table('status_evento'):
+            return
+        
+        condicao = ''
+        parametros = {}
+        if self.marca_evento:
+            condicao = 'WHERE data_evento >= :marca'
+            parametros['marca'] = datetime.fromisoformat(self.marca_evento) - self.MARGEM_RELEITURA
+        
+        consulta = text(f"""
+            SELECT id, status_anterior, status, duracao_segundos, data_evento
+            FROM status_evento
+            {condicao}
+        """).bindparams(*(bindparam(nome, type_=DateTime()) for nome in parametros)).columns(
+            data_evento=DateTime()
+        )
+        
+        for linhas in conexao.execute(consulta, parametros).partitions(self.tamanho_lote):
+            contados = self.eventos_contados([linha.id for linha in linhas])
+            novos = []
+            for linha in linhas:
+                if linha.id in contados:
+                    continue
+                valores = self.etapas.setdefault((linha.status_anterior, linha.status), [0, 0, 0.0])
+                valores[0] += 1
+                if linha.duracao_segundos is not None:
+                    valores[1] += 1
+                    valores[2] += float(linha.duracao_segundos)
+                
+                data = linha.data_evento.isoformat()
+                novos.append((linha.id, data))
+                if self.marca_evento is None or data > self.marca_evento:
+                    self.marca_evento = data
+            self.estado.executemany('INSERT INTO evento_contado (id, data_evento) VALUES (?, ?)', novos)
+        
+        # Eventos anteriores à janela não são relidos: os ids deixam de ser necessários
+        if self.marca_evento:
+            limite = datetime.fromisoformat(self.marca_evento) - self.MARGEM_RELEITURA
+            self.estado.execute('DELETE FROM evento_contado WHERE data_evento < ?', (limite.isoformat(),))
+    
+    def atualizar(self):
+        """Lê só as entregas alteradas desde a última execução e funde nos agregados"""
+        inicio = time.perf_counter()
+        condicao = ''
+        parametros = {}
+        if self.marca_atualizacao:
+            condicao = 'WHERE data_atualizacao >= :marca'
+            parametros['marca'] = datetime.fromisoformat(self.marca_atualizacao) - self.MARGEM_RELEITURA
+        
+        consulta = text(f"""
+            SELECT id, remetente_cidade, destinatario_cidade, tipo_produto, peso, valor_declarado,
+                   status, data_criacao, data_atualizacao
+            FROM entrega
+            {condicao}
+        """).bindparams(*(bindparam(nome, type_=DateTime()) for nome in parametros)).columns(
+            data_criacao=DateTime(), data_atualizacao=DateTime()
+        )
+        
+        processadas = 0
+        sem_datas = 0
+        with self.engine.connect().execution_options(stream_results=True) as conexao:
+            for linhas in conexao.execute(consulta, parametros).partitions(self.tamanho_lote):
+                sem_datas += self.aplicar_lote(linhas)
+                processadas += len(linhas)
+            self.atualizar_etapas(conexao)
+        
+        self.salvar_estado()
+        if sem_datas:
+            print(f"⚠️  {sem_datas} entregas sem data de criação ou atualização ficaram fora do tempo de processamento")
+        print(f"✅ {processadas} entregas novas ou alteradas processadas em {time.perf_counter() - inicio:.2f}s")
+        return processadas
+    
+    def gerar_relatorio(self):
+        """Relatório com as mesmas chaves de AnalisadorEntregas.gerar_relatorio_completo"""
+        self.atualizar()
+        
+        positivos = lambda contador: {chave: total for chave, total in contador.most_common() if total > 0}
+        entregues = self.status.get('entregue', 0)
+        
+        resultados = {
+            'data_analise': datetime.now().isoformat(),
+            'total_entregas': self.total,
+            'distribuicao_status': positivos(self.status),
+            'distribuicao_produtos': positivos(self.produtos),
+            # Empates em ordem alfabética, como em AnalisadorEntregas e AnalisadorSQL
+            'rotas_principais': dict(sorted(positivos(self.rotas).items(), key=lambda rota: (-rota[1], rota[0]))[:5]),
+            'entregas_por_dia_semana': positivos(self.dias_semana),
+            'entregas_por_mes': dict(sorted(positivos(self.meses).items())),
+            'latencia_etapas': [
+                {
+                    'status_anterior': anterior,
+                    'status': status,
+                    'total': total,
+                    'media_horas': round(soma / com_duracao / 3600, 2) if com_duracao else None
+                }
+                for (anterior, status), (total, com_duracao, soma) in self.etapas.items()
+            ],
+            'tempo_por_status': {
+                status: {'total': w.n, 'media': round(w.media, 2), 'desvio': round(w.desvio(), 2) if w.desvio() is not None else None}
+                for status, w in self.tempo_por_status.items() if w.n > 0
+            },
+            'indicadores': {
+                'taxa_sucesso': (entregues / self.total * 100) if self.total else 0,
+                'tempo_medio_processamento': self.tempo.media,
+                'total_valor_declarado': self.somas['valor_declarado'],
+                'peso_total': self.somas['peso']
+            }
+        }
+        
+        salvar_relatorio(resultados)
+        
+        print(f"✅ Relatório incremental salvo em: {CAMINHO_RELATORIO}")
         return resultados
 
 def main():
     """Função principal"""
-    db_path = '/home/ubuntu/site_integrado_expresso/src/instance/expresso_itaporanga.db'
+    parser = argparse.ArgumentParser(description='Análise avançada das entregas')
+    parser.add_argument('--db', help='Caminho do SQLite ou URL do banco (padrão: DATABASE_URL)')
+    parser.add_argument('--inicio', help='Data inicial (AAAA-MM-DD)')
+    parser.add_argument('--fim', help='Data final, inclusiva (AAAA-MM-DD)')
+    parser.add_argument('--lote', type=int, default=TAMANHO_LOTE_PADRAO, help='Linhas lidas por lote')
+    parser.add_argument('--snapshot', nargs='?', const=CAMINHO_SNAPSHOT_PADRAO,
+                        help='Ler as entregas do snapshot Parquet em vez do banco (exportar_snapshot_entregas.py)')
+    parser.add_argument('--sql', action='store_true',
+                        help='Agregar no banco (GROUP BY) em vez de carregar as entregas no pandas')
+    parser.add_argument('--incremental', action='store_true',
+                        help='Processar só as entregas novas ou alteradas desde a última execução')
+    parser.add_argument('--estado', default=CAMINHO_ESTADO_PADRAO, help='Arquivo de estado da análise incremental')
+    parser.add_argument('--reconstruir', action='store_true',
+                        help='Descartar o estado e reprocessar todo o histórico (modo incremental)')
+    args = parser.parse_args()
     
-    if not os.path.exists(db_path):
+    db_url = url_banco(args.db)
+    db_path = db_url[len('sqlite:///'):] if db_url.startswith('sqlite:///') else None
+    if db_path and not args.snapshot and not os.path.exists(db_path):
         print(f"❌ Banco de dados não encontrado: {db_path}")
         return
     
-    # Criar analisador
-    analisador = AnalisadorEntregas(db_path)
-    
-    # Gerar relatório completo
-    resultados = analisador.gerar_relatorio_completo()
+    if args.incremental:
+        if args.inicio or args.fim:
+            print("⚠️  --inicio/--fim são ignorados no modo incremental (agregados de todo o histórico)")
+        if args.reconstruir and os.path.exists(args.estado):
+            os.remove(args.estado)
+        analisador = AnalisadorIncremental(db_url, caminho_estado=args.estado, tamanho_lote=args.lote)
+        resultados = analisador.gerar_relatorio()
+    elif args.sql:
+        analisador = AnalisadorSQL(db_url, data_inicio=args.inicio, data_fim=args.fim)
+        resultados = analisador.gerar_relatorio_completo()
+    else:
+        # Criar analisador
+        analisador = AnalisadorEntregas(db_url, data_inicio=args.inicio, data_fim=args.fim, tamanho_lote=args.lote,
+                                        snapshot=args.snapshot)
+        
+        # Gerar relatório completo
+        resultados = analisador.gerar_relatorio_completo()
     
     print("\n🎯 ANÁLISE CONCLUÍDA COM SUCESSO!")
     print("Todos os dados foram processados e o relatório foi gerado.")
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark da análise de entregas - Expresso Itaporanga
+Compara a agregação no pandas (AnalisadorEntregas) com a agregação no banco (AnalisadorSQL)
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'src'))
+
+from sqlalchemy import create_engine
+
+from app import db, Entrega
+from benchmark_pool import url_benchmark
+import analise_avancada_entregas as analise
+
+CIDADES = ['Recife - PE', 'São Paulo - SP', 'Itaporanga - PB', 'Patos - PB', 'João Pessoa - PB',
+           'Natal - RN', 'Campina Grande - PB', 'Fortaleza - CE']
+PRODUTOS = ['Eletrônicos', 'Roupas', 'Documentos', 'Medicamentos', 'Alimentos']
+STATUS = ['pendente', 'coletado', 'em_transito', 'entregue', 'cancelado']
+LOTE_INSERCAO = 50000
+
+def gerar_entregas(url, quantidade, semente=42):
+    """Cria a tabela entrega com `quantidade` entregas aleatórias ao longo de ~13 meses"""
+    engine = create_engine(url)
+    db.metadata.create_all(engine)
+    aleatorio = random.Random(semente)
+    base = datetime(2024, 1, 1)
+
+    with engine.begin() as conexao:
+        conexao.execute(Entrega.__table__.delete())
+        for inicio in range(0, quantidade, LOTE_INSERCAO):
+            linhas = []
+            for i in range(inicio, min(inicio + LOTE_INSERCAO, quantidade)):
+                criacao = base + timedelta(minutes=aleatorio.randint(0, 60 * 24 * 400))
+                linhas.append({
+                    'codigo_rastreamento': f'EI{i:010d}',
+                    'remetente_nome': 'Remetente',
+                    'remetente_endereco': 'Rua A, 1',
+                    'remetente_cidade': aleatorio.choice(CIDADES),
+                    'destinatario_nome': 'Destinatário',
+                    'destinatario_endereco': 'Rua B, 2',
+                    'destinatario_cidade': aleatorio.choice(CIDADES),
+                    'tipo_produto': aleatorio.choice(PRODUTOS),
+                    'peso': round(aleatorio.uniform(0.1, 30), 2),
+                    'valor_declarado': round(aleatorio.uniform(10, 5000), 2),
+                    'status': aleatorio.choice(STATUS),
+                    'data_criacao': criacao,
+                    'data_atualizacao': criacao + timedelta(minutes=aleatorio.randint(0, 60 * 24 * 10))
+                })
+            conexao.execute(Entrega.__table__.insert(), linhas)
+    engine.dispose()
+
+def pico_memoria_mb():
+    """Pico de memória residente do processo (ru_maxrss é em KB no Linux)"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def medir(nome, gerar):
+    """Executa a análise sem a saída no terminal e devolve o relatório"""
+    inicio = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        resultados = gerar()
+    decorrido = time.perf_counter() - inicio
+    print(f"{nome:<28} {decorrido:>9.2f}s {pico_memoria_mb():>12.0f} MB")
+    return resultados
+
+def main():
+    """Função principal"""
+    parser = argparse.ArgumentParser(description='Benchmark da análise de entregas (pandas x SQL)')
+    parser.add_argument('--url', help='URL de um banco descartável (padrão: SQLite temporário)')
+    parser.add_argument('--apagar-dados', action='store_true',
+                        help='Confirma que as entregas do banco de --url podem ser apagadas')
+    parser.add_argument('--entregas', type=int, default=1000000, help='Entregas sintéticas')
+    parser.add_argument('--sem-carga', action='store_true',
+                        help='Só ler as entregas já existentes no banco de --url (não apaga nada)')
+    args = parser.parse_args()
+
+    diretorio = tempfile.mkdtemp()
+    if args.sem_carga:
+        if not args.url:
+            parser.error('--sem-carga exige --url')
+        url = analise.url_banco(args.url)
+    else:
+        url = analise.url_banco(url_benchmark(args.url, args.apagar_dados, 'benchmark_analise'))
+    # O relatório JSON do benchmark não substitui o da análise real
+    analise.CAMINHO_RELATORIO = os.path.join(diretorio, 'relatorio.json')
+
+    print("🚀 Benchmark da análise de entregas")
+    if not args.sem_carga:
+        inicio = time.perf_counter()
+        gerar_entregas(url, args.entregas)
+        print(f"   {args.entregas} entregas geradas em {time.perf_counter() - inicio:.1f}s")
+
+    # SQL primeiro: o pico de memória só cresce, então o segundo valor inclui o pandas
+    print(f"\n{'backend':<28} {'tempo':>10} {'pico de RSS':>15}")
+    sql = medir('SQL (GROUP BY no banco)', lambda: analise.AnalisadorSQL(url).gerar_relatorio_completo())
+    pandas = medir('pandas (linhas em lotes)', lambda: analise.AnalisadorEntregas(url).gerar_relatorio_completo())
+
+    divergentes = [chave for chave in pandas if chave not in ('data_analise', 'indicadores', 'rotas_principais')
+                   and pandas[chave] != sql[chave]]
+    if sorted(pandas['rotas_principais'].values()) != sorted(sql['rotas_principais'].values()):
+        divergentes.append('rotas_principais')
+    if divergentes:
+        print(f"\n⚠️  Resultados divergentes em: {', '.join(divergentes)}")
+    else:
+        print("\n✅ Os dois backends produziram o mesmo relatório")
+
+if __name__ == "__main__":
+    main()
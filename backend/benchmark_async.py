@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark de concorrência do rastreamento - Expresso Itaporanga
+Compara um worker gunicorn gthread (Flask) com um worker uvicorn (app_async)
+sob muitas conexões keep-alive consultando /api/rastrear/<codigo>
+"""
+
+import argparse
+import asyncio
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'src'))
+
+from benchmark_pool import preparar_banco, url_benchmark
+
+DIRETORIO = os.path.dirname(os.path.abspath(__file__))
+
+SERVIDORES = {
+    'sync (gunicorn gthread, 8 threads)': [
+        sys.executable, '-m', 'gunicorn', '--workers', '1', '--worker-class', 'gthread',
+        '--threads', '8', '--bind', '127.0.0.1:{porta}', '--log-level', 'warning', 'src.app:app'
+    ],
+    'async (uvicorn, app_async)': [
+        sys.executable, '-m', 'uvicorn', '--workers', '1', '--host', '127.0.0.1', '--port', '{porta}',
+        '--log-level', 'warning', '--no-access-log', 'src.app:app_async'
+    ]
+}
+
+def porta_livre():
+    """Porta TCP livre em localhost"""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def iniciar_servidor(comando, porta, ambiente):
+    """Sobe o servidor e espera a porta aceitar conexões"""
+    processo = subprocess.Popen([parte.format(porta=porta) for parte in comando], cwd=DIRETORIO,
+                                env=ambiente, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    limite = time.time() + 30
+    while time.time() < limite:
+        try:
+            with socket.create_connection(('127.0.0.1', porta), timeout=0.5):
+                return processo
+        except OSError:
+            time.sleep(0.2)
+    processo.kill()
+    raise RuntimeError(f'Servidor não respondeu na porta {porta}')
+
+async def cliente(porta, codigos, fim, latencias, erros):
+    """Conexão keep-alive que consulta códigos em sequência até o fim do cenário"""
+    try:
+        leitor, escritor = await asyncio.open_connection('127.0.0.1', porta)
+    except OSError:
+        erros.append(1)
+        return
+
+    i = 0
+    try:
+        while time.perf_counter() < fim:
+            codigo = codigos[i % len(codigos)]
+            i += 1
+            inicio = time.perf_counter()
+            escritor.write(f'GET /api/rastrear/{codigo} HTTP/1.1\r\nHost: localhost\r\n\r\n'.encode())
+            await escritor.drain()
+
+            cabecalhos = await leitor.readuntil(b'\r\n\r\n')
+            tamanho = 0
+            for linha in cabecalhos.split(b'\r\n'):
+                if linha.lower().startswith(b'content-length:'):
+                    tamanho = int(linha.split(b':')[1])
+            await leitor.readexactly(tamanho)
+
+            if not cabecalhos.startswith(b'HTTP/1.1 200'):
+                erros.append(1)
+            latencias.append(time.perf_counter() - inicio)
+    except (OSError, asyncio.IncompleteReadError):
+        erros.append(1)
+    finally:
+        escritor.close()
+
+async def executar_cenario(porta, conexoes, duracao, codigos):
+    """Abre `conexoes` clientes simultâneos e mede vazão e latência"""
+    latencias = []
+    erros = []
+    inicio = time.perf_counter()
+    fim = inicio + duracao
+    await asyncio.gather(*(cliente(porta, codigos[n:] + codigos[:n], fim, latencias, erros)
+                           for n in range(conexoes)))
+    decorrido = time.perf_counter() - inicio
+
+    latencias.sort()
+    return {
+        'vazao': len(latencias) / decorrido,
+        'p50_ms': statistics.median(latencias) * 1000 if latencias else 0,
+        'p95_ms': latencias[int(len(latencias) * 0.95)] * 1000 if latencias else 0,
+        'erros': len(erros)
+    }
+
+def main():
+    """Função principal"""
+    parser = argparse.ArgumentParser(description='Benchmark de concorrência do rastreamento')
+    parser.add_argument('--url', help='URL de um banco descartável (padrão: SQLite temporário)')
+    parser.add_argument('--apagar-dados', action='store_true',
+                        help='Confirma que as entregas do banco de --url podem ser apagadas')
+    parser.add_argument('--conexoes', default='8,64,256', help='Conexões simultâneas por cenário')
+    parser.add_argument('--duracao', type=float, default=5, help='Segundos por cenário')
+    parser.add_argument('--entregas', type=int, default=10000, help='Entregas sintéticas')
+    args = parser.parse_args()
+
+    url = url_benchmark(args.url, args.apagar_dados, 'benchmark_async')
+    preparar_banco(url, args.entregas)
+
+    # Sem cache de rastreamento: toda requisição vai ao banco
+    ambiente = dict(os.environ, DATABASE_URL=url, RASTREIO_CACHE_TTL='0', RASTREIO_CACHE_TTL_NEGATIVO='0')
+    codigos = [f'EI{i:010d}' for i in range(0, args.entregas, max(args.entregas // 1000, 1))]
+
+    print("🚀 Benchmark de concorrência do rastreamento (1 worker)")
+    for nome, comando in SERVIDORES.items():
+        porta = porta_livre()
+        processo = iniciar_servidor(comando, porta, ambiente)
+        try:
+            print(f"\n📊 {nome}")
+            print(f"{'conexões':>9} {'req/s':>10} {'p50':>10} {'p95':>10} {'erros':>7}")
+            for conexoes in [int(c) for c in args.conexoes.split(',')]:
+                resultado = asyncio.run(executar_cenario(porta, conexoes, args.duracao, codigos))
+                print(f"{conexoes:>9} {resultado['vazao']:>10.1f} {resultado['p50_ms']:>8.2f}ms "
+                      f"{resultado['p95_ms']:>8.2f}ms {resultado['erros']:>7}")
+        finally:
+            processo.terminate()
+            processo.wait()
+
+    print("\n✅ Benchmark concluído")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Teste de carga do pool de conexões - Expresso Itaporanga
+Mede a vazão da consulta de rastreamento com diferentes tamanhos de pool
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'src'))
+
+from sqlalchemy import create_engine, text
+
+from app import db, Entrega, opcoes_engine
+
+CONSULTA_RASTREIO = text(
+    'SELECT codigo_rastreamento, status, data_atualizacao FROM entrega WHERE codigo_rastreamento = :codigo'
+)
+
+def url_benchmark(url, confirmar, nome):
+    """SQLite temporário por padrão; um banco existente só com --url e --apagar-dados explícitos"""
+    if not url:
+        return 'sqlite:///' + os.path.join(tempfile.mkdtemp(), f'{nome}.db')
+    if not confirmar:
+        sys.exit(f"❌ O benchmark apaga todas as entregas de {url}. "
+                 "Use --apagar-dados para confirmar (nunca num banco de produção).")
+    if url.startswith('postgres://'):
+        url = url.replace('postgres://', 'postgresql://', 1)
+    return url
+
+def preparar_banco(url, quantidade):
+    """Cria a tabela entrega e insere entregas sintéticas"""
+    engine = create_engine(url)
+    db.metadata.create_all(engine)
+    agora = datetime.utcnow()
+    with engine.begin() as conexao:
+        conexao.execute(Entrega.__table__.delete())
+        conexao.execute(Entrega.__table__.insert(), [{
+            'codigo_rastreamento': f'EI{i:010d}',
+            'remetente_nome': 'Remetente',
+            'remetente_endereco': 'Rua A, 1',
+            'remetente_cidade': 'Recife - PE',
+            'destinatario_nome': 'Destinatário',
+            'destinatario_endereco': 'Rua B, 2',
+            'destinatario_cidade': 'Itaporanga - PB',
+            'tipo_produto': 'Documentos',
+            'status': 'em_transito',
+            'data_criacao': agora,
+            'data_atualizacao': agora
+        } for i in range(quantidade)])
+    engine.dispose()
+
+def executar_carga(url, tamanho_pool, threads, duracao, latencia, quantidade):
+    """Dispara consultas concorrentes por `duracao` segundos e retorna as métricas do pool"""
+    engine = create_engine(url, **opcoes_engine(url, pool_size=tamanho_pool, max_overflow=0))
+    concluidas = [0] * threads
+    fim = time.perf_counter() + duracao
+
+    def trabalhador(indice):
+        i = indice
+        while time.perf_counter() < fim:
+            with engine.connect() as conexao:
+                conexao.execute(CONSULTA_RASTREIO, {'codigo': f'EI{i % quantidade:010d}'}).first()
+                # Simula a latência de rede até o Postgres com a conexão ainda emprestada
+                if latencia:
+                    time.sleep(latencia)
+            concluidas[indice] += 1
+            i += threads
+
+    trabalhadores = [threading.Thread(target=trabalhador, args=(n,)) for n in range(threads)]
+    inicio = time.perf_counter()
+    for t in trabalhadores:
+        t.start()
+    for t in trabalhadores:
+        t.join()
+    decorrido = time.perf_counter() - inicio
+
+    metricas = engine.pool.metricas()
+    engine.dispose()
+    total = sum(concluidas)
+    return {
+        'requisicoes': total,
+        'vazao': total / decorrido,
+        'espera_media_ms': metricas['espera_total_segundos'] / max(metricas['esperas'], 1) * 1000,
+        'espera_maxima_ms': metricas['espera_maxima_segundos'] * 1000
+    }
+
+def main():
+    """Função principal"""
+    parser = argparse.ArgumentParser(description='Teste de carga do pool de conexões')
+    parser.add_argument('--url', help='URL de um banco descartável (padrão: SQLite temporário)')
+    parser.add_argument('--apagar-dados', action='store_true',
+                        help='Confirma que as entregas do banco de --url podem ser apagadas')
+    parser.add_argument('--pools', default='1,2,5,10,20', help='Tamanhos de pool separados por vírgula')
+    parser.add_argument('--threads', type=int, default=32, help='Requisições concorrentes')
+    parser.add_argument('--duracao', type=float, default=5, help='Segundos por cenário')
+    parser.add_argument('--latencia-ms', type=float, default=2, help='Latência simulada por consulta')
+    parser.add_argument('--entregas', type=int, default=10000, help='Entregas sintéticas')
+    args = parser.parse_args()
+
+    url = url_benchmark(args.url, args.apagar_dados, 'benchmark_pool')
+
+    print("🚀 Teste de carga do pool de conexões")
+    print(f"   {args.threads} threads, {args.duracao}s por cenário, latência simulada {args.latencia_ms}ms")
+    preparar_banco(url, args.entregas)
+
+    print(f"\n{'pool':>6} {'req/s':>10} {'espera média':>14} {'espera máx':>12}")
+    for tamanho in [int(p) for p in args.pools.split(',')]:
+        resultado = executar_carga(url, tamanho, args.threads, args.duracao,
+                                   args.latencia_ms / 1000, args.entregas)
+        print(f"{tamanho:>6} {resultado['vazao']:>10.1f} "
+              f"{resultado['espera_media_ms']:>12.2f}ms {resultado['espera_maxima_ms']:>10.2f}ms")
+
+    print("\n✅ Teste concluído")
+
+if __name__ == "__main__":
+    main()
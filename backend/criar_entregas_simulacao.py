@@ -8,7 +8,7 @@ import sys
 import os
 sys.path.append('/home/ubuntu/site_integrado_expresso/src')
 
-from app import app, db, Entrega
+from app import app, db, Entrega, reconstruir_estatistica_diaria
 from datetime import datetime, timedelta
 import random
 
@@ -184,6 +184,9 @@ def criar_entregas_simulacao():
         
         # Salvar todas as entregas
         try:
+            db.session.commit()
+            # A tabela foi limpa em lote: garantir o rollup de estatísticas igual às entregas
+            reconstruir_estatistica_diaria(db.session.connection())
             db.session.commit()
             print(f"\n🎉 {entregas_criadas} entregas de simulação criadas com sucesso!")
             
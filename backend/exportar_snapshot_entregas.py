@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Exportação do snapshot Parquet das entregas - Expresso Itaporanga
+Grava entrega e status_evento particionados por mês (mes=AAAA-MM), para a análise
+ler sem consultar o banco de produção
+"""
+
+import argparse
+import json
+import os
+import shutil
+import time
+from datetime import datetime, timedelta
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from sqlalchemy import create_engine, text, bindparam, DateTime
+
+from analise_avancada_entregas import (url_banco, filtro_periodo, consulta_com_periodo, MES_DIALETO,
+                                       CAMINHO_SNAPSHOT_PADRAO, TAMANHO_LOTE_PADRAO)
+
+CATEGORIA = pa.dictionary(pa.int32(), pa.string())
+
+# Só as colunas usadas na análise: nomes e endereços dos clientes ficam fora do snapshot
+TABELAS_SNAPSHOT = {
+    'entrega': {
+        'coluna_data': 'data_criacao',
+        'esquema': pa.schema([
+            ('id', pa.int64()),
+            ('remetente_cidade', CATEGORIA),
+            ('destinatario_cidade', CATEGORIA),
+            ('tipo_produto', CATEGORIA),
+            ('peso', pa.float64()),
+            ('valor_declarado', pa.float64()),
+            ('status', CATEGORIA),
+            ('data_criacao', pa.timestamp('us')),
+            ('data_atualizacao', pa.timestamp('us'))
+        ])
+    },
+    'status_evento': {
+        'coluna_data': 'data_evento',
+        'esquema': pa.schema([
+            ('id', pa.int64()),
+            ('entrega_id', pa.int64()),
+            ('status_anterior', CATEGORIA),
+            ('status', CATEGORIA),
+            ('data_evento', pa.timestamp('us')),
+            ('duracao_segundos', pa.float64())
+        ])
+    }
+}
+
+ARQUIVO_MANIFESTO = '_snapshot.json'
+
+class ExportadorSnapshot:
+    """Reexporta só os meses cujas entregas mudaram desde o último snapshot"""
+
+    # Releitura antes da marca d'água, para linhas gravadas por transações que confirmaram depois
+    MARGEM_RELEITURA = timedelta(minutes=5)
+
+    def __init__(self, db_path=None, destino=CAMINHO_SNAPSHOT_PADRAO, tamanho_lote=TAMANHO_LOTE_PADRAO):
+        self.engine = create_engine(url_banco(db_path))
+        self.destino = destino
+        self.tamanho_lote = tamanho_lote
+        self.manifesto = self.carregar_manifesto()
+
+    def carregar_manifesto(self):
+        """Marca d'água e total de linhas por mês do último snapshot"""
+        caminho = os.path.join(self.destino, ARQUIVO_MANIFESTO)
+        if not os.path.exists(caminho):
+            return {'tabelas': {}}
+        with open(caminho, encoding='utf-8') as f:
+            return json.load(f)
+
+    def salvar_manifesto(self):
+        """Grava o manifesto de forma atômica, depois das partições"""
+        caminho = os.path.join(self.destino, ARQUIVO_MANIFESTO)
+        with open(caminho + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(self.manifesto, f, indent=2, ensure_ascii=False)
+        os.replace(caminho + '.tmp', caminho)
+
+    def expressao_mes(self, coluna):
+        return MES_DIALETO.get(self.engine.dialect.name, MES_DIALETO['postgresql']).format(coluna=coluna)
+
+    def contagem_por_mes(self, conexao, tabela):
+        """Linhas por mês no banco: meses com total diferente do manifesto são reexportados"""
+        mes = self.expressao_mes(TABELAS_SNAPSHOT[tabela]['coluna_data'])
+        linhas = conexao.execute(text(f'SELECT {mes} AS mes, COUNT(*) FROM {tabela} GROUP BY mes')).all()
+        return {mes: total for mes, total in linhas if mes is not None}
+
+    def meses_atualizados(self, conexao, marca):
+        """Meses com entregas alteradas (mudança de status) desde a marca d'água"""
+        consulta = text(f"""
+            SELECT DISTINCT {self.expressao_mes('data_criacao')}
+            FROM entrega
+            WHERE data_atualizacao >= :marca
+        """).bindparams(bindparam('marca', type_=DateTime()))
+        limite = datetime.fromisoformat(marca) - self.MARGEM_RELEITURA
+        return {mes for (mes,) in conexao.execute(consulta, {'marca': limite}) if mes is not None}
+
+    def caminho_particao(self, tabela, mes):
+        return os.path.join(self.destino, tabela, f'mes={mes}')
+
+    def exportar_mes(self, conexao, tabela, mes):
+        """Regrava a partição do mês em lotes; o arquivo só substitui o anterior no final"""
+        config = TABELAS_SNAPSHOT[tabela]
+        esquema = config['esquema']
+        periodo = pd.Period(mes, freq='M')
+        where, parametros = filtro_periodo(config['coluna_data'], periodo.start_time, periodo.end_time)
+        consulta = consulta_com_periodo(f'SELECT {", ".join(esquema.names)} FROM {tabela} {where}', parametros)
+
+        particao = self.caminho_particao(tabela, mes)
+        os.makedirs(particao, exist_ok=True)
+        arquivo = os.path.join(particao, 'dados.parquet')
+        datas = [campo.name for campo in esquema if pa.types.is_timestamp(campo.type)]
+        linhas = 0
+        with pq.ParquetWriter(arquivo + '.tmp', esquema, compression='zstd') as escritor:
+            for lote in pd.read_sql_query(consulta, conexao, params=parametros, chunksize=self.tamanho_lote,
+                                          parse_dates=datas):
+                escritor.write_table(pa.Table.from_pandas(lote, schema=esquema, preserve_index=False))
+                linhas += len(lote)
+        os.replace(arquivo + '.tmp', arquivo)
+        return linhas
+
+    def exportar(self, completo=False):
+        """Exporta as tabelas do snapshot; sem `completo`, só os meses alterados"""
+        inicio = time.perf_counter()
+        if completo:
+            self.manifesto = {'tabelas': {}}
+            for tabela in TABELAS_SNAPSHOT:
+                shutil.rmtree(os.path.join(self.destino, tabela), ignore_errors=True)
+        os.makedirs(self.destino, exist_ok=True)
+
+        conexao = self.engine.connect()
+        if self.engine.dialect.name == 'postgresql':
+            # Todas as consultas do snapshot enxergam o mesmo estado do banco
+            conexao = conexao.execution_options(isolation_level='REPEATABLE READ')
+
+        resumo = {}
+        with conexao:
+            marca = conexao.execute(text('SELECT MAX(data_atualizacao) AS marca FROM entrega').columns(
+                marca=DateTime())).scalar()
+            for tabela in TABELAS_SNAPSHOT:
+                anteriores = self.manifesto['tabelas'].get(tabela, {})
+                atuais = self.contagem_por_mes(conexao, tabela)
+                alterados = {mes for mes, total in atuais.items() if anteriores.get(mes) != total}
+                if tabela == 'entrega' and self.manifesto.get('marca_atualizacao'):
+                    alterados |= self.meses_atualizados(conexao, self.manifesto['marca_atualizacao']) & atuais.keys()
+
+                linhas = sum(self.exportar_mes(conexao, tabela, mes) for mes in sorted(alterados))
+                # Meses que deixaram de ter linhas (entregas removidas)
+                for mes in anteriores.keys() - atuais.keys():
+                    shutil.rmtree(self.caminho_particao(tabela, mes), ignore_errors=True)
+
+                self.manifesto['tabelas'][tabela] = dict(sorted(atuais.items()))
+                resumo[tabela] = (len(alterados), linhas)
+
+        self.manifesto['marca_atualizacao'] = marca.isoformat() if marca else None
+        self.manifesto['gerado_em'] = datetime.now().isoformat()
+        self.salvar_manifesto()
+
+        for tabela, (meses, linhas) in resumo.items():
+            print(f"   {tabela:<14}: {meses} meses reexportados ({linhas} linhas)")
+        print(f"✅ Snapshot atualizado em {self.destino} ({time.perf_counter() - inicio:.2f}s)")
+        return resumo
+
+def main():
+    """Função principal"""
+    parser = argparse.ArgumentParser(description='Exporta o snapshot Parquet das entregas para a análise')
+    parser.add_argument('--db', help='Caminho do SQLite ou URL do banco (padrão: DATABASE_URL)')
+    parser.add_argument('--destino', default=CAMINHO_SNAPSHOT_PADRAO, help='Diretório do snapshot')
+    parser.add_argument('--lote', type=int, default=TAMANHO_LOTE_PADRAO, help='Linhas lidas por lote')
+    parser.add_argument('--completo', action='store_true', help='Descartar o snapshot e exportar todos os meses')
+    args = parser.parse_args()
+
+    print("📦 Exportando snapshot Parquet das entregas")
+    ExportadorSnapshot(args.db, args.destino, args.lote).exportar(completo=args.completo)
+
+if __name__ == "__main__":
+    main()
@@ -4,28 +4,52 @@ Gerador de Gráficos - Análise Expresso Itaporanga
 Cria visualizações gráficas dos dados de entregas
 """
 
+import argparse
+import hashlib
 import json
-import matplotlib.pyplot as plt
-import numpy as np
-from datetime import datetime
 import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import matplotlib
+matplotlib.use('Agg')
+import numpy as np
+from matplotlib.figure import Figure
+
+CAMINHO_DADOS_PADRAO = '/home/ubuntu/relatorio_analise_completa.json'
+DIRETORIO_SAIDA_PADRAO = '/home/ubuntu/site_integrado_expresso/graficos_analise'
+DPI_PADRAO = 300
+
+# Hash dos dados de cada gráfico na última renderização
+ARQUIVO_HASHES = '_hashes.json'
+
+# Código deste módulo inteiro (funções de gráfico e auxiliares como rotacionar_rotulos) e versão
+# do matplotlib: qualquer mudança invalida os gráficos já renderizados
+with open(__file__, 'rb') as _arquivo:
+    VERSAO_CODIGO = f'{hashlib.sha256(_arquivo.read()).hexdigest()}|{matplotlib.__version__}'
+
+# Aplicado com rc_context em cada renderização, sem mexer no estado global do pyplot
+ESTILO = {
+    'figure.figsize': (12, 8),
+    'font.size': 10,
+    'axes.titlesize': 14,
+    'axes.labelsize': 12,
+    'xtick.labelsize': 10,
+    'ytick.labelsize': 10,
+    'legend.fontsize': 10
+}
 
-def configurar_matplotlib():
-    """Configura matplotlib para melhor aparência"""
-    plt.style.use('default')
-    plt.rcParams['figure.figsize'] = (12, 8)
-    plt.rcParams['font.size'] = 10
-    plt.rcParams['axes.titlesize'] = 14
-    plt.rcParams['axes.labelsize'] = 12
-    plt.rcParams['xtick.labelsize'] = 10
-    plt.rcParams['ytick.labelsize'] = 10
-    plt.rcParams['legend.fontsize'] = 10
-
-def criar_grafico_status(dados, output_dir):
+def rotacionar_rotulos(ax):
+    """Rotaciona os rótulos do eixo x em 45 graus"""
+    for rotulo in ax.get_xticklabels():
+        rotulo.set(rotation=45, ha='right')
+
+def criar_grafico_status(dados, output_dir, dpi=DPI_PADRAO):
     """Cria gráfico de distribuição de status"""
     status_data = dados['distribuicao_status']
     
-    fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(15, 6))
+    fig = Figure(figsize=(15, 6))
+    ax1, ax2 = fig.subplots(1, 2)
     
     # Gráfico de pizza
     labels = list(status_data.keys())
@@ -46,21 +70,21 @@ def criar_grafico_status(dados, output_dir):
         ax2.text(bar.get_x() + bar.get_width()/2., height + 0.1,
                 f'{int(height)}', ha='center', va='bottom', fontweight='bold')
     
-    plt.tight_layout()
-    plt.savefig(f'{output_dir}/distribuicao_status.png', dpi=300, bbox_inches='tight')
-    plt.close()
-    
-    print("✅ Gráfico de status criado: distribuicao_status.png")
+    fig.tight_layout()
+    caminho = os.path.join(output_dir, 'distribuicao_status.png')
+    fig.savefig(caminho, dpi=dpi, bbox_inches='tight')
+    return caminho
 
-def criar_grafico_produtos(dados, output_dir):
+def criar_grafico_produtos(dados, output_dir, dpi=DPI_PADRAO):
     """Cria gráfico de distribuição de produtos"""
     produtos_data = dados['distribuicao_produtos']
     
-    fig, ax = plt.subplots(figsize=(12, 8))
+    fig = Figure(figsize=(12, 8))
+    ax = fig.subplots()
     
     labels = list(produtos_data.keys())
     sizes = list(produtos_data.values())
-    colors = plt.cm.Set3(np.linspace(0, 1, len(labels)))
+    colors = matplotlib.colormaps['Set3'](np.linspace(0, 1, len(labels)))
     
     bars = ax.bar(labels, sizes, color=colors)
     ax.set_title('Distribuição de Produtos Transportados', fontweight='bold', fontsize=16)
@@ -74,14 +98,13 @@ def criar_grafico_produtos(dados, output_dir):
                 f'{int(height)}', ha='center', va='bottom', fontweight='bold')
     
     # Rotacionar labels do eixo x
-    plt.xticks(rotation=45, ha='right')
-    plt.tight_layout()
-    plt.savefig(f'{output_dir}/distribuicao_produtos.png', dpi=300, bbox_inches='tight')
-    plt.close()
-    
-    print("✅ Gráfico de produtos criado: distribuicao_produtos.png")
+    rotacionar_rotulos(ax)
+    fig.tight_layout()
+    caminho = os.path.join(output_dir, 'distribuicao_produtos.png')
+    fig.savefig(caminho, dpi=dpi, bbox_inches='tight')
+    return caminho
 
-def criar_grafico_dias_semana(dados, output_dir):
+def criar_grafico_dias_semana(dados, output_dir, dpi=DPI_PADRAO):
     """Cria gráfico de entregas por dia da semana"""
     dias_data = dados['entregas_por_dia_semana']
     
@@ -89,23 +112,12 @@ def criar_grafico_dias_semana(dados, output_dir):
     ordem_dias = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
     dias_pt = ['Segunda', 'Terça', 'Quarta', 'Quinta', 'Sexta', 'Sábado', 'Domingo']
     
-    dias_ordenados = []
-    valores_ordenados = []
-    labels_pt = []
+    valores_ordenados = [dias_data.get(dia, 0) for dia in ordem_dias]
     
-    for i, dia in enumerate(ordem_dias):
-        if dia in dias_data:
-            dias_ordenados.append(dia)
-            valores_ordenados.append(dias_data[dia])
-            labels_pt.append(dias_pt[i])
-        else:
-            dias_ordenados.append(dia)
-            valores_ordenados.append(0)
-            labels_pt.append(dias_pt[i])
-    
-    fig, ax = plt.subplots(figsize=(12, 6))
+    fig = Figure(figsize=(12, 6))
+    ax = fig.subplots()
     
-    bars = ax.bar(labels_pt, valores_ordenados, color='#007bff', alpha=0.8)
+    bars = ax.bar(dias_pt, valores_ordenados, color='#007bff', alpha=0.8)
     ax.set_title('Entregas por Dia da Semana', fontweight='bold', fontsize=16)
     ax.set_ylabel('Número de Entregas', fontsize=12)
     ax.set_xlabel('Dia da Semana', fontsize=12)
@@ -117,15 +129,15 @@ def criar_grafico_dias_semana(dados, output_dir):
             ax.text(bar.get_x() + bar.get_width()/2., height + 0.05,
                     f'{int(height)}', ha='center', va='bottom', fontweight='bold')
     
-    plt.tight_layout()
-    plt.savefig(f'{output_dir}/entregas_por_dia_semana.png', dpi=300, bbox_inches='tight')
-    plt.close()
-    
-    print("✅ Gráfico de dias da semana criado: entregas_por_dia_semana.png")
+    fig.tight_layout()
+    caminho = os.path.join(output_dir, 'entregas_por_dia_semana.png')
+    fig.savefig(caminho, dpi=dpi, bbox_inches='tight')
+    return caminho
 
-def criar_dashboard_resumo(dados, output_dir):
+def criar_dashboard_resumo(dados, output_dir, dpi=DPI_PADRAO):
     """Cria dashboard com resumo dos principais indicadores"""
-    fig, ((ax1, ax2), (ax3, ax4)) = plt.subplots(2, 2, figsize=(16, 12))
+    fig = Figure(figsize=(16, 12))
+    (ax1, ax2), (ax3, ax4) = fig.subplots(2, 2)
     
     # 1. Status das entregas (pizza)
     status_data = dados['distribuicao_status']
@@ -141,10 +153,10 @@ def criar_dashboard_resumo(dados, output_dir):
     prod_labels = list(produtos_data.keys())
     prod_sizes = list(produtos_data.values())
     
-    bars2 = ax2.bar(prod_labels, prod_sizes, color='#17a2b8', alpha=0.8)
+    ax2.bar(prod_labels, prod_sizes, color='#17a2b8', alpha=0.8)
     ax2.set_title('Produtos Transportados', fontweight='bold')
     ax2.set_ylabel('Quantidade')
-    plt.setp(ax2.get_xticklabels(), rotation=45, ha='right')
+    rotacionar_rotulos(ax2)
     
     # 3. Indicadores principais
     indicadores = dados['indicadores']
@@ -181,52 +193,137 @@ def criar_dashboard_resumo(dados, output_dir):
     dias_labels = list(dias_data.keys())
     dias_values = list(dias_data.values())
     
-    bars4 = ax4.bar(dias_labels, dias_values, color='#fd7e14', alpha=0.8)
+    ax4.bar(dias_labels, dias_values, color='#fd7e14', alpha=0.8)
     ax4.set_title('Entregas por Dia da Semana', fontweight='bold')
     ax4.set_ylabel('Quantidade')
-    plt.setp(ax4.get_xticklabels(), rotation=45, ha='right')
+    rotacionar_rotulos(ax4)
     
     # Título geral
     fig.suptitle('Dashboard Analítico - Expresso Itaporanga', fontsize=18, fontweight='bold', y=0.98)
     
-    plt.tight_layout()
-    plt.subplots_adjust(top=0.93)
-    plt.savefig(f'{output_dir}/dashboard_resumo.png', dpi=300, bbox_inches='tight')
-    plt.close()
-    
-    print("✅ Dashboard resumo criado: dashboard_resumo.png")
+    fig.tight_layout()
+    fig.subplots_adjust(top=0.93)
+    caminho = os.path.join(output_dir, 'dashboard_resumo.png')
+    fig.savefig(caminho, dpi=dpi, bbox_inches='tight')
+    return caminho
+
+# Gráfico -> (função, chaves do relatório que ele usa)
+GRAFICOS = {
+    'distribuicao_status': (criar_grafico_status, ['distribuicao_status']),
+    'distribuicao_produtos': (criar_grafico_produtos, ['distribuicao_produtos']),
+    'entregas_por_dia_semana': (criar_grafico_dias_semana, ['entregas_por_dia_semana']),
+    'dashboard_resumo': (criar_dashboard_resumo,
+                         ['distribuicao_status', 'distribuicao_produtos', 'indicadores', 'entregas_por_dia_semana'])
+}
+
+def hash_grafico(nome, dados, dpi):
+    """Hash dos dados usados pelo gráfico, da resolução e do código que o desenha"""
+    _, chaves = GRAFICOS[nome]
+    conteudo = json.dumps({chave: dados.get(chave) for chave in chaves}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(f'{nome}|{conteudo}|{dpi}|{VERSAO_CODIGO}|{ESTILO}'.encode()).hexdigest()
+
+def renderizar(nome, dados, output_dir, dpi):
+    """Desenha um gráfico (executado nos processos do pool)"""
+    funcao, _ = GRAFICOS[nome]
+    with matplotlib.rc_context(ESTILO):
+        return funcao(dados, output_dir, dpi)
+
+def carregar_hashes(output_dir):
+    caminho = os.path.join(output_dir, ARQUIVO_HASHES)
+    if not os.path.exists(caminho):
+        return {}
+    with open(caminho, encoding='utf-8') as f:
+        return json.load(f)
+
+def salvar_hashes(output_dir, hashes):
+    with open(os.path.join(output_dir, ARQUIVO_HASHES), 'w', encoding='utf-8') as f:
+        json.dump(hashes, f, indent=2, sort_keys=True)
+
+def gerar_graficos(relatorios, processos=None, dpi=DPI_PADRAO, forcar=False):
+    """Renderiza em paralelo os gráficos cujos dados mudaram; `relatorios` é uma lista de (dados, output_dir)
+    
+    Retorna os arquivos gerados e as falhas (nome, output_dir, erro); os hashes dos gráficos que
+    renderizaram são gravados mesmo quando outros falham.
+    """
+    tarefas = []
+    hashes_por_saida = {}
+    for dados, output_dir in relatorios:
+        os.makedirs(output_dir, exist_ok=True)
+        hashes = hashes_por_saida.setdefault(output_dir, carregar_hashes(output_dir))
+        for nome in GRAFICOS:
+            atual = hash_grafico(nome, dados, dpi)
+            arquivo = os.path.join(output_dir, f'{nome}.png')
+            if not forcar and hashes.get(nome) == atual and os.path.exists(arquivo):
+                continue
+            tarefas.append((nome, dados, output_dir, atual))
+    
+    gerados = []
+    falhas = []
+    if tarefas:
+        processos = min(processos or os.cpu_count() or 1, len(tarefas))
+        with ProcessPoolExecutor(max_workers=processos) as executor:
+            futuros = [(executor.submit(renderizar, nome, dados, output_dir, dpi), nome, output_dir, atual)
+                       for nome, dados, output_dir, atual in tarefas]
+            for futuro, nome, output_dir, atual in futuros:
+                try:
+                    gerados.append(futuro.result())
+                except Exception as e:
+                    # Sem hash novo: o gráfico é renderizado de novo na próxima execução
+                    hashes_por_saida[output_dir].pop(nome, None)
+                    falhas.append((nome, output_dir, e))
+                    continue
+                # Hash gravado só depois do arquivo: uma falha força nova renderização
+                hashes_por_saida[output_dir][nome] = atual
+    
+    for output_dir, hashes in hashes_por_saida.items():
+        salvar_hashes(output_dir, hashes)
+    return gerados, falhas
 
 def main():
     """Função principal"""
-    # Carregar dados da análise
-    json_path = '/home/ubuntu/relatorio_analise_completa.json'
-    
-    if not os.path.exists(json_path):
-        print(f"❌ Arquivo de dados não encontrado: {json_path}")
-        return
+    parser = argparse.ArgumentParser(description='Gera os gráficos da análise de entregas')
+    parser.add_argument('--dados', nargs='+', default=[CAMINHO_DADOS_PADRAO],
+                        help='Relatórios JSON da análise (vários: um subdiretório de saída por relatório)')
+    parser.add_argument('--saida', default=DIRETORIO_SAIDA_PADRAO, help='Diretório dos gráficos')
+    parser.add_argument('--processos', type=int, help='Processos de renderização (padrão: núcleos da máquina)')
+    parser.add_argument('--dpi', type=int, default=DPI_PADRAO, help='Resolução dos PNGs')
+    parser.add_argument('--forcar', action='store_true', help='Renderizar mesmo os gráficos sem mudança nos dados')
+    args = parser.parse_args()
     
-    with open(json_path, 'r', encoding='utf-8') as f:
-        dados = json.load(f)
+    # Carregar dados da análise
+    relatorios = []
+    for json_path in args.dados:
+        if not os.path.exists(json_path):
+            print(f"❌ Arquivo de dados não encontrado: {json_path}")
+            return
     
-    # Criar diretório para gráficos
-    output_dir = '/home/ubuntu/site_integrado_expresso/graficos_analise'
-    os.makedirs(output_dir, exist_ok=True)
+        with open(json_path, 'r', encoding='utf-8') as f:
+            dados = json.load(f)
     
-    # Configurar matplotlib
-    configurar_matplotlib()
+        output_dir = args.saida
+        if len(args.dados) > 1:
+            output_dir = os.path.join(args.saida, os.path.splitext(os.path.basename(json_path))[0])
+        relatorios.append((dados, output_dir))
     
     print("🎨 GERANDO VISUALIZAÇÕES GRÁFICAS")
     print("=" * 50)
     
-    # Gerar todos os gráficos
-    criar_grafico_status(dados, output_dir)
-    criar_grafico_produtos(dados, output_dir)
-    criar_grafico_dias_semana(dados, output_dir)
-    criar_dashboard_resumo(dados, output_dir)
-    
-    print(f"\n✅ Todos os gráficos foram salvos em: {output_dir}")
+    # Gerar os gráficos alterados
+    gerados, falhas = gerar_graficos(relatorios, processos=args.processos, dpi=args.dpi, forcar=args.forcar)
+    for caminho in gerados:
+        print(f"✅ Gráfico criado: {caminho}")
+    for nome, output_dir, erro in falhas:
+        print(f"❌ Erro ao gerar {nome} em {output_dir}: {erro}")
+    
+    total = len(relatorios) * len(GRAFICOS)
+    if len(gerados) + len(falhas) < total:
+        print(f"⏭️  {total - len(gerados) - len(falhas)} gráficos sem mudança nos dados foram mantidos")
+    
+    if falhas:
+        print(f"\n⚠️  {len(falhas)} gráficos falharam; os demais foram salvos em: {args.saida}")
+        sys.exit(1)
+    print(f"\n✅ Todos os gráficos foram salvos em: {args.saida}")
     print("🎯 VISUALIZAÇÕES CONCLUÍDAS COM SUCESSO!")
 
 if __name__ == "__main__":
     main()
-
@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Script para importar um manifesto de entregas (JSON ou CSV) no sistema Expresso Itaporanga
+"""
+
+import sys
+import os
+import argparse
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'src'))
+
+from app import app, ler_manifesto, importar_entregas
+
+def main():
+    """Função principal"""
+    parser = argparse.ArgumentParser(description='Importa entregas em lote a partir de um manifesto')
+    parser.add_argument('arquivo', help='Manifesto .json (lista de entregas) ou .csv (com cabeçalho)')
+    parser.add_argument('--estrito', action='store_true',
+                        help='Não importa nada se alguma linha for inválida')
+    args = parser.parse_args()
+    
+    formato = 'csv' if args.arquivo.lower().endswith('.csv') else 'json'
+    with open(args.arquivo, 'r', encoding='utf-8') as f:
+        registros = ler_manifesto(f.read(), formato)
+    
+    with app.app_context():
+        print(f"🚀 Importando {len(registros)} entregas de {args.arquivo}...")
+        resultado = importar_entregas(registros, estrito=args.estrito)
+    
+    for erro in resultado['erros']:
+        print(f"❌ Linha {erro['linha']}: {erro['erro']}")
+    
+    print(f"\n✅ Entregas inseridas: {resultado['inseridas']}")
+    print(f"   Linhas com erro: {len(resultado['erros'])}")
+    print(f"   Tempo: {resultado['duracao_segundos']}s ({resultado['linhas_por_segundo']} linhas/s)")
+    
+    return 1 if resultado['erros'] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -8,7 +8,7 @@ import sys
 import os
 sys.path.append('/home/ubuntu/site_integrado_expresso/src')
 
-from app import app, db, Usuario, Entrega
+from app import app, db, Usuario, Entrega, aplicar_migracoes
 
 def inicializar_banco():
     """Inicializa o banco de dados e cria as tabelas"""
@@ -16,9 +16,9 @@ def inicializar_banco():
     with app.app_context():
         print("🚀 Inicializando banco de dados...")
         
-        # Criar todas as tabelas
-        db.create_all()
-        print("✅ Tabelas criadas com sucesso!")
+        # Aplicar migrações pendentes
+        aplicadas = aplicar_migracoes()
+        print(f"✅ Migrações aplicadas: {aplicadas or 'nenhuma pendente'}")
         
         # Verificar se usuário admin já existe
         admin_existente = Usuario.query.filter_by(username='admin').first()
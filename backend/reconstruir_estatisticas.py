@@ -0,0 +1,27 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Script para reconstruir o rollup diário de estatísticas (estatistica_diaria) a partir das entregas
+"""
+
+import sys
+import os
+import time
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'src'))
+
+from app import app, db, EstatisticaDiaria, reconstruir_estatistica_diaria
+
+def main():
+    """Função principal"""
+    with app.app_context():
+        print("🔄 Reconstruindo estatísticas diárias...")
+        inicio = time.perf_counter()
+        
+        with db.engine.begin() as conexao:
+            reconstruir_estatistica_diaria(conexao)
+        
+        linhas = EstatisticaDiaria.query.count()
+        print(f"✅ {linhas} linhas agregadas em {time.perf_counter() - inicio:.2f}s")
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,29 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify
+from flask import (Flask, render_template, request, redirect, url_for, session, flash, jsonify, Response,
+                   stream_with_context, g, has_request_context)
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
+from flask_cors.core import try_match_any
+from sqlalchemy import create_engine, func, or_, and_, event, inspect
+from sqlalchemy.exc import DBAPIError, IntegrityError, OperationalError, TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import NullPool, QueuePool
 from werkzeug.security import generate_password_hash, check_password_hash
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
+import asyncio
+import base64
+import binascii
+import bisect
+import csv
+import io
+import json
 import logging
 import os
+import queue
+import re
+import select
+import sys
+import threading
+import time
+from collections import Counter, OrderedDict, defaultdict
 from dotenv import load_dotenv
 
 # Carregar variáveis de ambiente
@@ -21,11 +40,17 @@ from email.mime.multipart import MIMEMultipart
 app = Flask(__name__, template_folder='../templates', static_folder='../static')
 
 # Configurar CORS
-CORS(app, origins=[
+# O flask-cors trata como regex (re.match) as origens com caracteres especiais
+ORIGENS_CORS = [
     'http://localhost:3000',
-    'https://*.railway.app',
+    r'https://[\w-]+\.railway\.app$',
     os.environ.get('FRONTEND_URL', 'http://localhost:3000')
-])
+]
+CORS(app, origins=ORIGENS_CORS)
+
+def origem_permitida(origem):
+    """Mesma comparação de origem do flask-cors, para as rotas servidas fora do Flask"""
+    return bool(origem) and try_match_any(origem, ORIGENS_CORS)
 
 # Configurar aplicação
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY') or secrets.token_hex(16)
@@ -43,6 +68,80 @@ else:
 
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
+# Pool de conexões
+class PoolMedido(QueuePool):
+    """QueuePool que mede o tempo de espera por uma conexão livre"""
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._lock_metricas = threading.Lock()
+        self.esperas = 0
+        self.espera_total = 0.0
+        self.espera_maxima = 0.0
+        self.timeouts = 0
+    
+    def _do_get(self):
+        inicio = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            with self._lock_metricas:
+                self.timeouts += 1
+            raise
+        finally:
+            espera = time.perf_counter() - inicio
+            with self._lock_metricas:
+                self.esperas += 1
+                self.espera_total += espera
+                self.espera_maxima = max(self.espera_maxima, espera)
+    
+    def metricas(self):
+        """Ocupação atual e tempos de espera acumulados"""
+        with self._lock_metricas:
+            return {
+                'tamanho': self.size(),
+                'em_uso': self.checkedout(),
+                'livres': self.checkedin(),
+                'overflow': max(self.overflow(), 0),
+                'esperas': self.esperas,
+                'espera_total_segundos': round(self.espera_total, 6),
+                'espera_maxima_segundos': round(self.espera_maxima, 6),
+                'timeouts': self.timeouts
+            }
+
+def variavel_booleana(nome, padrao):
+    """Lê uma variável de ambiente do tipo sim/não"""
+    valor = os.environ.get(nome)
+    if valor is None:
+        return padrao
+    return valor.strip().lower() in ('1', 'true', 'sim', 'yes', 'on')
+
+def opcoes_engine(database_url, **substituicoes):
+    """SQLALCHEMY_ENGINE_OPTIONS a partir das variáveis DB_* do ambiente"""
+    opcoes = {
+        # Railway derruba conexões ociosas: testar antes de usar e reciclar cedo
+        'pool_pre_ping': variavel_booleana('DB_POOL_PRE_PING', True),
+        'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 300))
+    }
+    
+    # Banco SQLite em memória usa um pool próprio do Flask-SQLAlchemy
+    if ':memory:' not in database_url:
+        opcoes.update({
+            'poolclass': PoolMedido,
+            'pool_size': int(os.environ.get('DB_POOL_SIZE', 5)),
+            'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 10)),
+            'pool_timeout': float(os.environ.get('DB_POOL_TIMEOUT', 30))
+        })
+    
+    timeout_consulta = int(os.environ.get('DB_STATEMENT_TIMEOUT_MS', 0))
+    if timeout_consulta and database_url.startswith('postgresql'):
+        opcoes['connect_args'] = {'options': f'-c statement_timeout={timeout_consulta}'}
+    
+    opcoes.update(substituicoes)
+    return opcoes
+
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = opcoes_engine(app.config['SQLALCHEMY_DATABASE_URI'])
+
 db = SQLAlchemy(app)
 
 # Modelos do banco de dados
@@ -76,9 +175,283 @@ class Entrega(db.Model):
     
     # Status e controle
     status = db.Column(db.String(20), default='pendente')
-    data_criacao = db.Column(db.DateTime, default=datetime.utcnow)
+    # Não nula: chave da paginação por cursor (ver migracao_data_criacao_obrigatoria)
+    data_criacao = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     data_atualizacao = db.Column(db.DateTime, default=datetime.utcnow)
     usuario_id = db.Column(db.Integer, db.ForeignKey('usuario.id'))
+    
+    # Índices das colunas usadas em filtros, ORDER BY e GROUP BY
+    __table_args__ = (
+        db.Index('ix_entrega_status_data_criacao', 'status', 'data_criacao'),
+        db.Index('ix_entrega_data_criacao_id', 'data_criacao', 'id'),
+        db.Index('ix_entrega_destinatario_cidade', 'destinatario_cidade'),
+        db.Index('ix_entrega_usuario_id', 'usuario_id'),
+    )
+
+class VersaoSchema(db.Model):
+    __tablename__ = 'versao_schema'
+    versao = db.Column(db.Integer, primary_key=True)
+    descricao = db.Column(db.String(200), nullable=False)
+    aplicada_em = db.Column(db.DateTime, default=datetime.utcnow)
+
+STATUS_VALIDOS = ['pendente', 'coletado', 'em_transito', 'entregue', 'cancelado']
+
+class StatusEvento(db.Model):
+    """Histórico (somente inserção) das mudanças de status de cada entrega"""
+    __tablename__ = 'status_evento'
+    id = db.Column(db.Integer, primary_key=True)
+    entrega_id = db.Column(db.Integer, db.ForeignKey('entrega.id'), nullable=False)
+    status_anterior = db.Column(db.String(20))
+    status = db.Column(db.String(20), nullable=False)
+    data_evento = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    # Tempo que a entrega ficou no status anterior
+    duracao_segundos = db.Column(db.Float)
+    usuario_id = db.Column(db.Integer, db.ForeignKey('usuario.id'))
+    
+    __table_args__ = (
+        db.Index('ix_status_evento_entrega_data', 'entrega_id', 'data_evento'),
+    )
+
+class EstatisticaDiaria(db.Model):
+    """Contagem pré-agregada de entregas por dia de criação, status atual, cidade e produto"""
+    __tablename__ = 'estatistica_diaria'
+    data = db.Column(db.Date, primary_key=True)
+    status = db.Column(db.String(20), primary_key=True)
+    destinatario_cidade = db.Column(db.String(100), primary_key=True)
+    tipo_produto = db.Column(db.String(50), primary_key=True)
+    total = db.Column(db.Integer, nullable=False, default=0)
+
+class ContadorCodigo(db.Model):
+    __tablename__ = 'contador_codigo'
+    nome = db.Column(db.String(50), primary_key=True)
+    proximo = db.Column(db.BigInteger, nullable=False, default=1)
+
+# Alocação de códigos de rastreamento
+FORMATO_CODIGO_RASTREIO = re.compile(r'^EI[A-Z]*(\d{11})$')
+
+def digito_verificador(numero):
+    """Dígito verificador (Luhn) de uma sequência de dígitos"""
+    soma = 0
+    for posicao, digito in enumerate(reversed(numero)):
+        valor = int(digito)
+        if posicao % 2 == 0:
+            valor *= 2
+            if valor > 9:
+                valor -= 9
+        soma += valor
+    return str((10 - soma % 10) % 10)
+
+def codigo_rastreio_invalido(codigo):
+    """Indica se o código segue o formato com dígito verificador mas o dígito não confere"""
+    correspondencia = FORMATO_CODIGO_RASTREIO.match(codigo)
+    if not correspondencia:
+        return False
+    numero = correspondencia.group(1)
+    return digito_verificador(numero[:-1]) != numero[-1]
+
+class AlocadorCodigos:
+    """Aloca códigos de rastreamento a partir de faixas reservadas no banco
+    
+    Cada processo reserva um bloco do contador com um único UPDATE e distribui os
+    números do bloco em memória, sem consultar o banco a cada entrega. O formato
+    EI + prefixo + 10 dígitos + dígito verificador não se confunde com os códigos
+    aleatórios antigos (8 ou 10 dígitos), então os códigos são únicos por construção.
+    """
+    
+    def __init__(self, nome, tamanho_bloco, prefixo=''):
+        self.nome = nome
+        self.tamanho_bloco = tamanho_bloco
+        self.prefixo = prefixo
+        self._proximo = 0
+        self._limite = 0
+        self._lock = threading.Lock()
+    
+    def reservar_faixa(self, quantidade):
+        """Reserva [inicio, fim) no contador em uma transação própria"""
+        tabela = ContadorCodigo.__table__
+        for _ in range(2):
+            try:
+                with db.engine.begin() as conexao:
+                    resultado = conexao.execute(
+                        tabela.update()
+                        .where(tabela.c.nome == self.nome)
+                        .values(proximo=tabela.c.proximo + quantidade)
+                    )
+                    if resultado.rowcount == 0:
+                        conexao.execute(tabela.insert().values(nome=self.nome, proximo=1 + quantidade))
+                        return 1, 1 + quantidade
+                    fim = conexao.execute(
+                        db.select(tabela.c.proximo).where(tabela.c.nome == self.nome)
+                    ).scalar()
+                    return fim - quantidade, fim
+            except IntegrityError:
+                # Outro processo criou o contador ao mesmo tempo; tentar o UPDATE de novo
+                continue
+        raise RuntimeError(f'Não foi possível reservar faixa do contador {self.nome}')
+    
+    def formatar(self, numero):
+        sequencia = f'{numero:010d}'
+        return f'EI{self.prefixo}{sequencia}{digito_verificador(sequencia)}'
+    
+    def gerar(self, quantidade=1):
+        """Retorna uma lista de códigos novos"""
+        with self._lock:
+            numeros = []
+            while len(numeros) < quantidade:
+                if self._proximo >= self._limite:
+                    faltam = quantidade - len(numeros)
+                    self._proximo, self._limite = self.reservar_faixa(max(faltam, self.tamanho_bloco))
+                fim = min(self._limite, self._proximo + quantidade - len(numeros))
+                numeros.extend(range(self._proximo, fim))
+                self._proximo = fim
+        return [self.formatar(numero) for numero in numeros]
+    
+    def proximo(self):
+        """Retorna um código novo"""
+        return self.gerar(1)[0]
+
+# Prefixo opcional (letras) para identificar a origem dos códigos, ex.: por worker ou unidade
+alocador_codigos = AlocadorCodigos(
+    'entrega',
+    tamanho_bloco=int(os.environ.get('CODIGO_RASTREIO_BLOCO', 1000)),
+    prefixo=os.environ.get('CODIGO_RASTREIO_PREFIXO', '').upper()
+)
+
+# Rollup diário de estatísticas (estatistica_diaria)
+def chave_estatistica(data_criacao, status, cidade, produto):
+    return (data_criacao.date(), status, cidade, produto)
+
+def aplicar_deltas_estatistica(conexao, deltas):
+    """Soma os deltas {(data, status, cidade, produto): quantidade} no rollup com upsert"""
+    linhas = [{
+        'data': data,
+        'status': status,
+        'destinatario_cidade': cidade,
+        'tipo_produto': produto,
+        'total': quantidade
+    } for (data, status, cidade, produto), quantidade in deltas.items() if quantidade]
+    if not linhas:
+        return
+    
+    if conexao.dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as insert_upsert
+    else:
+        from sqlalchemy.dialects.sqlite import insert as insert_upsert
+    tabela = EstatisticaDiaria.__table__
+    comando = insert_upsert(tabela)
+    comando = comando.on_conflict_do_update(
+        index_elements=[tabela.c.data, tabela.c.status, tabela.c.destinatario_cidade, tabela.c.tipo_produto],
+        set_={'total': tabela.c.total + comando.excluded.total}
+    )
+    conexao.execute(comando, linhas)
+
+def reconstruir_estatistica_diaria(conexao):
+    """Recalcula o rollup inteiro a partir da tabela entrega (backfill)"""
+    tabela = EstatisticaDiaria.__table__
+    conexao.execute(tabela.delete())
+    conexao.execute(tabela.insert().from_select(
+        ['data', 'status', 'destinatario_cidade', 'tipo_produto', 'total'],
+        db.select(
+            func.date(Entrega.data_criacao),
+            Entrega.status,
+            Entrega.destinatario_cidade,
+            Entrega.tipo_produto,
+            func.count(Entrega.id)
+        ).where(Entrega.data_criacao.isnot(None)).group_by(
+            func.date(Entrega.data_criacao),
+            Entrega.status,
+            Entrega.destinatario_cidade,
+            Entrega.tipo_produto
+        )
+    ))
+
+# Invariante: estatistica_diaria é o GROUP BY de entrega por (dia, status, cidade, produto),
+# e as estatísticas da API e do painel leem só o rollup. Ele se mantém porque:
+# - escritas de objetos pelo ORM (flush) passam pelos listeners abaixo, na mesma transação;
+# - INSERT/UPDATE/DELETE em lote do ORM (Query.delete(), Query.update(), session.execute(update(Entrega)))
+#   reconstroem o rollup na mesma transação (estatistica_apos_comando_em_lote);
+# - comandos Core sobre Entrega.__table__ aplicam os deltas explicitamente (importação e status em lote).
+# SQL bruto ou comandos Core sem deltas não são vistos: depois deles, chamar
+# reconstruir_estatistica_diaria (ou rodar reconstruir_estatisticas.py).
+@event.listens_for(Entrega, 'after_insert')
+def estatistica_apos_inserir(mapper, conexao, entrega):
+    if entrega.data_criacao is not None:
+        chave = chave_estatistica(entrega.data_criacao, entrega.status,
+                                  entrega.destinatario_cidade, entrega.tipo_produto)
+        aplicar_deltas_estatistica(conexao, {chave: 1})
+
+@event.listens_for(Entrega, 'after_update')
+def estatistica_apos_atualizar(mapper, conexao, entrega):
+    estado = inspect(entrega)
+    valores_antigos = []
+    for atributo in ('data_criacao', 'status', 'destinatario_cidade', 'tipo_produto'):
+        historico = estado.attrs[atributo].history
+        valores_antigos.append(historico.deleted[0] if historico.deleted else getattr(entrega, atributo))
+    
+    antiga = chave_estatistica(*valores_antigos) if valores_antigos[0] is not None else None
+    nova = chave_estatistica(entrega.data_criacao, entrega.status,
+                             entrega.destinatario_cidade, entrega.tipo_produto) if entrega.data_criacao else None
+    if antiga != nova:
+        deltas = Counter()
+        if antiga:
+            deltas[antiga] -= 1
+        if nova:
+            deltas[nova] += 1
+        aplicar_deltas_estatistica(conexao, deltas)
+
+@event.listens_for(Entrega, 'after_delete')
+def estatistica_apos_remover(mapper, conexao, entrega):
+    if entrega.data_criacao is not None:
+        chave = chave_estatistica(entrega.data_criacao, entrega.status,
+                                  entrega.destinatario_cidade, entrega.tipo_produto)
+        aplicar_deltas_estatistica(conexao, {chave: -1})
+
+@event.listens_for(db.session, 'do_orm_execute')
+def estatistica_apos_comando_em_lote(estado):
+    """Comandos em lote do ORM sobre Entrega não disparam os listeners por objeto: reconstruir o rollup"""
+    if not (estado.is_insert or estado.is_update or estado.is_delete):
+        return None
+    if estado.bind_mapper is None or estado.bind_mapper.class_ is not Entrega:
+        return None
+    resultado = estado.invoke_statement()
+    reconstruir_estatistica_diaria(estado.session.connection())
+    return resultado
+
+# Serviço de estatísticas
+def consulta_estatisticas_status():
+    """GROUP BY por status sobre o rollup diário"""
+    return db.select(
+        EstatisticaDiaria.status,
+        func.sum(EstatisticaDiaria.total)
+    ).group_by(EstatisticaDiaria.status)
+
+def resumir_estatisticas_status(linhas):
+    """Total, contagem por status e taxa de sucesso a partir das linhas (status, total)"""
+    por_status = {status: int(total) for status, total in linhas if total}
+    total = sum(por_status.values())
+    entregues = por_status.get('entregue', 0)
+    
+    return {
+        'total': total,
+        'por_status': por_status,
+        'taxa_sucesso': (entregues / total * 100) if total > 0 else 0
+    }
+
+def calcular_estatisticas_status():
+    """Conta entregas por status, total e taxa de sucesso com um GROUP BY sobre o rollup diário"""
+    return resumir_estatisticas_status(db.session.execute(consulta_estatisticas_status()).all())
+
+def consulta_top_cidades(limite=5):
+    """Cidades de destino com mais entregas, a partir do rollup diário"""
+    total = func.sum(EstatisticaDiaria.total)
+    return db.select(
+        EstatisticaDiaria.destinatario_cidade,
+        total.label('total')
+    ).group_by(EstatisticaDiaria.destinatario_cidade).having(total > 0).order_by(total.desc()).limit(limite)
+
+def calcular_top_cidades(limite=5):
+    """Top cidades de destino (linhas cidade, total)"""
+    return db.session.execute(consulta_top_cidades(limite)).all()
 
 # Rotas do site institucional
 @app.route('/')
@@ -201,27 +574,86 @@ def dashboard():
         return redirect(url_for('gestao_login'))
     
     # Estatísticas
-    total_entregas = Entrega.query.count()
-    pendentes = Entrega.query.filter_by(status='pendente').count()
-    em_transito = Entrega.query.filter_by(status='em_transito').count()
-    entregues = Entrega.query.filter_by(status='entregue').count()
+    estatisticas = cache_respostas.obter_ou_gerar('estatisticas_status', calcular_estatisticas_status)
+    por_status = estatisticas['por_status']
     
     stats = {
-        'total': total_entregas,
-        'pendentes': pendentes,
-        'em_transito': em_transito,
-        'entregues': entregues
+        'total': estatisticas['total'],
+        'pendentes': por_status.get('pendente', 0),
+        'em_transito': por_status.get('em_transito', 0),
+        'entregues': por_status.get('entregue', 0)
     }
     
     return render_template('gestao/dashboard.html', stats=stats)
 
+# Paginação da listagem de gestão
+POR_PAGINA_GESTAO = 50
+ORDENACOES_GESTAO = {
+    'data_criacao': Entrega.data_criacao,
+    'codigo_rastreamento': Entrega.codigo_rastreamento,
+    'status': Entrega.status,
+    'destinatario_cidade': Entrega.destinatario_cidade
+}
+# Acima deste número de linhas a listagem sem filtros usa a estimativa do Postgres
+LIMITE_CONTAGEM_EXATA = 100000
+
+def contar_entregas(query, filtrada):
+    """Total da listagem: COUNT separado, ou estimativa do planejador para a tabela inteira"""
+    if not filtrada and db.engine.dialect.name == 'postgresql':
+        estimativa = db.session.execute(
+            db.text("SELECT reltuples::bigint FROM pg_class WHERE relname = 'entrega'")
+        ).scalar()
+        if estimativa and estimativa > LIMITE_CONTAGEM_EXATA:
+            return estimativa, True
+    return query.order_by(None).count(), False
+
+def paginar_entregas(args):
+    """Monta uma página da listagem a partir dos parâmetros de filtro, ordenação e página"""
+    filtros = {chave: args.get(chave) for chave in ('status', 'cidade', 'data_inicio', 'data_fim')
+               if args.get(chave)}
+    query = aplicar_filtros_entrega(Entrega.query, filtros)
+    
+    ordenar = args.get('ordenar') if args.get('ordenar') in ORDENACOES_GESTAO else 'data_criacao'
+    direcao = 'asc' if args.get('direcao') == 'asc' else 'desc'
+    coluna = ORDENACOES_GESTAO[ordenar]
+    if direcao == 'asc':
+        query = query.order_by(coluna.asc(), Entrega.id.asc())
+    else:
+        query = query.order_by(coluna.desc(), Entrega.id.desc())
+    
+    total, estimado = contar_entregas(query, bool(filtros))
+    total_paginas = max(1, -(-total // POR_PAGINA_GESTAO))
+    try:
+        pagina = min(max(1, int(args.get('pagina', 1))), total_paginas)
+    except ValueError:
+        pagina = 1
+    
+    entregas = query.offset((pagina - 1) * POR_PAGINA_GESTAO).limit(POR_PAGINA_GESTAO).all()
+    
+    return {
+        'entregas': entregas,
+        'filtros': dict(filtros, ordenar=ordenar, direcao=direcao),
+        'paginacao': {
+            'pagina': pagina,
+            'por_pagina': POR_PAGINA_GESTAO,
+            'total': total,
+            'total_paginas': total_paginas,
+            'estimado': estimado
+        }
+    }
+
 @app.route('/gestao/entregas')
 def listar_entregas():
     if 'user_id' not in session:
         return redirect(url_for('gestao_login'))
     
-    entregas = Entrega.query.order_by(Entrega.data_criacao.desc()).all()
-    return render_template('gestao/entregas.html', entregas=entregas)
+    try:
+        pagina = paginar_entregas(request.args)
+    except ValueError as e:
+        flash(str(e), 'error')
+        return redirect(url_for('listar_entregas'))
+    
+    return render_template('gestao/entregas.html', **pagina)
 
 @app.route('/gestao/nova-entrega')
 def nova_entrega():
@@ -236,9 +668,7 @@ def criar_entrega():
         return redirect(url_for('gestao_login'))
     
     # Gerar código de rastreamento
-    import random
-    import string
-    codigo = 'EI' + ''.join(random.choices(string.digits, k=8))
+    codigo = alocador_codigos.proximo()
     
     entrega = Entrega(
         codigo_rastreamento=codigo,
@@ -257,6 +687,8 @@ def criar_entrega():
     
     db.session.add(entrega)
     db.session.commit()
+    cache_respostas.invalidar()
+    cache_rastreamento.invalidar(codigo)
     
     flash(f'Entrega criada com sucesso! Código: {codigo}', 'success')
     return redirect(url_for('listar_entregas'))
@@ -267,22 +699,16 @@ def relatorios():
         return redirect(url_for('gestao_login'))
     
     # Dados para relatórios
-    total_entregas = Entrega.query.count()
-    pendentes = Entrega.query.filter_by(status='pendente').count()
-    em_transito = Entrega.query.filter_by(status='em_transito').count()
-    entregues = Entrega.query.filter_by(status='entregue').count()
-    devolvidas = Entrega.query.filter_by(status='devolvida').count()
-    
-    # Taxa de sucesso
-    taxa_sucesso = (entregues / total_entregas * 100) if total_entregas > 0 else 0
+    estatisticas = cache_respostas.obter_ou_gerar('estatisticas_status', calcular_estatisticas_status)
+    por_status = estatisticas['por_status']
     
     dados = {
-        'total': total_entregas,
-        'pendentes': pendentes,
-        'em_transito': em_transito,
-        'entregues': entregues,
-        'devolvidas': devolvidas,
-        'taxa_sucesso': round(taxa_sucesso, 1)
+        'total': estatisticas['total'],
+        'pendentes': por_status.get('pendente', 0),
+        'em_transito': por_status.get('em_transito', 0),
+        'entregues': por_status.get('entregue', 0),
+        'devolvidas': por_status.get('devolvida', 0),
+        'taxa_sucesso': round(estatisticas['taxa_sucesso'], 1)
     }
     
     return render_template('gestao/relatorios.html', dados=dados)
@@ -291,25 +717,542 @@ def relatorios():
 def rastreamento():
     return render_template('rastreamento.html')
 
-@app.route('/api/rastrear/<codigo>')
-def api_rastrear(codigo):
-    entrega = Entrega.query.filter_by(codigo_rastreamento=codigo).first()
+# Cache em memória (LRU + TTL)
+class CacheTTL:
+    """Cache LRU com expiração por item, seguro entre threads e com contadores de acerto"""
+    
+    def __init__(self, capacidade, ttl):
+        self.capacidade = capacidade
+        self.ttl = ttl
+        self._itens = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+    
+    def obter(self, chave):
+        """Retorna (True, valor) se a chave está válida no cache, senão (False, None)"""
+        agora = time.monotonic()
+        with self._lock:
+            item = self._itens.get(chave)
+            if item is not None and item[0] > agora:
+                self._itens.move_to_end(chave)
+                self.hits += 1
+                return True, item[1]
+            if item is not None:
+                del self._itens[chave]
+            self.misses += 1
+            return False, None
+    
+    def definir(self, chave, valor, ttl=None):
+        """Armazena o valor, descartando o item menos usado se passar da capacidade"""
+        expira_em = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._itens[chave] = (expira_em, valor)
+            self._itens.move_to_end(chave)
+            while len(self._itens) > self.capacidade:
+                self._itens.popitem(last=False)
+    
+    def invalidar(self, chave):
+        """Remove a chave do cache"""
+        with self._lock:
+            self._itens.pop(chave, None)
+    
+    def limpar(self):
+        """Esvazia o cache e zera os contadores"""
+        with self._lock:
+            self._itens.clear()
+            self.hits = 0
+            self.misses = 0
+    
+    def estatisticas(self):
+        """Contadores de uso do cache"""
+        with self._lock:
+            consultas = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'taxa_acerto': round(self.hits / consultas, 4) if consultas else 0,
+                'tamanho': len(self._itens),
+                'capacidade': self.capacidade
+            }
+
+# Cache do rastreamento público. É local a cada worker: a invalidação vale para
+# o processo que atualizou o status e o TTL limita o atraso nos demais.
+cache_rastreamento = CacheTTL(
+    capacidade=int(os.environ.get('RASTREIO_CACHE_TAMANHO', 10000)),
+    ttl=float(os.environ.get('RASTREIO_CACHE_TTL', 30))
+)
+RASTREIO_CACHE_TTL_NEGATIVO = float(os.environ.get('RASTREIO_CACHE_TTL_NEGATIVO', 5))
+
+# Cache de respostas agregadas (estatísticas e relatórios) com backend plugável
+class BackendCacheMemoria:
+    """Backend local ao processo, limitado em tamanho pelo CacheTTL"""
+
+    nome = 'memoria'
+
+    def __init__(self, capacidade, ttl):
+        self._cache = CacheTTL(capacidade, ttl)
+        self._geracoes = {}
+        self._lock = threading.Lock()
+
+    def obter(self, chave):
+        encontrado, valor = self._cache.obter(chave)
+        return valor if encontrado else None
+
+    def definir(self, chave, valor, ttl):
+        self._cache.definir(chave, valor, ttl)
+
+    def geracao(self, chave):
+        with self._lock:
+            return self._geracoes.get(chave, 0)
+
+    def incrementar(self, chave):
+        with self._lock:
+            self._geracoes[chave] = self._geracoes.get(chave, 0) + 1
+
+    def limpar(self):
+        self._cache.limpar()
+        with self._lock:
+            self._geracoes.clear()
+
+class BackendCacheRedis:
+    """Backend compartilhado entre workers para qualquer cliente compatível com Redis (get/set/incr)"""
+
+    nome = 'redis'
+
+    def __init__(self, cliente, prefixo='expresso:'):
+        self.cliente = cliente
+        self.prefixo = prefixo
+
+    def obter(self, chave):
+        bruto = self.cliente.get(self.prefixo + chave)
+        return json.loads(bruto) if bruto is not None else None
+
+    def definir(self, chave, valor, ttl):
+        self.cliente.set(self.prefixo + chave, json.dumps(valor), ex=max(1, int(ttl)))
+
+    def geracao(self, chave):
+        return int(self.cliente.get(self.prefixo + chave) or 0)
+
+    def incrementar(self, chave):
+        self.cliente.incr(self.prefixo + chave)
+
+    def limpar(self):
+        # As entradas antigas deixam de ser alcançáveis e expiram pelo TTL
+        self.incrementar(CacheRespostas.CHAVE_GERACAO)
+
+class CacheRespostas:
+    """Cache de dados agregados invalidado por geração: toda escrita em entregas incrementa a geração"""
+
+    CHAVE_GERACAO = 'geracao:entregas'
+
+    def __init__(self, backend, ttl):
+        self.backend = backend
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.erros = 0
+
+    def _contar(self, campo):
+        with self._lock:
+            setattr(self, campo, getattr(self, campo) + 1)
+
+    def buscar(self, nome):
+        """Retorna (chave, valor) da geração atual; valor None em miss e chave None se o backend falhar"""
+        try:
+            geracao = self.backend.geracao(self.CHAVE_GERACAO)
+            chave = f'resposta:{geracao}:{nome}'
+            valor = self.backend.obter(chave)
+        except Exception as e:
+            # Falha do backend não derruba o endpoint: calcula direto do banco
+            self._contar('erros')
+            app.logger.warning(f"Cache de respostas indisponível: {e}")
+            return None, None
+
+        self._contar('hits' if valor is not None else 'misses')
+        return chave, valor
+
+    def guardar(self, chave, valor):
+        """Armazena o valor calculado após um miss"""
+        if chave is None:
+            return
+        try:
+            self.backend.definir(chave, valor, self.ttl)
+        except Exception as e:
+            self._contar('erros')
+            app.logger.warning(f"Cache de respostas indisponível: {e}")
+
+    def obter_ou_gerar(self, nome, gerar):
+        """Retorna o valor em cache para a geração atual ou calcula e armazena com gerar()"""
+        chave, valor = self.buscar(nome)
+        if valor is None:
+            valor = gerar()
+            self.guardar(chave, valor)
+        return valor
+
+    def invalidar(self):
+        """Incrementa a geração após uma escrita em entregas"""
+        try:
+            self.backend.incrementar(self.CHAVE_GERACAO)
+        except Exception as e:
+            self._contar('erros')
+            app.logger.warning(f"Falha ao invalidar o cache de respostas: {e}")
+
+    def limpar(self):
+        """Descarta as entradas e zera os contadores"""
+        self.backend.limpar()
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+            self.erros = 0
+
+    def estatisticas(self):
+        """Contadores de uso do cache"""
+        with self._lock:
+            consultas = self.hits + self.misses
+            return {
+                'backend': self.backend.nome,
+                'hits': self.hits,
+                'misses': self.misses,
+                'erros': self.erros,
+                'taxa_acerto': round(self.hits / consultas, 4) if consultas else 0
+            }
+
+def criar_backend_cache_respostas():
+    """Usa Redis quando RESPOSTA_CACHE_URL está definida, senão memória local"""
+    url = os.environ.get('RESPOSTA_CACHE_URL')
+    if url:
+        try:
+            import redis
+            return BackendCacheRedis(redis.Redis.from_url(url))
+        except ImportError:
+            app.logger.warning("Pacote redis não instalado, cache de respostas em memória")
+    return BackendCacheMemoria(
+        capacidade=int(os.environ.get('RESPOSTA_CACHE_TAMANHO', 256)),
+        ttl=float(os.environ.get('RESPOSTA_CACHE_TTL', 60))
+    )
+
+# Com o backend em memória a invalidação vale só para o worker que escreveu e o
+# TTL limita o atraso nos demais; com Redis a geração é compartilhada.
+cache_respostas = CacheRespostas(
+    criar_backend_cache_respostas(),
+    ttl=float(os.environ.get('RESPOSTA_CACHE_TTL', 60))
+)
+
+# Requisições condicionais (ETag / Last-Modified) derivadas de data_atualizacao
+def validadores_http(prefixo, chave, data_atualizacao):
+    """Retorna (etag, last_modified) de um recurso a partir de data_atualizacao"""
+    etag = f"{prefixo}-{chave}-{data_atualizacao.strftime('%Y%m%d%H%M%S%f')}"
+    ultima_modificacao = data_atualizacao.replace(microsecond=0, tzinfo=timezone.utc)
+    return etag, ultima_modificacao
+
+def recurso_nao_modificado(etag, ultima_modificacao, requisicao=None):
+    """Verifica If-None-Match (prioritário) ou If-Modified-Since da requisição"""
+    requisicao = requisicao or request
+    if requisicao.if_none_match:
+        return requisicao.if_none_match.contains(etag)
+    if requisicao.if_modified_since:
+        return ultima_modificacao <= requisicao.if_modified_since
+    return False
+
+def resposta_condicional(etag, ultima_modificacao, gerar_dados, requisicao=None):
+    """Responde 304 sem montar o corpo quando o cliente já tem a versão atual"""
+    if recurso_nao_modificado(etag, ultima_modificacao, requisicao):
+        response = Response(status=304)
+    else:
+        response = jsonify(gerar_dados())
+    response.set_etag(etag)
+    response.last_modified = ultima_modificacao
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+def montar_resultado_rastreio(entrega):
+    """Dados públicos de rastreamento de uma entrega (objeto ou linha com as mesmas colunas)"""
+    return {
+        'encontrado': True,
+        'codigo': entrega.codigo_rastreamento,
+        'status': entrega.status,
+        'destinatario': entrega.destinatario_nome,
+        'cidade_destino': entrega.destinatario_cidade,
+        'data_criacao': entrega.data_criacao.strftime('%d/%m/%Y %H:%M')
+    }
+
+def guardar_rastreio(codigo, entrega):
+    """Monta o resultado de um código consultado no banco e guarda no cache"""
     if entrega:
-        return jsonify({
-            'encontrado': True,
-            'codigo': entrega.codigo_rastreamento,
-            'status': entrega.status,
-            'destinatario': entrega.destinatario_nome,
-            'cidade_destino': entrega.destinatario_cidade,
-            'data_criacao': entrega.data_criacao.strftime('%d/%m/%Y %H:%M')
-        })
+        resultado = montar_resultado_rastreio(entrega)
+        data_atualizacao = entrega.data_atualizacao
+        cache_rastreamento.definir(codigo, (resultado, data_atualizacao))
     else:
+        # Códigos inexistentes ficam pouco tempo no cache
+        resultado = {'encontrado': False}
+        data_atualizacao = None
+        cache_rastreamento.definir(codigo, (resultado, data_atualizacao), ttl=RASTREIO_CACHE_TTL_NEGATIVO)
+    return resultado, data_atualizacao
+
+def resposta_rastreio(codigo, resultado, data_atualizacao, requisicao=None):
+    """Resposta do rastreamento, condicional quando a entrega existe"""
+    if data_atualizacao is None:
+        return jsonify(resultado)
+    
+    etag, ultima_modificacao = validadores_http('rastreio', codigo, data_atualizacao)
+    return resposta_condicional(etag, ultima_modificacao, lambda: resultado, requisicao)
+
+# Rastreamento em lote
+LOTE_RASTREIO_MAXIMO = 5000
+LOTE_RASTREIO_TAMANHO_IN = 500
+
+def consulta_rastreio(codigos):
+    """Colunas públicas de rastreamento das entregas com os códigos informados"""
+    return db.select(
+        Entrega.codigo_rastreamento,
+        Entrega.status,
+        Entrega.destinatario_nome,
+        Entrega.destinatario_cidade,
+        Entrega.data_criacao,
+        Entrega.data_atualizacao
+    ).where(Entrega.codigo_rastreamento.in_(codigos))
+
+@app.route('/api/rastrear/<codigo>')
+def api_rastrear(codigo):
+    # Código no formato novo com dígito verificador errado: não existe
+    if codigo_rastreio_invalido(codigo):
         return jsonify({'encontrado': False})
+    
+    encontrado_cache, item = cache_rastreamento.obter(codigo)
+    if encontrado_cache:
+        resultado, data_atualizacao = item
+    else:
+        entrega = db.session.execute(consulta_rastreio([codigo])).first()
+        resultado, data_atualizacao = guardar_rastreio(codigo, entrega)
+    
+    return resposta_rastreio(codigo, resultado, data_atualizacao)
+
+def validar_lote_rastreio(data):
+    """Retorna (codigos, None) ou (None, mensagem de erro) para o corpo do rastreamento em lote"""
+    if not isinstance(data, dict):
+        return None, 'Envie um objeto JSON com "codigos"'
+    
+    codigos = data.get('codigos')
+    
+    if not isinstance(codigos, list) or not all(isinstance(codigo, str) for codigo in codigos):
+        return None, 'Informe "codigos" como uma lista de códigos de rastreamento'
+    
+    if len(codigos) > LOTE_RASTREIO_MAXIMO:
+        return None, f'Máximo de {LOTE_RASTREIO_MAXIMO} códigos por requisição'
+    
+    return codigos, None
+
+def separar_rastreios_em_cache(codigos):
+    """Remove duplicados mantendo a ordem e retorna (resultados do cache, códigos a consultar)"""
+    resultados = {}
+    pendentes = []
+    for codigo in dict.fromkeys(codigos):
+        encontrado_cache, item = cache_rastreamento.obter(codigo)
+        if encontrado_cache:
+            resultados[codigo] = item[0]
+        else:
+            pendentes.append(codigo)
+    return resultados, pendentes
+
+def registrar_rastreios(linhas, resultados):
+    """Monta o resultado de cada linha consultada e guarda no cache de rastreamento"""
+    for linha in linhas:
+        resultado = montar_resultado_rastreio(linha)
+        resultados[linha.codigo_rastreamento] = resultado
+        cache_rastreamento.definir(linha.codigo_rastreamento, (resultado, linha.data_atualizacao))
+
+@app.route('/api/rastrear/lote', methods=['POST'])
+def api_rastrear_lote():
+    codigos, erro = validar_lote_rastreio(request.get_json(silent=True) or {})
+    if erro:
+        return jsonify({
+            'success': False,
+            'error': erro
+        }), 400
+    
+    # Aproveitar o cache de rastreamento
+    resultados, pendentes = separar_rastreios_em_cache(codigos)
+    
+    # Uma consulta IN por bloco de códigos
+    for inicio in range(0, len(pendentes), LOTE_RASTREIO_TAMANHO_IN):
+        bloco = pendentes[inicio:inicio + LOTE_RASTREIO_TAMANHO_IN]
+        registrar_rastreios(db.session.execute(consulta_rastreio(bloco)).all(), resultados)
+    
+    for codigo in pendentes:
+        resultados.setdefault(codigo, {'encontrado': False})
+    
+    return jsonify({
+        'success': True,
+        'data': resultados,
+        'total': len(resultados)
+    })
+
+# API: Estatísticas dos caches em memória
+@app.route('/api/cache/estatisticas', methods=['GET'])
+def api_cache_estatisticas():
+    return jsonify({
+        'success': True,
+        'data': {
+            'rastreamento': cache_rastreamento.estatisticas(),
+            'respostas': cache_respostas.estatisticas()
+        }
+    })
+
+# Métricas no formato texto do Prometheus
+TIPO_CONTEUDO_METRICAS = 'text/plain; version=0.0.4; charset=utf-8'
+
+METRICAS_POOL = [
+    ('tamanho', 'expresso_db_pool_size', 'gauge', 'Conexões permanentes do pool'),
+    ('em_uso', 'expresso_db_pool_checkedout', 'gauge', 'Conexões emprestadas no momento'),
+    ('livres', 'expresso_db_pool_checkedin', 'gauge', 'Conexões ociosas no pool'),
+    ('overflow', 'expresso_db_pool_overflow', 'gauge', 'Conexões abertas além de pool_size'),
+    ('esperas', 'expresso_db_pool_checkouts_total', 'counter', 'Conexões solicitadas ao pool'),
+    ('espera_total_segundos', 'expresso_db_pool_wait_seconds_total', 'counter', 'Tempo total esperando por conexão'),
+    ('espera_maxima_segundos', 'expresso_db_pool_wait_seconds_max', 'gauge', 'Maior espera por conexão'),
+    ('timeouts', 'expresso_db_pool_timeouts_total', 'counter', 'Esperas que estouraram pool_timeout')
+]
+
+def linhas_metricas_pool():
+    """Métricas do pool de conexões do engine"""
+    pool = db.engine.pool
+    if not isinstance(pool, PoolMedido):
+        return []
+
+    valores = pool.metricas()
+    linhas = []
+    for chave, nome, tipo, descricao in METRICAS_POOL:
+        linhas.append(f'# HELP {nome} {descricao}')
+        linhas.append(f'# TYPE {nome} {tipo}')
+        linhas.append(f'{nome} {valores[chave]}')
+    return linhas
+
+# Migrações de schema versionadas
+def migracao_schema_inicial(conexao):
+    """Cria as tabelas que ainda não existem"""
+    db.metadata.create_all(conexao)
+
+def migracao_indices_entrega(conexao):
+    """Cria os índices de Entrega em bancos criados antes deles"""
+    for indice in Entrega.__table__.indexes:
+        indice.create(conexao, checkfirst=True)
+
+def migracao_contador_codigo(conexao):
+    """Cria a tabela do contador usado pelo alocador de códigos"""
+    ContadorCodigo.__table__.create(conexao, checkfirst=True)
+
+# Índice de busca textual: FTS5 no SQLite, tsvector + trigrama no Postgres
+CAMPOS_BUSCA = ['codigo_rastreamento', 'remetente_nome', 'destinatario_nome', 'remetente_endereco',
+                'destinatario_endereco', 'remetente_cidade', 'destinatario_cidade']
+DOCUMENTO_BUSCA_PG = "to_tsvector('portuguese'::regconfig, {})".format(
+    " || ' ' || ".join(f"coalesce({campo}, '')" for campo in CAMPOS_BUSCA[1:])
+)
+
+def migracao_indice_busca(conexao):
+    """Cria (ou reconstrói) o índice de busca textual de entregas"""
+    if conexao.dialect.name == 'postgresql':
+        conexao.execute(db.text(
+            f'CREATE INDEX IF NOT EXISTS ix_entrega_busca_texto ON entrega USING GIN ({DOCUMENTO_BUSCA_PG})'
+        ))
+        # CREATE EXTENSION exige privilégio; num savepoint, a falha não aborta a transação da migração
+        try:
+            with conexao.begin_nested():
+                conexao.execute(db.text('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+        except DBAPIError as e:
+            app.logger.warning(f"pg_trgm indisponível, a busca por trecho do código não terá índice: {e}")
+            return
+        conexao.execute(db.text(
+            'CREATE INDEX IF NOT EXISTS ix_entrega_codigo_trgm ON entrega '
+            'USING GIN (codigo_rastreamento gin_trgm_ops)'
+        ))
+        return
+    
+    colunas = ', '.join(CAMPOS_BUSCA)
+    novos = ', '.join(f'new.{campo}' for campo in CAMPOS_BUSCA)
+    antigos = ', '.join(f'old.{campo}' for campo in CAMPOS_BUSCA)
+    try:
+        conexao.execute(db.text(
+            f'CREATE VIRTUAL TABLE IF NOT EXISTS entrega_busca USING fts5({colunas}, '
+            "content='entrega', content_rowid='id', "
+            "tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+        ))
+    except OperationalError as e:
+        app.logger.warning(f"FTS5 indisponível, a busca usará LIKE: {e}")
+        return
+    
+    # Gatilhos mantêm o índice de conteúdo externo em sincronia com a tabela entrega
+    conexao.execute(db.text(
+        f'CREATE TRIGGER IF NOT EXISTS entrega_busca_ai AFTER INSERT ON entrega BEGIN '
+        f'INSERT INTO entrega_busca(rowid, {colunas}) VALUES (new.id, {novos}); END'
+    ))
+    conexao.execute(db.text(
+        f'CREATE TRIGGER IF NOT EXISTS entrega_busca_ad AFTER DELETE ON entrega BEGIN '
+        f"INSERT INTO entrega_busca(entrega_busca, rowid, {colunas}) VALUES ('delete', old.id, {antigos}); END"
+    ))
+    conexao.execute(db.text(
+        f'CREATE TRIGGER IF NOT EXISTS entrega_busca_au AFTER UPDATE OF {colunas} ON entrega BEGIN '
+        f"INSERT INTO entrega_busca(entrega_busca, rowid, {colunas}) VALUES ('delete', old.id, {antigos}); "
+        f'INSERT INTO entrega_busca(rowid, {colunas}) VALUES (new.id, {novos}); END'
+    ))
+    conexao.execute(db.text("INSERT INTO entrega_busca(entrega_busca) VALUES ('rebuild')"))
+
+def migracao_status_evento(conexao):
+    """Cria a tabela de histórico de status"""
+    StatusEvento.__table__.create(conexao, checkfirst=True)
+
+def migracao_estatistica_diaria(conexao):
+    """Cria o rollup diário de estatísticas e faz o backfill"""
+    EstatisticaDiaria.__table__.create(conexao, checkfirst=True)
+    reconstruir_estatistica_diaria(conexao)
+
+def migracao_data_criacao_obrigatoria(conexao):
+    """Preenche data_criacao nula (com data_atualizacao ou agora) e a torna NOT NULL no Postgres"""
+    tabela = Entrega.__table__
+    preenchidas = conexao.execute(tabela.update().where(tabela.c.data_criacao.is_(None)).values(
+        data_criacao=func.coalesce(tabela.c.data_atualizacao, datetime.utcnow())
+    )).rowcount
+    if preenchidas:
+        # Entregas sem data ficavam fora do rollup
+        reconstruir_estatistica_diaria(conexao)
+    # No SQLite, alterar a restrição exige recriar a tabela; bancos novos já nascem com NOT NULL
+    if conexao.dialect.name == 'postgresql':
+        conexao.execute(db.text('ALTER TABLE entrega ALTER COLUMN data_criacao SET NOT NULL'))
+
+# Lista ordenada de (versão, descrição, função); novas migrações entram no final
+MIGRACOES = [
+    (1, 'Schema inicial', migracao_schema_inicial),
+    (2, 'Índices de status, data_criacao, destinatario_cidade e usuario_id em entrega', migracao_indices_entrega),
+    (3, 'Contador de códigos de rastreamento', migracao_contador_codigo),
+    (4, 'Índice de busca textual de entregas', migracao_indice_busca),
+    (5, 'Histórico de status de entregas', migracao_status_evento),
+    (6, 'Rollup diário de estatísticas', migracao_estatistica_diaria),
+    (7, 'data_criacao obrigatória em entrega', migracao_data_criacao_obrigatoria),
+]
+
+def aplicar_migracoes():
+    """Aplica as migrações pendentes, cada uma em sua própria transação"""
+    VersaoSchema.__table__.create(db.engine, checkfirst=True)
+    versao_atual = db.session.query(func.max(VersaoSchema.versao)).scalar() or 0
+    db.session.commit()
+    
+    aplicadas = []
+    for versao, descricao, migracao in MIGRACOES:
+        if versao <= versao_atual:
+            continue
+        with db.engine.begin() as conexao:
+            migracao(conexao)
+            conexao.execute(VersaoSchema.__table__.insert().values(
+                versao=versao, descricao=descricao, aplicada_em=datetime.utcnow()
+            ))
+        app.logger.info(f"Migração {versao} aplicada: {descricao}")
+        aplicadas.append(versao)
+    return aplicadas
 
 def init_db():
     """Inicializar banco de dados"""
     try:
-        db.create_all()
+        aplicar_migracoes()
         
         # Criar usuário admin se não existir
         admin = Usuario.query.filter_by(username='admin').first()
@@ -344,33 +1287,87 @@ if __name__ == '__main__':
 
 from flask import jsonify
 
-# API: Listar todas as entregas
+# Paginação por cursor (keyset) da listagem de entregas
+CAMPOS_LISTAGEM_ENTREGA = [
+    'id', 'codigo_rastreamento', 'remetente_nome', 'remetente_cidade',
+    'destinatario_nome', 'destinatario_cidade', 'tipo_produto', 'peso',
+    'valor_declarado', 'status', 'data_criacao', 'data_atualizacao'
+]
+LIMITE_PADRAO_PAGINA = 50
+LIMITE_MAXIMO_PAGINA = 500
+
+def codificar_cursor(data_criacao, entrega_id):
+    """Gera cursor opaco a partir da posição (data_criacao, id)"""
+    bruto = json.dumps([data_criacao.isoformat(), entrega_id])
+    return base64.urlsafe_b64encode(bruto.encode('utf-8')).decode('ascii')
+
+def decodificar_cursor(cursor):
+    """Recupera (data_criacao, id) de um cursor; gera ValueError se inválido"""
+    try:
+        data_criacao, entrega_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return datetime.fromisoformat(data_criacao), int(entrega_id)
+    except (TypeError, ValueError, UnicodeError, binascii.Error):
+        raise ValueError('Cursor inválido')
+
+# API: Listar entregas (paginado por cursor)
 @app.route('/api/entregas', methods=['GET'])
 def api_entregas():
     try:
-        entregas = Entrega.query.all()
-        entregas_list = []
+        # Limite de itens por página
+        try:
+            limite = int(request.args.get('limit', LIMITE_PADRAO_PAGINA))
+        except ValueError:
+            return jsonify({'success': False, 'error': 'Parâmetro limit inválido'}), 400
+        limite = max(1, min(limite, LIMITE_MAXIMO_PAGINA))
         
-        for entrega in entregas:
-            entregas_list.append({
-                'id': entrega.id,
-                'codigo_rastreamento': entrega.codigo_rastreamento,
-                'remetente_nome': entrega.remetente_nome,
-                'remetente_cidade': entrega.remetente_cidade,
-                'destinatario_nome': entrega.destinatario_nome,
-                'destinatario_cidade': entrega.destinatario_cidade,
-                'tipo_produto': entrega.tipo_produto,
-                'peso': entrega.peso,
-                'valor_declarado': entrega.valor_declarado,
-                'status': entrega.status,
-                'data_criacao': entrega.data_criacao.isoformat() if entrega.data_criacao else None,
-                'data_atualizacao': entrega.data_atualizacao.isoformat() if entrega.data_atualizacao else None
-            })
+        # Projeção de campos
+        campos = CAMPOS_LISTAGEM_ENTREGA
+        if request.args.get('fields'):
+            campos = [campo.strip() for campo in request.args['fields'].split(',') if campo.strip()]
+            invalidos = [campo for campo in campos if campo not in CAMPOS_LISTAGEM_ENTREGA]
+            if invalidos:
+                return jsonify({
+                    'success': False,
+                    'error': f'Campos inválidos: {", ".join(invalidos)}'
+                }), 400
+        
+        # id e data_criacao são sempre lidos para montar o próximo cursor
+        colunas = [getattr(Entrega, campo) for campo in campos
+                   if campo not in ('id', 'data_criacao')]
+        query = db.session.query(Entrega.id, Entrega.data_criacao, *colunas)
+        
+        if request.args.get('cursor'):
+            try:
+                data_cursor, id_cursor = decodificar_cursor(request.args['cursor'])
+            except ValueError as e:
+                return jsonify({'success': False, 'error': str(e)}), 400
+            query = query.filter(or_(
+                Entrega.data_criacao < data_cursor,
+                and_(Entrega.data_criacao == data_cursor, Entrega.id < id_cursor)
+            ))
+        
+        linhas = query.order_by(
+            Entrega.data_criacao.desc(), Entrega.id.desc()
+        ).limit(limite + 1).all()
+        
+        proximo_cursor = None
+        if len(linhas) > limite:
+            linhas = linhas[:limite]
+            proximo_cursor = codificar_cursor(linhas[-1].data_criacao, linhas[-1].id)
+        
+        entregas_list = []
+        for linha in linhas:
+            item = {}
+            for campo in campos:
+                valor = getattr(linha, campo)
+                item[campo] = valor.isoformat() if isinstance(valor, datetime) else valor
+            entregas_list.append(item)
         
         return jsonify({
             'success': True,
             'data': entregas_list,
-            'total': len(entregas_list)
+            'quantidade': len(entregas_list),
+            'next_cursor': proximo_cursor
         })
     
     except Exception as e:
@@ -379,6 +1376,176 @@ def api_entregas():
             'error': str(e)
         }), 500
 
+# Filtros comuns de entregas (status, cidade de destino e período de criação)
+def interpretar_data(valor):
+    """Converte data no formato AAAA-MM-DD; gera ValueError se inválida"""
+    try:
+        return datetime.strptime(valor, '%Y-%m-%d')
+    except (TypeError, ValueError):
+        raise ValueError(f'Data inválida: {valor}. Use o formato AAAA-MM-DD')
+
+def aplicar_filtros_entrega(query, args):
+    """Aplica os filtros status, cidade, data_inicio e data_fim (inclusiva) à consulta"""
+    if args.get('status'):
+        query = query.filter(Entrega.status == args['status'])
+    if args.get('cidade'):
+        query = query.filter(Entrega.destinatario_cidade == args['cidade'])
+    if args.get('data_inicio'):
+        query = query.filter(Entrega.data_criacao >= interpretar_data(args['data_inicio']))
+    if args.get('data_fim'):
+        query = query.filter(Entrega.data_criacao < interpretar_data(args['data_fim']) + timedelta(days=1))
+    return query
+
+# Exportação em streaming (NDJSON ou CSV)
+TAMANHO_LOTE_EXPORTACAO = 1000
+
+class LinhaCSV:
+    """Buffer mínimo para o csv.writer: devolve a linha em vez de acumulá-la"""
+    def write(self, valor):
+        return valor
+
+def gerar_exportacao(linhas, formato):
+    """Gera o conteúdo da exportação linha a linha"""
+    if formato == 'csv':
+        escritor = csv.writer(LinhaCSV())
+        yield escritor.writerow(CAMPOS_LISTAGEM_ENTREGA)
+        for linha in linhas:
+            yield escritor.writerow([
+                valor.isoformat() if isinstance(valor, datetime) else valor
+                for valor in linha
+            ])
+    else:
+        for linha in linhas:
+            yield json.dumps({
+                campo: valor.isoformat() if isinstance(valor, datetime) else valor
+                for campo, valor in zip(CAMPOS_LISTAGEM_ENTREGA, linha)
+            }, ensure_ascii=False) + '\n'
+
+# API: Exportar entregas em streaming
+@app.route('/api/entregas/exportar', methods=['GET'])
+def api_exportar_entregas():
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'error': 'Autenticação necessária'}), 401
+    
+    formato = request.args.get('formato', 'ndjson')
+    if formato not in ('ndjson', 'csv'):
+        return jsonify({
+            'success': False,
+            'error': 'Formato inválido. Valores aceitos: ndjson, csv'
+        }), 400
+    
+    try:
+        query = aplicar_filtros_entrega(
+            db.session.query(*[getattr(Entrega, campo) for campo in CAMPOS_LISTAGEM_ENTREGA]),
+            request.args
+        )
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    # yield_per usa cursor no servidor (stream_results) e lê em lotes
+    linhas = query.order_by(Entrega.id).yield_per(TAMANHO_LOTE_EXPORTACAO)
+    
+    if formato == 'csv':
+        mimetype = 'text/csv'
+        nome_arquivo = 'entregas.csv'
+    else:
+        mimetype = 'application/x-ndjson'
+        nome_arquivo = 'entregas.ndjson'
+    
+    return Response(
+        stream_with_context(gerar_exportacao(linhas, formato)),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename={nome_arquivo}'}
+    )
+
+# Busca textual ranqueada
+BUSCA_LIMITE_MAXIMO = 100
+
+def buscar_entregas(termo, limite, deslocamento):
+    """Busca entregas por nome, endereço, cidade ou prefixo do código, ordenadas por relevância
+    
+    Retorna as linhas da página e se há mais resultados.
+    """
+    palavras = re.findall(r'\w+', termo)
+    if not palavras:
+        return [], False
+    
+    colunas = ('e.id, e.codigo_rastreamento, e.remetente_nome, e.remetente_cidade, '
+               'e.destinatario_nome, e.destinatario_cidade, e.status, e.data_criacao')
+    parametros = {'limite': limite + 1, 'deslocamento': deslocamento}
+    
+    if db.engine.dialect.name == 'postgresql':
+        parametros['consulta'] = ' & '.join(f'{palavra}:*' for palavra in palavras)
+        parametros['codigo'] = f'%{termo.strip()}%'
+        sql = (
+            f'SELECT {colunas}, '
+            f"ts_rank({DOCUMENTO_BUSCA_PG}, to_tsquery('portuguese', :consulta)) "
+            f'+ CASE WHEN e.codigo_rastreamento ILIKE :codigo THEN 1 ELSE 0 END AS relevancia '
+            f'FROM entrega e '
+            f"WHERE {DOCUMENTO_BUSCA_PG} @@ to_tsquery('portuguese', :consulta) "
+            f'OR e.codigo_rastreamento ILIKE :codigo '
+            f'ORDER BY relevancia DESC, e.id DESC LIMIT :limite OFFSET :deslocamento'
+        )
+    elif db.session.execute(db.text(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'entrega_busca'"
+    )).first():
+        parametros['consulta'] = ' '.join(f'"{palavra}"*' for palavra in palavras)
+        sql = (
+            f'SELECT {colunas}, -bm25(entrega_busca) AS relevancia '
+            f'FROM entrega_busca JOIN entrega e ON e.id = entrega_busca.rowid '
+            f'WHERE entrega_busca MATCH :consulta '
+            f'ORDER BY bm25(entrega_busca), e.id DESC LIMIT :limite OFFSET :deslocamento'
+        )
+    else:
+        # Sem índice textual disponível: todas as palavras devem aparecer em algum campo
+        condicoes = []
+        for i, palavra in enumerate(palavras):
+            parametros[f'p{i}'] = f'%{palavra}%'
+            condicoes.append('(' + ' OR '.join(f'e.{campo} LIKE :p{i}' for campo in CAMPOS_BUSCA) + ')')
+        sql = (
+            f'SELECT {colunas}, 0 AS relevancia FROM entrega e WHERE {" AND ".join(condicoes)} '
+            f'ORDER BY e.id DESC LIMIT :limite OFFSET :deslocamento'
+        )
+    
+    linhas = db.session.execute(db.text(sql), parametros).mappings().all()
+    return linhas[:limite], len(linhas) > limite
+
+# API: Buscar entregas por texto
+@app.route('/api/entregas/busca', methods=['GET'])
+def api_buscar_entregas():
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'error': 'Autenticação necessária'}), 401
+    
+    termo = request.args.get('q', '').strip()
+    if not termo:
+        return jsonify({'success': False, 'error': 'Parâmetro q é obrigatório'}), 400
+    
+    try:
+        limite = max(1, min(int(request.args.get('limit', 20)), BUSCA_LIMITE_MAXIMO))
+        pagina = max(1, int(request.args.get('pagina', 1)))
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Parâmetros limit/pagina inválidos'}), 400
+    
+    try:
+        linhas, tem_mais = buscar_entregas(termo, limite, (pagina - 1) * limite)
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+    
+    resultados = []
+    for linha in linhas:
+        item = dict(linha)
+        item['relevancia'] = round(float(item['relevancia'] or 0), 4)
+        if item['data_criacao'] is not None and not isinstance(item['data_criacao'], str):
+            item['data_criacao'] = item['data_criacao'].isoformat()
+        resultados.append(item)
+    
+    return jsonify({
+        'success': True,
+        'data': resultados,
+        'pagina': pagina,
+        'proxima_pagina': pagina + 1 if tem_mais else None
+    })
+
 # API: Buscar entrega por código de rastreamento
 @app.route('/api/entregas/<codigo_rastreamento>', methods=['GET'])
 def api_entrega_por_codigo(codigo_rastreamento):
@@ -391,28 +1558,33 @@ def api_entrega_por_codigo(codigo_rastreamento):
                 'error': 'Entrega não encontrada'
             }), 404
         
-        entrega_data = {
-            'id': entrega.id,
-            'codigo_rastreamento': entrega.codigo_rastreamento,
-            'remetente_nome': entrega.remetente_nome,
-            'remetente_endereco': entrega.remetente_endereco,
-            'remetente_cidade': entrega.remetente_cidade,
-            'destinatario_nome': entrega.destinatario_nome,
-            'destinatario_endereco': entrega.destinatario_endereco,
-            'destinatario_cidade': entrega.destinatario_cidade,
-            'tipo_produto': entrega.tipo_produto,
-            'peso': entrega.peso,
-            'valor_declarado': entrega.valor_declarado,
-            'observacoes': entrega.observacoes,
-            'status': entrega.status,
-            'data_criacao': entrega.data_criacao.isoformat() if entrega.data_criacao else None,
-            'data_atualizacao': entrega.data_atualizacao.isoformat() if entrega.data_atualizacao else None
-        }
+        def montar_dados():
+            return {
+                'success': True,
+                'data': {
+                    'id': entrega.id,
+                    'codigo_rastreamento': entrega.codigo_rastreamento,
+                    'remetente_nome': entrega.remetente_nome,
+                    'remetente_endereco': entrega.remetente_endereco,
+                    'remetente_cidade': entrega.remetente_cidade,
+                    'destinatario_nome': entrega.destinatario_nome,
+                    'destinatario_endereco': entrega.destinatario_endereco,
+                    'destinatario_cidade': entrega.destinatario_cidade,
+                    'tipo_produto': entrega.tipo_produto,
+                    'peso': entrega.peso,
+                    'valor_declarado': entrega.valor_declarado,
+                    'observacoes': entrega.observacoes,
+                    'status': entrega.status,
+                    'data_criacao': entrega.data_criacao.isoformat() if entrega.data_criacao else None,
+                    'data_atualizacao': entrega.data_atualizacao.isoformat() if entrega.data_atualizacao else None
+                }
+            }
         
-        return jsonify({
-            'success': True,
-            'data': entrega_data
-        })
+        if entrega.data_atualizacao is None:
+            return jsonify(montar_dados())
+        
+        etag, ultima_modificacao = validadores_http('entrega', entrega.codigo_rastreamento, entrega.data_atualizacao)
+        return resposta_condicional(etag, ultima_modificacao, montar_dados)
     
     except Exception as e:
         return jsonify({
@@ -439,13 +1611,7 @@ def api_criar_entrega():
                 }), 400
         
         # Gerar código de rastreamento único
-        import random
-        import string
-        codigo = 'EI' + ''.join(random.choices(string.digits, k=10))
-        
-        # Verificar se código já existe
-        while Entrega.query.filter_by(codigo_rastreamento=codigo).first():
-            codigo = 'EI' + ''.join(random.choices(string.digits, k=10))
+        codigo = alocador_codigos.proximo()
         
         # Criar nova entrega
         nova_entrega = Entrega(
@@ -465,6 +1631,8 @@ def api_criar_entrega():
         
         db.session.add(nova_entrega)
         db.session.commit()
+        cache_respostas.invalidar()
+        cache_rastreamento.invalidar(codigo)
         
         return jsonify({
             'success': True,
@@ -483,6 +1651,559 @@ def api_criar_entrega():
             'error': str(e)
         }), 500
 
+# ============================================================================
+# IMPORTAÇÃO EM LOTE DE ENTREGAS
+# ============================================================================
+
+CAMPOS_OBRIGATORIOS_ENTREGA = ['remetente_nome', 'remetente_endereco', 'remetente_cidade',
+                               'destinatario_nome', 'destinatario_endereco', 'destinatario_cidade',
+                               'tipo_produto']
+COLUNAS_IMPORTACAO = CAMPOS_OBRIGATORIOS_ENTREGA + ['peso', 'valor_declarado', 'observacoes']
+LOTE_IMPORTACAO_MAXIMO = 100000
+
+def ler_manifesto(conteudo, formato):
+    """Converte o manifesto (JSON com lista de objetos ou CSV com cabeçalho) em lista de dicts"""
+    if formato == 'csv':
+        return list(csv.DictReader(io.StringIO(conteudo)))
+    registros = json.loads(conteudo)
+    if not isinstance(registros, list):
+        raise ValueError('O manifesto JSON deve ser uma lista de entregas')
+    return registros
+
+def validar_registro_entrega(registro):
+    """Valida e normaliza um registro do manifesto; retorna (dados, erro)"""
+    if not isinstance(registro, dict):
+        return None, 'Registro deve ser um objeto'
+    
+    for campo in CAMPOS_OBRIGATORIOS_ENTREGA:
+        if not registro.get(campo):
+            return None, f'Campo obrigatório: {campo}'
+    
+    # Texto e tamanho conferidos aqui: no COPY um valor longo demais aborta o lote inteiro
+    for campo in CAMPOS_OBRIGATORIOS_ENTREGA + ['observacoes']:
+        valor = registro.get(campo)
+        if valor in (None, '') and campo == 'observacoes':
+            continue
+        if not isinstance(valor, str):
+            return None, f'Campo {campo} deve ser texto'
+        tamanho = Entrega.__table__.c[campo].type.length
+        if tamanho and len(valor) > tamanho:
+            return None, f'Campo {campo} excede {tamanho} caracteres'
+    
+    dados = {campo: registro[campo] for campo in CAMPOS_OBRIGATORIOS_ENTREGA}
+    for campo in ('peso', 'valor_declarado'):
+        valor = registro.get(campo)
+        if valor in (None, ''):
+            dados[campo] = None
+            continue
+        try:
+            dados[campo] = float(valor)
+        except (TypeError, ValueError):
+            return None, f'Valor numérico inválido em {campo}: {valor}'
+    dados['observacoes'] = registro.get('observacoes') or ''
+    return dados, None
+
+def copiar_entregas_postgres(linhas):
+    """Insere as linhas com COPY ... FROM STDIN na conexão da transação atual"""
+    colunas = list(linhas[0].keys())
+    buffer = io.StringIO()
+    # QUOTE_NONNUMERIC: None vira campo vazio sem aspas, que o COPY lê como NULL
+    escritor = csv.writer(buffer, quoting=csv.QUOTE_NONNUMERIC)
+    for linha in linhas:
+        escritor.writerow([linha[coluna] for coluna in colunas])
+    buffer.seek(0)
+    
+    cursor = db.session.connection().connection.cursor()
+    cursor.copy_expert(
+        f'COPY entrega ({", ".join(colunas)}) FROM STDIN WITH (FORMAT csv)', buffer
+    )
+
+def importar_entregas(registros, usuario_id=None, estrito=False):
+    """Valida e insere um lote de entregas em uma única transação
+    
+    Retorna as entregas criadas (linha e código), os erros por linha e a vazão.
+    Com estrito=True nada é inserido se alguma linha for inválida.
+    """
+    inicio = time.perf_counter()
+    
+    validos = []
+    erros = []
+    for numero, registro in enumerate(registros, 1):
+        dados, erro = validar_registro_entrega(registro)
+        if erro:
+            erros.append({'linha': numero, 'erro': erro})
+        else:
+            validos.append((numero, dados))
+    
+    criadas = []
+    if validos and not (estrito and erros):
+        agora = datetime.utcnow()
+        codigos = alocador_codigos.gerar(len(validos))
+        linhas = []
+        for (numero, dados), codigo in zip(validos, codigos):
+            linhas.append(dict(
+                dados,
+                codigo_rastreamento=codigo,
+                status='pendente',
+                data_criacao=agora,
+                data_atualizacao=agora,
+                usuario_id=usuario_id
+            ))
+            criadas.append({'linha': numero, 'codigo_rastreamento': codigo})
+        
+        try:
+            if db.engine.dialect.name == 'postgresql':
+                copiar_entregas_postgres(linhas)
+            else:
+                # executemany em lotes (insertmanyvalues do SQLAlchemy)
+                db.session.execute(Entrega.__table__.insert(), linhas)
+            
+            deltas = Counter(
+                chave_estatistica(agora, 'pendente', linha['destinatario_cidade'], linha['tipo_produto'])
+                for linha in linhas
+            )
+            aplicar_deltas_estatistica(db.session.connection(), deltas)
+            db.session.commit()
+            cache_respostas.invalidar()
+        except Exception:
+            db.session.rollback()
+            raise
+        
+        for item in criadas:
+            cache_rastreamento.invalidar(item['codigo_rastreamento'])
+    
+    duracao = time.perf_counter() - inicio
+    return {
+        'inseridas': len(criadas),
+        'entregas': criadas,
+        'erros': erros,
+        'duracao_segundos': round(duracao, 3),
+        'linhas_por_segundo': round(len(criadas) / duracao, 1) if duracao > 0 else 0
+    }
+
+# API: Importar entregas em lote (JSON ou CSV)
+@app.route('/api/entregas/lote', methods=['POST'])
+def api_importar_entregas():
+    try:
+        formato = 'csv' if request.mimetype in ('text/csv', 'application/csv') else 'json'
+        try:
+            registros = ler_manifesto(request.get_data(as_text=True), formato)
+        except ValueError as e:
+            return jsonify({'success': False, 'error': f'Manifesto inválido: {e}'}), 400
+        
+        if len(registros) > LOTE_IMPORTACAO_MAXIMO:
+            return jsonify({
+                'success': False,
+                'error': f'Máximo de {LOTE_IMPORTACAO_MAXIMO} entregas por lote'
+            }), 400
+        
+        estrito = request.args.get('estrito', '').lower() in ('1', 'true', 'sim')
+        resultado = importar_entregas(registros, usuario_id=session.get('user_id'), estrito=estrito)
+        
+        return jsonify({
+            'success': not (estrito and resultado['erros']),
+            'data': resultado
+        }), 201 if resultado['inseridas'] else 400
+    
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+# ============================================================================
+# HISTÓRICO DE STATUS
+# ============================================================================
+
+def registrar_mudanca_status(entrega, novo_status, agora=None, usuario_id=None):
+    """Altera o status e adiciona o evento correspondente à mesma transação (sem commit)"""
+    agora = agora or datetime.utcnow()
+    inicio_etapa = entrega.data_atualizacao or entrega.data_criacao
+    db.session.add(StatusEvento(
+        entrega_id=entrega.id,
+        status_anterior=entrega.status,
+        status=novo_status,
+        data_evento=agora,
+        duracao_segundos=(agora - inicio_etapa).total_seconds() if inicio_etapa else None,
+        usuario_id=usuario_id
+    ))
+    entrega.status = novo_status
+    entrega.data_atualizacao = agora
+
+def calcular_latencia_etapas(data_inicio=None, data_fim=None):
+    """Tempo médio, mínimo e máximo (em horas) em cada etapa, com uma consulta agregada"""
+    query = db.session.query(
+        StatusEvento.status_anterior,
+        StatusEvento.status,
+        func.count(StatusEvento.id),
+        func.avg(StatusEvento.duracao_segundos),
+        func.min(StatusEvento.duracao_segundos),
+        func.max(StatusEvento.duracao_segundos)
+    )
+    if data_inicio:
+        query = query.filter(StatusEvento.data_evento >= data_inicio)
+    if data_fim:
+        query = query.filter(StatusEvento.data_evento < data_fim)
+    
+    linhas = query.group_by(StatusEvento.status_anterior, StatusEvento.status).all()
+    return [{
+        'de': de,
+        'para': para,
+        'total': total,
+        'media_horas': round(media / 3600, 2) if media is not None else None,
+        'minimo_horas': round(minimo / 3600, 2) if minimo is not None else None,
+        'maximo_horas': round(maximo / 3600, 2) if maximo is not None else None
+    } for de, para, total, media, minimo, maximo in linhas]
+
+# API: Atualizar status em lote (leitura de pacotes no depósito)
+LOTE_STATUS_MAXIMO = 5000
+
+@app.route('/api/entregas/status/lote', methods=['POST'])
+def api_atualizar_status_lote():
+    data = request.get_json(silent=True) or {}
+    atualizacoes = data.get('atualizacoes')
+    
+    if not isinstance(atualizacoes, list):
+        return jsonify({
+            'success': False,
+            'error': 'Informe "atualizacoes" como uma lista de {"codigo", "status"}'
+        }), 400
+    
+    if len(atualizacoes) > LOTE_STATUS_MAXIMO:
+        return jsonify({
+            'success': False,
+            'error': f'Máximo de {LOTE_STATUS_MAXIMO} atualizações por requisição'
+        }), 400
+    
+    # Validação em memória; para códigos repetidos vale a última leitura
+    resultados = {}
+    novos_status = {}
+    # Itens sem código válido não têm chave em resultados: erro pela posição na lista
+    erros = []
+    for indice, item in enumerate(atualizacoes):
+        codigo = item.get('codigo') if isinstance(item, dict) else None
+        status = item.get('status') if isinstance(item, dict) else None
+        if not isinstance(codigo, str) or not codigo:
+            erros.append({'indice': indice, 'success': False, 'error': 'Código de rastreamento ausente ou inválido'})
+            continue
+        if status not in STATUS_VALIDOS:
+            resultados[codigo] = {'success': False, 'error': f'Status inválido: {status}'}
+            novos_status.pop(codigo, None)
+        else:
+            novos_status[codigo] = status
+            resultados.pop(codigo, None)
+    
+    try:
+        # Estado atual das entregas com uma consulta IN por bloco
+        codigos = list(novos_status)
+        atuais = {}
+        for inicio in range(0, len(codigos), LOTE_RASTREIO_TAMANHO_IN):
+            bloco = codigos[inicio:inicio + LOTE_RASTREIO_TAMANHO_IN]
+            for linha in db.session.query(
+                Entrega.id, Entrega.codigo_rastreamento, Entrega.status,
+                Entrega.data_criacao, Entrega.data_atualizacao,
+                Entrega.destinatario_cidade, Entrega.tipo_produto
+            ).filter(Entrega.codigo_rastreamento.in_(bloco)).with_for_update():
+                atuais[linha.codigo_rastreamento] = linha
+        
+        agora = datetime.utcnow()
+        eventos = []
+        deltas = Counter()
+        codigos_por_status = defaultdict(list)
+        for codigo, status in novos_status.items():
+            atual = atuais.get(codigo)
+            if atual is None:
+                resultados[codigo] = {'success': False, 'error': 'Entrega não encontrada'}
+                continue
+            
+            alterado = atual.status != status
+            resultados[codigo] = {'success': True, 'status': status, 'alterado': alterado}
+            if not alterado:
+                continue
+            
+            inicio_etapa = atual.data_atualizacao or atual.data_criacao
+            eventos.append({
+                'entrega_id': atual.id,
+                'status_anterior': atual.status,
+                'status': status,
+                'data_evento': agora,
+                'duracao_segundos': (agora - inicio_etapa).total_seconds() if inicio_etapa else None,
+                'usuario_id': session.get('user_id')
+            })
+            codigos_por_status[status].append(codigo)
+            if atual.data_criacao is not None:
+                deltas[chave_estatistica(atual.data_criacao, atual.status,
+                                         atual.destinatario_cidade, atual.tipo_produto)] -= 1
+                deltas[chave_estatistica(atual.data_criacao, status,
+                                         atual.destinatario_cidade, atual.tipo_produto)] += 1
+        
+        # Um UPDATE ... WHERE codigo_rastreamento IN (...) por status, tudo na mesma transação
+        for status, codigos_status in codigos_por_status.items():
+            for inicio in range(0, len(codigos_status), LOTE_RASTREIO_TAMANHO_IN):
+                bloco = codigos_status[inicio:inicio + LOTE_RASTREIO_TAMANHO_IN]
+                db.session.execute(
+                    Entrega.__table__.update()
+                    .where(Entrega.__table__.c.codigo_rastreamento.in_(bloco))
+                    .values(status=status, data_atualizacao=agora)
+                )
+        if eventos:
+            db.session.execute(StatusEvento.__table__.insert(), eventos)
+        aplicar_deltas_estatistica(db.session.connection(), deltas)
+        db.session.commit()
+        cache_respostas.invalidar()
+    
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+    
+    mudancas = []
+    for status, lista in codigos_por_status.items():
+        for codigo in lista:
+            cache_rastreamento.invalidar(codigo)
+            mudancas.append(evento_status(codigo, status, agora))
+    publicar_mudancas_status(mudancas)
+    
+    return jsonify({
+        'success': True,
+        'data': resultados,
+        'erros': erros,
+        'atualizadas': len(eventos)
+    })
+
+# API: Histórico de status de uma entrega
+@app.route('/api/entregas/<codigo_rastreamento>/historico', methods=['GET'])
+def api_historico_status(codigo_rastreamento):
+    try:
+        entrega = db.session.query(Entrega.id, Entrega.data_criacao).filter_by(
+            codigo_rastreamento=codigo_rastreamento
+        ).first()
+        
+        if not entrega:
+            return jsonify({
+                'success': False,
+                'error': 'Entrega não encontrada'
+            }), 404
+        
+        eventos = StatusEvento.query.filter_by(entrega_id=entrega.id).order_by(StatusEvento.data_evento).all()
+        
+        return jsonify({
+            'success': True,
+            'data': {
+                'codigo_rastreamento': codigo_rastreamento,
+                'data_criacao': entrega.data_criacao.isoformat() if entrega.data_criacao else None,
+                'eventos': [{
+                    'status_anterior': evento.status_anterior,
+                    'status': evento.status,
+                    'data_evento': evento.data_evento.isoformat(),
+                    'duracao_horas': round(evento.duracao_segundos / 3600, 2) if evento.duracao_segundos is not None else None
+                } for evento in eventos]
+            }
+        })
+    
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+# API: Latência por etapa (pendente → coletado → em_transito → entregue)
+@app.route('/api/estatisticas/etapas', methods=['GET'])
+def api_latencia_etapas():
+    try:
+        data_inicio = interpretar_data(request.args['data_inicio']) if request.args.get('data_inicio') else None
+        data_fim = interpretar_data(request.args['data_fim']) + timedelta(days=1) if request.args.get('data_fim') else None
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    try:
+        return jsonify({
+            'success': True,
+            'data': calcular_latencia_etapas(data_inicio, data_fim)
+        })
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+# ============================================================================
+# EVENTOS EM TEMPO REAL (SERVER-SENT EVENTS)
+# ============================================================================
+
+CANAL_OPERACAO = 'entregas'
+CANAL_POSTGRES = 'entregas_status'
+SSE_INTERVALO_HEARTBEAT = 15
+# Conexões SSE são encerradas periodicamente; o EventSource do navegador reconecta sozinho
+SSE_DURACAO_MAXIMA = int(os.environ.get('SSE_DURACAO_MAXIMA', 300))
+# Cada stream ocupa uma thread do worker: acima do limite, 503 e o cliente consulta por polling
+SSE_MAXIMO_CONEXOES = int(os.environ.get('SSE_MAXIMO_CONEXOES', 8))
+# Com vários workers do gunicorn, LISTEN/NOTIFY do Postgres distribui os eventos entre eles
+SSE_POSTGRES_NOTIFY = os.environ.get('SSE_POSTGRES_NOTIFY', '').lower() in ('1', 'true', 'sim')
+
+class BarramentoEventos:
+    """Pub/sub em memória: cada assinante recebe uma fila própria por canal"""
+    
+    def __init__(self, tamanho_fila=100):
+        self.tamanho_fila = tamanho_fila
+        self._assinantes = defaultdict(set)
+        self._lock = threading.Lock()
+    
+    def assinar(self, canal, limite=None):
+        """Fila do assinante, ou None se já houver `limite` assinaturas no barramento"""
+        fila = queue.Queue(maxsize=self.tamanho_fila)
+        with self._lock:
+            if limite is not None and sum(len(filas) for filas in self._assinantes.values()) >= limite:
+                return None
+            self._assinantes[canal].add(fila)
+        return fila
+    
+    def cancelar(self, canal, fila):
+        with self._lock:
+            self._assinantes[canal].discard(fila)
+            if not self._assinantes[canal]:
+                del self._assinantes[canal]
+    
+    def publicar(self, canal, evento):
+        """Entrega o evento aos assinantes do canal; assinantes lentos perdem eventos"""
+        with self._lock:
+            filas = list(self._assinantes.get(canal, ()))
+        for fila in filas:
+            try:
+                fila.put_nowait(evento)
+            except queue.Full:
+                pass
+    
+    def total_assinantes(self):
+        with self._lock:
+            return sum(len(filas) for filas in self._assinantes.values())
+
+barramento_eventos = BarramentoEventos()
+_ouvinte_postgres = None
+_ouvinte_postgres_lock = threading.Lock()
+_parar_ouvinte = threading.Event()
+
+def distribuir_evento_status(evento):
+    """Publica a mudança no canal da entrega e no canal da operação"""
+    barramento_eventos.publicar(f"entrega:{evento['codigo']}", evento)
+    barramento_eventos.publicar(CANAL_OPERACAO, evento)
+
+def criar_engine_ouvinte(engine):
+    """Engine própria do LISTEN: conexão dedicada em autocommit, fora do pool da aplicação"""
+    return create_engine(engine.url, poolclass=NullPool, isolation_level='AUTOCOMMIT')
+
+def repassar_notificacoes(driver):
+    """Lê os NOTIFY pendentes da conexão do driver e publica no barramento local"""
+    driver.poll()
+    while driver.notifies:
+        notificacao = driver.notifies.pop(0)
+        for evento in json.loads(notificacao.payload):
+            distribuir_evento_status(evento)
+
+def ouvir_postgres(engine, parar):
+    """Thread que recebe os NOTIFY do Postgres e repassa ao barramento local"""
+    while not parar.is_set():
+        try:
+            with engine.connect() as conexao:
+                conexao.exec_driver_sql(f'LISTEN {CANAL_POSTGRES}')
+                driver = conexao.connection.driver_connection
+                while not parar.is_set():
+                    if select.select([driver], [], [], SSE_INTERVALO_HEARTBEAT) != ([], [], []):
+                        repassar_notificacoes(driver)
+        except Exception as e:
+            app.logger.error(f"Erro no LISTEN do Postgres, reconectando: {e}")
+            parar.wait(5)
+
+def garantir_ouvinte_postgres(engine=None):
+    """Inicia o ouvinte no worker atual (depois do fork do gunicorn) se configurado"""
+    global _ouvinte_postgres
+    # A engine é resolvida aqui, no contexto da aplicação: a thread não tem contexto próprio
+    engine = engine or db.engine
+    if not SSE_POSTGRES_NOTIFY or engine.dialect.name != 'postgresql':
+        return
+    with _ouvinte_postgres_lock:
+        if _ouvinte_postgres is None or not _ouvinte_postgres.is_alive():
+            _parar_ouvinte.clear()
+            _ouvinte_postgres = threading.Thread(
+                target=ouvir_postgres, args=(criar_engine_ouvinte(engine), _parar_ouvinte),
+                daemon=True, name='ouvinte-postgres'
+            )
+            _ouvinte_postgres.start()
+
+def publicar_mudancas_status(eventos):
+    """Publica mudanças de status já confirmadas (chamar depois do commit)"""
+    if not eventos:
+        return
+    if SSE_POSTGRES_NOTIFY and db.engine.dialect.name == 'postgresql':
+        # O payload do NOTIFY é limitado a 8000 bytes: enviar em blocos pequenos
+        with db.engine.begin() as conexao:
+            for inicio in range(0, len(eventos), 50):
+                conexao.execute(db.text('SELECT pg_notify(:canal, :payload)'), {
+                    'canal': CANAL_POSTGRES,
+                    'payload': json.dumps(eventos[inicio:inicio + 50])
+                })
+        return
+    for evento in eventos:
+        distribuir_evento_status(evento)
+
+def evento_status(codigo, status, data_atualizacao):
+    return {'codigo': codigo, 'status': status, 'data_atualizacao': data_atualizacao.isoformat()}
+
+def formatar_sse(evento, nome='status'):
+    return f'event: {nome}\ndata: {json.dumps(evento, ensure_ascii=False)}\n\n'
+
+def gerar_stream_sse(canal, fila, inicial=None):
+    """Gera o stream SSE: estado inicial, eventos do canal e heartbeats"""
+    limite = time.monotonic() + SSE_DURACAO_MAXIMA
+    try:
+        yield 'retry: 3000\n\n'
+        if inicial is not None:
+            yield formatar_sse(inicial)
+        while time.monotonic() < limite:
+            try:
+                yield formatar_sse(fila.get(timeout=SSE_INTERVALO_HEARTBEAT))
+            except queue.Empty:
+                yield ': heartbeat\n\n'
+    finally:
+        barramento_eventos.cancelar(canal, fila)
+
+def resposta_sse(canal, inicial=None):
+    garantir_ouvinte_postgres()
+    fila = barramento_eventos.assinar(canal, limite=SSE_MAXIMO_CONEXOES)
+    if fila is None:
+        return jsonify({
+            'success': False,
+            'error': 'Limite de conexões em tempo real atingido; consulte o status novamente mais tarde'
+        }), 503, {'Retry-After': '30'}
+    return Response(
+        gerar_stream_sse(canal, fila, inicial),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+# API: Acompanhar uma entrega em tempo real
+@app.route('/api/rastrear/<codigo>/stream')
+def api_rastrear_stream(codigo):
+    entrega = db.session.query(
+        Entrega.codigo_rastreamento, Entrega.status, Entrega.data_atualizacao
+    ).filter_by(codigo_rastreamento=codigo).first()
+    
+    if not entrega:
+        return jsonify({'encontrado': False}), 404
+    
+    inicial = evento_status(entrega.codigo_rastreamento, entrega.status, entrega.data_atualizacao)
+    return resposta_sse(f'entrega:{codigo}', inicial)
+
+# API: Feed de mudanças de status da operação
+@app.route('/api/eventos/stream')
+def api_eventos_stream():
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'error': 'Autenticação necessária'}), 401
+    return resposta_sse(CANAL_OPERACAO)
+
 # API: Atualizar status da entrega
 @app.route('/api/entregas/<codigo_rastreamento>/status', methods=['PUT'])
 def api_atualizar_status(codigo_rastreamento):
@@ -497,11 +2218,10 @@ def api_atualizar_status(codigo_rastreamento):
             }), 400
         
         # Validar status
-        status_validos = ['pendente', 'coletado', 'em_transito', 'entregue', 'cancelado']
-        if novo_status not in status_validos:
+        if novo_status not in STATUS_VALIDOS:
             return jsonify({
                 'success': False,
-                'error': f'Status inválido. Valores aceitos: {", ".join(status_validos)}'
+                'error': f'Status inválido. Valores aceitos: {", ".join(STATUS_VALIDOS)}'
             }), 400
         
         entrega = Entrega.query.filter_by(codigo_rastreamento=codigo_rastreamento).first()
@@ -512,9 +2232,15 @@ def api_atualizar_status(codigo_rastreamento):
                 'error': 'Entrega não encontrada'
             }), 404
         
-        entrega.status = novo_status
-        entrega.data_atualizacao = datetime.utcnow()
-        db.session.commit()
+        # Reenvio do mesmo status não gera evento nem altera a entrega
+        if entrega.status != novo_status:
+            registrar_mudanca_status(entrega, novo_status, usuario_id=session.get('user_id'))
+            db.session.commit()
+            cache_respostas.invalidar()
+            cache_rastreamento.invalidar(entrega.codigo_rastreamento)
+            publicar_mudancas_status([
+                evento_status(entrega.codigo_rastreamento, entrega.status, entrega.data_atualizacao)
+            ])
         
         return jsonify({
             'success': True,
@@ -533,43 +2259,35 @@ def api_atualizar_status(codigo_rastreamento):
             'error': str(e)
         }), 500
 
+def montar_estatisticas_api():
+    """Payload de /api/estatisticas (armazenado no cache de respostas)"""
+    # Entregas por cidade (top 5)
+    return formatar_estatisticas_api(calcular_estatisticas_status(), calcular_top_cidades(5))
+
+def formatar_estatisticas_api(resumo, cidades_destino):
+    """Monta o payload de /api/estatisticas a partir do resumo por status e das cidades"""
+    por_status = resumo['por_status']
+    
+    return {
+        'total_entregas': resumo['total'],
+        'entregas_por_status': {
+            'pendente': por_status.get('pendente', 0),
+            'em_transito': por_status.get('em_transito', 0),
+            'entregue': por_status.get('entregue', 0),
+            'cancelado': por_status.get('cancelado', 0)
+        },
+        'taxa_sucesso': round(resumo['taxa_sucesso'], 2),
+        'top_cidades_destino': [
+            {'cidade': cidade[0], 'total': cidade[1]} 
+            for cidade in cidades_destino
+        ]
+    }
+
 # API: Estatísticas gerais
 @app.route('/api/estatisticas', methods=['GET'])
 def api_estatisticas():
     try:
-        total_entregas = Entrega.query.count()
-        entregas_pendentes = Entrega.query.filter_by(status='pendente').count()
-        entregas_em_transito = Entrega.query.filter_by(status='em_transito').count()
-        entregas_entregues = Entrega.query.filter_by(status='entregue').count()
-        entregas_canceladas = Entrega.query.filter_by(status='cancelado').count()
-        
-        # Calcular taxa de sucesso
-        if total_entregas > 0:
-            taxa_sucesso = round((entregas_entregues / total_entregas) * 100, 2)
-        else:
-            taxa_sucesso = 0
-        
-        # Entregas por cidade (top 5)
-        from sqlalchemy import func
-        cidades_destino = db.session.query(
-            Entrega.destinatario_cidade,
-            func.count(Entrega.id).label('total')
-        ).group_by(Entrega.destinatario_cidade).order_by(func.count(Entrega.id).desc()).limit(5).all()
-        
-        estatisticas = {
-            'total_entregas': total_entregas,
-            'entregas_por_status': {
-                'pendente': entregas_pendentes,
-                'em_transito': entregas_em_transito,
-                'entregue': entregas_entregues,
-                'cancelado': entregas_canceladas
-            },
-            'taxa_sucesso': taxa_sucesso,
-            'top_cidades_destino': [
-                {'cidade': cidade[0], 'total': cidade[1]} 
-                for cidade in cidades_destino
-            ]
-        }
+        estatisticas = cache_respostas.obter_ou_gerar('api_estatisticas', montar_estatisticas_api)
         
         return jsonify({
             'success': True,
@@ -619,15 +2337,26 @@ def api_documentacao():
         'version': '1.0.0',
         'description': 'API REST para gestão de entregas e rastreamento logístico',
         'endpoints': {
-            'GET /api/entregas': 'Listar todas as entregas',
+            'GET /api/entregas': 'Listar entregas (parâmetros: limit, cursor, fields)',
             'GET /api/entregas/<codigo>': 'Buscar entrega por código de rastreamento',
+            'GET /api/entregas/exportar': 'Exportar entregas em NDJSON ou CSV (parâmetros: formato, status, cidade, data_inicio, data_fim)',
+            'GET /api/entregas/busca': 'Buscar entregas por nome, endereço, cidade ou código (parâmetros: q, limit, pagina)',
             'POST /api/entregas': 'Criar nova entrega',
+            'POST /api/entregas/lote': 'Importar entregas em lote (JSON ou text/csv; parâmetro: estrito)',
             'PUT /api/entregas/<codigo>/status': 'Atualizar status da entrega',
+            'POST /api/rastrear/lote': 'Rastrear vários códigos de uma vez (corpo: {"codigos": [...]})',
+            'POST /api/entregas/status/lote': 'Atualizar status em lote (corpo: {"atualizacoes": [{"codigo", "status"}]})',
+            'GET /api/entregas/<codigo>/historico': 'Histórico de mudanças de status da entrega',
+            'GET /api/rastrear/<codigo>/stream': 'Mudanças de status da entrega em tempo real (Server-Sent Events)',
+            'GET /api/eventos/stream': 'Feed de mudanças de status da operação (Server-Sent Events, requer login)',
             'GET /api/estatisticas': 'Obter estatísticas gerais',
+            'GET /api/estatisticas/etapas': 'Tempo médio por etapa do fluxo de status (parâmetros: data_inicio, data_fim)',
+            'GET /api/cache/estatisticas': 'Contadores de acerto dos caches de rastreamento e de respostas',
+            'GET /metrics': 'Métricas no formato do Prometheus (latência por rota, status, consultas SQL e pool de conexões)',
             'POST /api/contato': 'Processar formulário de contato',
             'GET /api/docs': 'Esta documentação'
         },
-        'status_validos': ['pendente', 'coletado', 'em_transito', 'entregue', 'cancelado'],
+        'status_validos': STATUS_VALIDOS,
         'exemplo_entrega': {
             'remetente_nome': 'João Silva',
             'remetente_endereco': 'Rua A, 123',
@@ -652,6 +2381,485 @@ def analytics():
     return render_template('gestao/analytics.html')
 
 
+# ============================================================================
+# INSTRUMENTAÇÃO DAS REQUISIÇÕES
+# ============================================================================
+
+# Limites (em segundos) dos buckets do histograma de latência
+BUCKETS_LATENCIA = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def escapar_rotulo(valor):
+    """Escapa o valor de um rótulo no formato texto do Prometheus"""
+    return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def formatar_rotulos(**rotulos):
+    """Monta o bloco {chave="valor",...} de uma amostra"""
+    return '{' + ','.join(f'{chave}="{escapar_rotulo(valor)}"' for chave, valor in rotulos.items()) + '}'
+
+class RegistroMetricas:
+    """Contadores e histogramas das requisições, agregados em memória por worker"""
+    
+    def __init__(self, buckets=BUCKETS_LATENCIA):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self.em_andamento = 0
+        self.requisicoes = Counter()
+        self.latencias = {}
+        self.consultas = {}
+    
+    def iniciar(self):
+        """Conta uma requisição em andamento"""
+        with self._lock:
+            self.em_andamento += 1
+    
+    def finalizar(self):
+        """Desconta uma requisição em andamento"""
+        with self._lock:
+            self.em_andamento -= 1
+    
+    def registrar(self, metodo, rota, status, duracao, total_consultas, tempo_consultas):
+        """Acumula uma requisição concluída"""
+        indice = bisect.bisect_left(self.buckets, duracao)
+        with self._lock:
+            self.requisicoes[(metodo, rota, status)] += 1
+            
+            # [contagem por bucket..., +Inf] seguidos da soma
+            histograma = self.latencias.get((metodo, rota))
+            if histograma is None:
+                histograma = self.latencias[(metodo, rota)] = [0] * (len(self.buckets) + 1) + [0.0]
+            histograma[indice] += 1
+            histograma[-1] += duracao
+            
+            acumulado = self.consultas.get((metodo, rota))
+            if acumulado is None:
+                acumulado = self.consultas[(metodo, rota)] = [0, 0.0]
+            acumulado[0] += total_consultas
+            acumulado[1] += tempo_consultas
+    
+    def limpar(self):
+        """Zera todas as métricas"""
+        with self._lock:
+            self.requisicoes.clear()
+            self.latencias.clear()
+            self.consultas.clear()
+    
+    def exportar(self):
+        """Linhas no formato texto do Prometheus"""
+        with self._lock:
+            requisicoes = sorted(self.requisicoes.items())
+            latencias = sorted((chave, list(valores)) for chave, valores in self.latencias.items())
+            consultas = sorted((chave, list(valores)) for chave, valores in self.consultas.items())
+            em_andamento = self.em_andamento
+        
+        linhas = [
+            '# HELP expresso_http_requests_in_flight Requisições sendo atendidas pelo worker',
+            '# TYPE expresso_http_requests_in_flight gauge',
+            f'expresso_http_requests_in_flight {em_andamento}',
+            '# HELP expresso_http_requests_total Requisições por método, rota e status',
+            '# TYPE expresso_http_requests_total counter'
+        ]
+        for (metodo, rota, status), total in requisicoes:
+            linhas.append(f'expresso_http_requests_total{formatar_rotulos(method=metodo, route=rota, status=status)} {total}')
+        
+        linhas.append('# HELP expresso_http_request_duration_seconds Latência das requisições por rota')
+        linhas.append('# TYPE expresso_http_request_duration_seconds histogram')
+        for (metodo, rota), histograma in latencias:
+            acumulado = 0
+            for limite, contagem in zip(self.buckets + ('+Inf',), histograma):
+                acumulado += contagem
+                rotulos = formatar_rotulos(method=metodo, route=rota, le=limite)
+                linhas.append(f'expresso_http_request_duration_seconds_bucket{rotulos} {acumulado}')
+            rotulos = formatar_rotulos(method=metodo, route=rota)
+            linhas.append(f'expresso_http_request_duration_seconds_sum{rotulos} {histograma[-1]:.6f}')
+            linhas.append(f'expresso_http_request_duration_seconds_count{rotulos} {acumulado}')
+        
+        linhas.append('# HELP expresso_db_queries_total Consultas SQL executadas por rota')
+        linhas.append('# TYPE expresso_db_queries_total counter')
+        for (metodo, rota), (total, _) in consultas:
+            linhas.append(f'expresso_db_queries_total{formatar_rotulos(method=metodo, route=rota)} {total}')
+        linhas.append('# HELP expresso_db_query_seconds_total Tempo gasto em consultas SQL por rota')
+        linhas.append('# TYPE expresso_db_query_seconds_total counter')
+        for (metodo, rota), (_, tempo) in consultas:
+            linhas.append(f'expresso_db_query_seconds_total{formatar_rotulos(method=metodo, route=rota)} {tempo:.6f}')
+        return linhas
+
+# Cada worker do gunicorn mantém o próprio registro
+registro_metricas = RegistroMetricas()
+
+# Perfil de SQL por requisição (opcional): cada consulta com duração e local de chamada
+app.config['PERFIL_SQL'] = variavel_booleana('PERFIL_SQL', False)
+app.config['PERFIL_SQL_LENTA_MS'] = float(os.environ.get('PERFIL_SQL_LENTA_MS', 100))
+app.config['PERFIL_SQL_REPETICOES'] = int(os.environ.get('PERFIL_SQL_REPETICOES', 3))
+
+def local_chamada():
+    """Primeira linha da aplicação na pilha que disparou a consulta"""
+    quadro = sys._getframe(1)
+    while quadro is not None:
+        codigo = quadro.f_code
+        if codigo.co_filename == __file__ and codigo.co_name not in ('local_chamada', 'contabilizar_consulta'):
+            return f'{codigo.co_name}:{quadro.f_lineno}'
+        quadro = quadro.f_back
+    return 'desconhecido'
+
+def analisar_consultas(consultas, limite_lenta_ms, limite_repeticoes):
+    """Resume as consultas de uma requisição e aponta N+1 e consultas lentas"""
+    repeticoes = Counter(consulta['sql'] for consulta in consultas)
+    locais = {}
+    for consulta in consultas:
+        locais.setdefault(consulta['sql'], consulta['local'])
+    
+    return {
+        'total': len(consultas),
+        'tempo_ms': round(sum(consulta['duracao_ms'] for consulta in consultas), 3),
+        'repetidas': [
+            {'sql': sql, 'vezes': vezes, 'local': locais[sql]}
+            for sql, vezes in repeticoes.most_common() if vezes >= limite_repeticoes
+        ],
+        'lentas': [consulta for consulta in consultas if consulta['duracao_ms'] >= limite_lenta_ms]
+    }
+
+def cabecalho_server_timing(perfil):
+    """Valor do cabeçalho Server-Timing com o resumo do perfil de SQL"""
+    partes = [f'sql;dur={perfil["tempo_ms"]};desc="{perfil["total"]} consultas"']
+    if perfil['repetidas']:
+        partes.append(f'sql-repetidas;desc="{len(perfil["repetidas"])} consultas repetidas"')
+    if perfil['lentas']:
+        partes.append(f'sql-lentas;desc="{len(perfil["lentas"])} consultas lentas"')
+    return ', '.join(partes)
+
+def registrar_perfil_sql(response):
+    """Envia o resumo no Server-Timing e registra N+1 e consultas lentas no log"""
+    perfil = analisar_consultas(
+        g.perfil_sql, app.config['PERFIL_SQL_LENTA_MS'], app.config['PERFIL_SQL_REPETICOES']
+    )
+    response.headers['Server-Timing'] = cabecalho_server_timing(perfil)
+    
+    for repetida in perfil['repetidas']:
+        app.logger.warning(
+            f"Possível N+1 em {request.method} {request.path}: {repetida['vezes']}x "
+            f"em {repetida['local']}: {repetida['sql'][:200]}"
+        )
+    for lenta in perfil['lentas']:
+        app.logger.warning(
+            f"Consulta lenta em {request.method} {request.path}: {lenta['duracao_ms']}ms "
+            f"em {lenta['local']}: {lenta['sql'][:200]}"
+        )
+    return perfil
+
+def iniciar_cronometro_consulta(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('inicio_consulta', []).append(time.perf_counter())
+
+def contabilizar_consulta(conn, cursor, statement, parameters, context, executemany):
+    duracao = time.perf_counter() - conn.info['inicio_consulta'].pop()
+    # Consultas fora de uma requisição (migrações, threads do SSE) não entram
+    if has_request_context() and 'inicio_requisicao' in g:
+        g.consultas_requisicao += 1
+        g.tempo_consultas_requisicao += duracao
+        if g.perfil_sql is not None:
+            g.perfil_sql.append({
+                'sql': statement,
+                'duracao_ms': round(duracao * 1000, 3),
+                'local': local_chamada()
+            })
+
+with app.app_context():
+    event.listen(db.engine, 'before_cursor_execute', iniciar_cronometro_consulta)
+    event.listen(db.engine, 'after_cursor_execute', contabilizar_consulta)
+
+@app.before_request
+def iniciar_metricas_requisicao():
+    g.inicio_requisicao = time.perf_counter()
+    g.consultas_requisicao = 0
+    g.tempo_consultas_requisicao = 0.0
+    g.metricas_registradas = False
+    g.perfil_sql = [] if app.config['PERFIL_SQL'] else None
+    registro_metricas.iniciar()
+
+def concluir_metricas_requisicao(status):
+    """Registra a requisição uma única vez, na resposta ou no teardown"""
+    if 'inicio_requisicao' not in g or g.get('metricas_registradas'):
+        return
+    g.metricas_registradas = True
+    rota = request.url_rule.rule if request.url_rule else 'sem_rota'
+    registro_metricas.registrar(
+        request.method, rota, status,
+        time.perf_counter() - g.inicio_requisicao,
+        g.consultas_requisicao, g.tempo_consultas_requisicao
+    )
+
+@app.after_request
+def registrar_metricas_requisicao(response):
+    concluir_metricas_requisicao(response.status_code)
+    if g.get('perfil_sql') is not None:
+        registrar_perfil_sql(response)
+    return response
+
+@app.teardown_request
+def encerrar_metricas_requisicao(exc):
+    if 'inicio_requisicao' in g:
+        # Exceção não tratada: after_request não roda
+        concluir_metricas_requisicao(500)
+        registro_metricas.finalizar()
+
+@app.route('/metrics', methods=['GET'])
+def metricas():
+    linhas = registro_metricas.exportar() + linhas_metricas_pool()
+    return Response('\n'.join(linhas) + '\n', content_type=TIPO_CONTEUDO_METRICAS)
+
+
+# ============================================================================
+# MODO ASSÍNCRONO DOS ENDPOINTS PÚBLICOS DE LEITURA
+# ============================================================================
+
+# Servir com: uvicorn src.app:app_async (ou gunicorn -k uvicorn.workers.UvicornWorker src.app:app_async).
+# Rastreamento, rastreamento em lote e estatísticas rodam no event loop com driver
+# asyncio (asyncpg/aiosqlite); as demais rotas seguem no Flask, em um pool de threads.
+DRIVERS_ASYNC = {'postgresql': 'postgresql+asyncpg', 'sqlite': 'sqlite+aiosqlite'}
+CORPO_ASYNC_MAXIMO = 1024 * 1024
+THREADS_WSGI_ASYNC = int(os.environ.get('ASYNC_THREADS_WSGI', 8))
+
+def url_banco_async(url):
+    """Troca o driver da URL do engine síncrono pelo equivalente asyncio"""
+    dialeto = url.get_backend_name()
+    if dialeto not in DRIVERS_ASYNC:
+        raise ValueError(f'Banco sem driver asyncio configurado: {dialeto}')
+    return url.set(drivername=DRIVERS_ASYNC[dialeto])
+
+def opcoes_engine_async(url):
+    """Mesmas variáveis DB_* do engine síncrono, adaptadas ao driver asyncio"""
+    opcoes = opcoes_engine(url.render_as_string(hide_password=False))
+    # PoolMedido é síncrono: o engine asyncio usa o próprio pool adaptado
+    opcoes.pop('poolclass', None)
+    opcoes.pop('connect_args', None)
+    if url.get_backend_name() == 'sqlite' and 'pool_size' in opcoes:
+        # O padrão do aiosqlite (NullPool) abriria um arquivo por requisição
+        from sqlalchemy.pool import AsyncAdaptedQueuePool
+        opcoes['poolclass'] = AsyncAdaptedQueuePool
+    
+    timeout_consulta = int(os.environ.get('DB_STATEMENT_TIMEOUT_MS', 0))
+    if timeout_consulta and url.get_backend_name() == 'postgresql':
+        opcoes['connect_args'] = {'server_settings': {'statement_timeout': str(timeout_consulta)}}
+    return opcoes
+
+def ambiente_wsgi(scope, corpo):
+    """Environ WSGI mínimo de uma requisição ASGI, para reaproveitar o Request do Flask"""
+    ambiente = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': '',
+        'PATH_INFO': scope['path'],
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': 'localhost',
+        'SERVER_PORT': '80',
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': (scope.get('client') or ('', 0))[0],
+        'CONTENT_LENGTH': str(len(corpo)),
+        'wsgi.input': io.BytesIO(corpo),
+        'wsgi.url_scheme': scope.get('scheme', 'http')
+    }
+    for nome, valor in scope.get('headers', []):
+        chave = nome.decode('latin-1').upper().replace('-', '_')
+        if chave == 'CONTENT_TYPE':
+            ambiente['CONTENT_TYPE'] = valor.decode('latin-1')
+        elif chave != 'CONTENT_LENGTH':
+            ambiente[f'HTTP_{chave}'] = valor.decode('latin-1')
+    return ambiente
+
+async def ler_corpo_asgi(receive):
+    """Lê o corpo da requisição; None se passar de CORPO_ASYNC_MAXIMO"""
+    partes = []
+    tamanho = 0
+    while True:
+        mensagem = await receive()
+        if mensagem['type'] == 'http.disconnect':
+            break
+        parte = mensagem.get('body', b'')
+        tamanho += len(parte)
+        if tamanho > CORPO_ASYNC_MAXIMO:
+            return None
+        partes.append(parte)
+        if not mensagem.get('more_body'):
+            break
+    return b''.join(partes)
+
+class MedidorConsultas:
+    """Conta e cronometra as consultas de uma requisição assíncrona"""
+    
+    def __init__(self):
+        self.total = 0
+        self.tempo = 0.0
+    
+    async def executar(self, conexao, consulta):
+        inicio = time.perf_counter()
+        try:
+            return await conexao.execute(consulta)
+        finally:
+            self.total += 1
+            self.tempo += time.perf_counter() - inicio
+
+class AppAssincrona:
+    """Aplicação ASGI: endpoints públicos de leitura em asyncio e o restante delegado ao Flask"""
+    
+    def __init__(self, app_flask, threads_wsgi=THREADS_WSGI_ASYNC):
+        self.app_flask = app_flask
+        self.threads_wsgi = threads_wsgi
+        self._engine = None
+        self._app_wsgi = None
+        self.rotas = [
+            ('POST', re.compile(r'/api/rastrear/lote'), self.rastrear_lote, '/api/rastrear/lote'),
+            ('GET', re.compile(r'/api/rastrear/(?P<codigo>[^/]+)'), self.rastrear, '/api/rastrear/<codigo>'),
+            ('GET', re.compile(r'/api/estatisticas'), self.estatisticas, '/api/estatisticas')
+        ]
+    
+    @property
+    def engine(self):
+        """Engine asyncio criado no primeiro uso, dentro do event loop do servidor"""
+        if self._engine is None:
+            from sqlalchemy.ext.asyncio import create_async_engine
+            with self.app_flask.app_context():
+                url = url_banco_async(db.engine.url)
+            self._engine = create_async_engine(url, **opcoes_engine_async(url))
+        return self._engine
+    
+    @property
+    def app_wsgi(self):
+        """Flask exposto como ASGI, rodando em um pool de threads"""
+        if self._app_wsgi is None:
+            from a2wsgi import WSGIMiddleware
+            self._app_wsgi = WSGIMiddleware(self.app_flask, workers=self.threads_wsgi)
+        return self._app_wsgi
+    
+    async def encerrar(self):
+        """Fecha as conexões do engine asyncio"""
+        if self._engine is not None:
+            await self._engine.dispose()
+            self._engine = None
+    
+    def resolver(self, scope):
+        """Retorna (handler, parâmetros, rota) de um endpoint assíncrono ou None"""
+        for metodo, padrao, handler, rota in self.rotas:
+            if scope['method'] == metodo:
+                correspondencia = padrao.fullmatch(scope['path'])
+                if correspondencia:
+                    return handler, correspondencia.groupdict(), rota
+        return None
+    
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.ciclo_de_vida(receive, send)
+            return
+        
+        destino = self.resolver(scope) if scope['type'] == 'http' else None
+        if destino is None:
+            await self.app_wsgi(scope, receive, send)
+            return
+        
+        handler, parametros, rota = destino
+        inicio = time.perf_counter()
+        medidor = MedidorConsultas()
+        status = 500
+        registro_metricas.iniciar()
+        try:
+            corpo = await ler_corpo_asgi(receive)
+            requisicao = self.app_flask.request_class(ambiente_wsgi(scope, corpo or b''))
+            if corpo is None:
+                dados, status = {'success': False, 'error': 'Corpo da requisição muito grande'}, 413
+            else:
+                try:
+                    dados, status = await handler(requisicao, medidor, **parametros)
+                except Exception as e:
+                    app.logger.error(f"Erro em {scope['method']} {scope['path']}: {e}")
+                    dados, status = {'success': False, 'error': str(e)}, 500
+            
+            response = self.montar_resposta(requisicao, dados, status)
+            await send({
+                'type': 'http.response.start',
+                'status': response.status_code,
+                'headers': [(nome.lower().encode('latin-1'), valor.encode('latin-1'))
+                            for nome, valor in response.headers.items()]
+            })
+            await send({'type': 'http.response.body', 'body': response.get_data()})
+        finally:
+            registro_metricas.registrar(scope['method'], rota, status,
+                                        time.perf_counter() - inicio, medidor.total, medidor.tempo)
+            registro_metricas.finalizar()
+    
+    async def ciclo_de_vida(self, receive, send):
+        """Eventos lifespan do servidor ASGI"""
+        while True:
+            mensagem = await receive()
+            if mensagem['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif mensagem['type'] == 'lifespan.shutdown':
+                await self.encerrar()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+    
+    def montar_resposta(self, requisicao, dados, status):
+        """Resposta do Flask com os mesmos cabeçalhos de segurança e CORS das rotas síncronas"""
+        with self.app_flask.app_context():
+            if isinstance(dados, Response):
+                response = dados
+            else:
+                response = jsonify(dados)
+                response.status_code = status
+            add_security_headers(response)
+        
+        origem = requisicao.headers.get('Origin')
+        if origem_permitida(origem):
+            response.headers['Access-Control-Allow-Origin'] = origem
+            response.headers.add('Vary', 'Origin')
+        return response
+    
+    async def rastrear(self, requisicao, medidor, codigo):
+        # Mesmo fluxo de api_rastrear: dígito verificador, cache e consulta por código
+        if codigo_rastreio_invalido(codigo):
+            return {'encontrado': False}, 200
+        
+        encontrado_cache, item = cache_rastreamento.obter(codigo)
+        if encontrado_cache:
+            resultado, data_atualizacao = item
+        else:
+            async with self.engine.connect() as conexao:
+                entrega = (await medidor.executar(conexao, consulta_rastreio([codigo]))).first()
+            resultado, data_atualizacao = guardar_rastreio(codigo, entrega)
+        
+        with self.app_flask.app_context():
+            response = resposta_rastreio(codigo, resultado, data_atualizacao, requisicao)
+        return response, response.status_code
+    
+    async def rastrear_lote(self, requisicao, medidor):
+        codigos, erro = validar_lote_rastreio(requisicao.get_json(silent=True) or {})
+        if erro:
+            return {'success': False, 'error': erro}, 400
+        
+        resultados, pendentes = separar_rastreios_em_cache(codigos)
+        if pendentes:
+            async with self.engine.connect() as conexao:
+                for inicio in range(0, len(pendentes), LOTE_RASTREIO_TAMANHO_IN):
+                    bloco = pendentes[inicio:inicio + LOTE_RASTREIO_TAMANHO_IN]
+                    linhas = (await medidor.executar(conexao, consulta_rastreio(bloco))).all()
+                    registrar_rastreios(linhas, resultados)
+        
+        for codigo in pendentes:
+            resultados.setdefault(codigo, {'encontrado': False})
+        
+        return {'success': True, 'data': resultados, 'total': len(resultados)}, 200
+    
+    async def estatisticas(self, requisicao, medidor):
+        # O backend do cache pode ser o Redis (I/O bloqueante): fora do event loop
+        chave, dados = await asyncio.to_thread(cache_respostas.buscar, 'api_estatisticas')
+        if dados is None:
+            async with self.engine.connect() as conexao:
+                linhas_status = (await medidor.executar(conexao, consulta_estatisticas_status())).all()
+                cidades = (await medidor.executar(conexao, consulta_top_cidades(5))).all()
+            dados = formatar_estatisticas_api(resumir_estatisticas_status(linhas_status), cidades)
+            await asyncio.to_thread(cache_respostas.guardar, chave, dados)
+        
+        return {'success': True, 'data': dados}, 200
+
+app_async = AppAssincrona(app)
+
+
 # ============================================================================
 # MELHORIAS DE SEGURANÇA
 # ============================================================================
@@ -5,15 +5,33 @@ Testes automatizados para a aplicação Expresso Itaporanga
 """
 
 import unittest
+import asyncio
+import importlib.util
 import json
 import sys
 import os
-from datetime import datetime
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from unittest import mock
 
 # Adicionar o diretório src ao path
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
 
-from app import app, db, Usuario, Entrega
+from app import (app, db, Usuario, Entrega, StatusEvento, EstatisticaDiaria, VersaoSchema, calcular_estatisticas_status,
+                 calcular_top_cidades, aplicar_migracoes, MIGRACOES, CacheTTL, cache_rastreamento,
+                 AlocadorCodigos, digito_verificador, codigo_rastreio_invalido,
+                 paginar_entregas, POR_PAGINA_GESTAO, migracao_indice_busca,
+                 calcular_latencia_etapas, barramento_eventos, reconstruir_estatistica_diaria,
+                 cache_respostas, CacheRespostas, BackendCacheMemoria, BackendCacheRedis,
+                 PoolMedido, opcoes_engine, RegistroMetricas, registro_metricas,
+                 analisar_consultas, local_chamada, app_async, url_banco_async, garantir_ouvinte_postgres,
+                 migracao_data_criacao_obrigatoria)
+import app as app_modulo
+from sqlalchemy import MetaData, create_engine, event, func, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
 from werkzeug.security import generate_password_hash
 
 class ExpressoItaporangaTestCase(unittest.TestCase):
@@ -32,6 +50,10 @@ class ExpressoItaporangaTestCase(unittest.TestCase):
         # Criar tabelas
         db.create_all()
         
+        # Limpar caches em memória entre testes
+        cache_rastreamento.limpar()
+        cache_respostas.limpar()
+        
         # Criar usuário de teste
         self.criar_usuario_teste()
         
@@ -44,6 +66,24 @@ class ExpressoItaporangaTestCase(unittest.TestCase):
         db.drop_all()
         self.app_context.pop()
     
+    def assertMaximoConsultas(self, maximo, url, metodo='get', **kwargs):
+        """Executa a requisição e falha se ela fizer mais de `maximo` consultas SQL"""
+        consultas = []
+        
+        def registrar(conn, cursor, statement, *args):
+            consultas.append((local_chamada(), statement))
+        
+        event.listen(db.engine, 'before_cursor_execute', registrar)
+        try:
+            response = getattr(self.app, metodo)(url, **kwargs)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', registrar)
+        
+        if len(consultas) > maximo:
+            detalhes = '\n'.join(f'  {local}: {sql[:120]}' for local, sql in consultas)
+            self.fail(f'{metodo.upper()} {url} executou {len(consultas)} consultas (máximo {maximo}):\n{detalhes}')
+        return response
+    
     def criar_usuario_teste(self):
         """Criar usuário para testes"""
         usuario_teste = Usuario(
@@ -117,7 +157,87 @@ class TestAPIEntregas(ExpressoItaporangaTestCase):
         data = json.loads(response.data)
         self.assertTrue(data['success'])
         self.assertIsInstance(data['data'], list)
-        self.assertGreater(data['total'], 0)
+        self.assertEqual(data['quantidade'], len(data['data']))
+        self.assertGreater(data['quantidade'], 0)
+    
+    def test_listar_entregas_paginado(self):
+        """Testar paginação por cursor sem repetir nem perder entregas"""
+        data_fixa = datetime(2024, 1, 1, 12, 0)
+        for i in range(5):
+            db.session.add(Entrega(
+                codigo_rastreamento=f'EIPAG{i:05d}',
+                remetente_nome='Remetente', remetente_endereco='Rua A',
+                remetente_cidade='Recife/PE', destinatario_nome='Destinatário',
+                destinatario_endereco='Rua B', destinatario_cidade='Itaporanga/PB',
+                tipo_produto='Documentos', data_criacao=data_fixa
+            ))
+        db.session.commit()
+        
+        codigos = []
+        cursor = None
+        while True:
+            url = '/api/entregas?limit=2'
+            if cursor:
+                url += f'&cursor={cursor}'
+            data = json.loads(self.app.get(url).data)
+            self.assertLessEqual(len(data['data']), 2)
+            codigos.extend(item['codigo_rastreamento'] for item in data['data'])
+            cursor = data['next_cursor']
+            if not cursor:
+                break
+        
+        self.assertEqual(len(codigos), 6)
+        self.assertEqual(len(set(codigos)), 6)
+    
+    def test_listar_entregas_campos(self):
+        """Testar projeção de campos na listagem"""
+        response = self.app.get('/api/entregas?fields=codigo_rastreamento,status')
+        self.assertEqual(response.status_code, 200)
+        
+        data = json.loads(response.data)
+        self.assertEqual(set(data['data'][0].keys()), {'codigo_rastreamento', 'status'})
+        
+        response = self.app.get('/api/entregas?fields=senha')
+        self.assertEqual(response.status_code, 400)
+    
+    def test_listar_entregas_cursor_invalido(self):
+        """Testar cursor inválido na listagem"""
+        response = self.app.get('/api/entregas?cursor=invalido')
+        self.assertEqual(response.status_code, 400)
+    
+    def test_exportar_entregas_ndjson(self):
+        """Testar exportação em NDJSON com filtro de status"""
+        with self.app.session_transaction() as sess:
+            sess['user_id'] = 1
+        
+        response = self.app.get('/api/entregas/exportar?status=pendente')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        
+        linhas = response.get_data(as_text=True).splitlines()
+        self.assertEqual(len(linhas), 1)
+        self.assertEqual(json.loads(linhas[0])['codigo_rastreamento'], 'EI1234567890')
+        
+        response = self.app.get('/api/entregas/exportar?status=entregue')
+        self.assertEqual(response.get_data(as_text=True), '')
+    
+    def test_exportar_entregas_csv(self):
+        """Testar exportação em CSV com cabeçalho"""
+        with self.app.session_transaction() as sess:
+            sess['user_id'] = 1
+        
+        response = self.app.get('/api/entregas/exportar?formato=csv&cidade=Itaporanga/PB'
+                                '&data_inicio=2000-01-01')
+        self.assertEqual(response.status_code, 200)
+        
+        linhas = response.get_data(as_text=True).splitlines()
+        self.assertTrue(linhas[0].startswith('id,codigo_rastreamento'))
+        self.assertEqual(len(linhas), 2)
+    
+    def test_exportar_entregas_sem_login(self):
+        """Testar que a exportação exige login"""
+        response = self.app.get('/api/entregas/exportar')
+        self.assertEqual(response.status_code, 401)
     
     def test_buscar_entrega_por_codigo(self):
         """Testar busca de entrega por código de rastreamento"""
@@ -230,6 +350,1537 @@ class TestAPIEstatisticas(ExpressoItaporangaTestCase):
         self.assertGreaterEqual(estatisticas['total_entregas'], 1)
         self.assertIsInstance(estatisticas['taxa_sucesso'], (int, float))
 
+class TestServicoEstatisticas(ExpressoItaporangaTestCase):
+    """Testes para o serviço de estatísticas agregadas"""
+    
+    def test_contagem_por_status(self):
+        """Testar contagem por status e taxa de sucesso"""
+        self.app.put('/api/entregas/EI1234567890/status',
+                     data=json.dumps({'status': 'entregue'}),
+                     content_type='application/json')
+        
+        estatisticas = calcular_estatisticas_status()
+        self.assertEqual(estatisticas['total'], 1)
+        self.assertEqual(estatisticas['por_status'], {'entregue': 1})
+        self.assertEqual(estatisticas['taxa_sucesso'], 100)
+    
+    def test_consulta_unica(self):
+        """Testar se as estatísticas são obtidas com uma única consulta"""
+        consultas = []
+        
+        def registrar(conn, cursor, statement, parameters, context, executemany):
+            consultas.append(statement)
+        
+        event.listen(db.engine, 'before_cursor_execute', registrar)
+        try:
+            calcular_estatisticas_status()
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', registrar)
+        
+        self.assertEqual(len(consultas), 1)
+        self.assertIn('GROUP BY', consultas[0])
+
+class TestMigracoesIndices(ExpressoItaporangaTestCase):
+    """Testes para as migrações de schema e índices de Entrega"""
+    
+    def plano_execucao(self, query):
+        """Retorna o EXPLAIN QUERY PLAN (SQLite) de uma consulta ORM"""
+        sql = query.statement.compile(db.engine, compile_kwargs={'literal_binds': True})
+        linhas = db.session.execute(text(f'EXPLAIN QUERY PLAN {sql}')).all()
+        return ' | '.join(linha[-1] for linha in linhas)
+    
+    def test_migracoes_idempotentes(self):
+        """Testar que as migrações são registradas e não reaplicadas"""
+        aplicar_migracoes()
+        self.assertEqual(aplicar_migracoes(), [])
+        
+        versoes = [versao for (versao,) in db.session.query(VersaoSchema.versao).order_by(VersaoSchema.versao)]
+        self.assertEqual(versoes, [versao for versao, _, _ in MIGRACOES])
+    
+    def test_migracao_preenche_data_criacao_nula(self):
+        """Testar o preenchimento de data_criacao nula em bancos anteriores à restrição"""
+        with tempfile.TemporaryDirectory() as diretorio:
+            engine = create_engine(f"sqlite:///{os.path.join(diretorio, 'antigo.db')}")
+            db.metadata.create_all(engine)
+            atualizacao = datetime(2024, 3, 10, 9, 0)
+            with engine.begin() as conexao:
+                recriar_entrega_legada(conexao)
+                conexao.execute(Entrega.__table__.insert(), [{
+                    'codigo_rastreamento': f'EINULA{i}', 'remetente_nome': 'R', 'remetente_endereco': 'Rua A',
+                    'remetente_cidade': 'Recife/PE', 'destinatario_nome': 'D', 'destinatario_endereco': 'Rua B',
+                    'destinatario_cidade': 'Patos/PB', 'tipo_produto': 'Documentos', 'status': 'pendente',
+                    'data_criacao': None, 'data_atualizacao': atualizacao if i else None
+                } for i in range(2)])
+                migracao_data_criacao_obrigatoria(conexao)
+                
+                datas = conexao.execute(text('SELECT data_criacao FROM entrega ORDER BY codigo_rastreamento')).scalars().all()
+                total_rollup = conexao.execute(text('SELECT SUM(total) FROM estatistica_diaria')).scalar()
+            engine.dispose()
+        
+        self.assertTrue(all(datas))
+        self.assertEqual(datas[1], '2024-03-10 09:00:00.000000')
+        self.assertEqual(total_rollup, 2)
+    
+    def test_contagem_por_status_usa_indice(self):
+        """Testar que o GROUP BY de status usa índice"""
+        plano = self.plano_execucao(
+            db.session.query(Entrega.status, func.count(Entrega.id)).group_by(Entrega.status)
+        )
+        self.assertIn('ix_entrega_status_data_criacao', plano)
+    
+    def test_filtro_status_ordenado_usa_indice(self):
+        """Testar que o filtro por status ordenado por data usa índice composto"""
+        plano = self.plano_execucao(
+            Entrega.query.filter_by(status='pendente').order_by(Entrega.data_criacao.desc())
+        )
+        self.assertIn('ix_entrega_status_data_criacao', plano)
+        self.assertNotIn('TEMP B-TREE', plano)
+    
+    def test_filtro_cidade_usa_indice(self):
+        """Testar que o filtro por cidade de destino usa índice"""
+        plano = self.plano_execucao(Entrega.query.filter_by(destinatario_cidade='Itaporanga/PB'))
+        self.assertIn('ix_entrega_destinatario_cidade', plano)
+    
+    def test_listagem_ordenada_usa_indice(self):
+        """Testar que a listagem por data de criação não ordena em memória"""
+        plano = self.plano_execucao(
+            Entrega.query.order_by(Entrega.data_criacao.desc(), Entrega.id.desc()).limit(50)
+        )
+        self.assertIn('ix_entrega_data_criacao_id', plano)
+        self.assertNotIn('TEMP B-TREE', plano)
+
+class TestCacheRastreamento(ExpressoItaporangaTestCase):
+    """Testes para o cache do rastreamento público"""
+    
+    def test_segunda_consulta_usa_cache(self):
+        """Testar acerto de cache na segunda consulta do mesmo código"""
+        self.app.get('/api/rastrear/EI1234567890')
+        response = self.app.get('/api/rastrear/EI1234567890')
+        
+        data = json.loads(response.data)
+        self.assertTrue(data['encontrado'])
+        self.assertEqual(cache_rastreamento.hits, 1)
+        self.assertEqual(cache_rastreamento.misses, 1)
+    
+    def test_atualizacao_status_invalida_cache(self):
+        """Testar que a atualização de status invalida o código no cache"""
+        self.app.get('/api/rastrear/EI1234567890')
+        self.app.put('/api/entregas/EI1234567890/status',
+                     data=json.dumps({'status': 'entregue'}),
+                     content_type='application/json')
+        
+        data = json.loads(self.app.get('/api/rastrear/EI1234567890').data)
+        self.assertEqual(data['status'], 'entregue')
+    
+    def test_codigo_inexistente_em_cache(self):
+        """Testar cache negativo para códigos inexistentes"""
+        self.app.get('/api/rastrear/EI0000000000')
+        data = json.loads(self.app.get('/api/rastrear/EI0000000000').data)
+        
+        self.assertFalse(data['encontrado'])
+        self.assertEqual(cache_rastreamento.hits, 1)
+        
+        response = self.app.get('/api/cache/estatisticas')
+        estatisticas = json.loads(response.data)['data']['rastreamento']
+        self.assertEqual(estatisticas['hits'], 1)
+        self.assertEqual(estatisticas['misses'], 1)
+    
+    def test_expiracao_e_capacidade(self):
+        """Testar expiração por TTL e descarte do item menos usado"""
+        cache = CacheTTL(capacidade=2, ttl=60)
+        cache.definir('a', 1)
+        cache.definir('b', 2)
+        cache.obter('a')
+        cache.definir('c', 3)
+        
+        self.assertEqual(cache.obter('b'), (False, None))
+        self.assertEqual(cache.obter('a'), (True, 1))
+        
+        cache.definir('d', 4, ttl=0)
+        self.assertEqual(cache.obter('d'), (False, None))
+
+class TestRequisicoesCondicionais(ExpressoItaporangaTestCase):
+    """Testes para ETag / Last-Modified e respostas 304"""
+    
+    def test_if_none_match_retorna_304(self):
+        """Testar 304 quando o ETag enviado é o atual"""
+        for url in ('/api/rastrear/EI1234567890', '/api/entregas/EI1234567890'):
+            response = self.app.get(url)
+            self.assertEqual(response.status_code, 200)
+            etag = response.headers['ETag']
+            self.assertIn('Last-Modified', response.headers)
+            
+            response = self.app.get(url, headers={'If-None-Match': etag})
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response.data, b'')
+    
+    def test_if_modified_since_retorna_304(self):
+        """Testar 304 quando o recurso não mudou desde a data enviada"""
+        response = self.app.get('/api/entregas/EI1234567890')
+        ultima_modificacao = response.headers['Last-Modified']
+        
+        response = self.app.get('/api/entregas/EI1234567890',
+                                headers={'If-Modified-Since': ultima_modificacao})
+        self.assertEqual(response.status_code, 304)
+    
+    def test_atualizacao_muda_etag(self):
+        """Testar que a atualização de status gera novo ETag e corpo completo"""
+        etag = self.app.get('/api/rastrear/EI1234567890').headers['ETag']
+        
+        self.app.put('/api/entregas/EI1234567890/status',
+                     data=json.dumps({'status': 'coletado'}),
+                     content_type='application/json')
+        
+        response = self.app.get('/api/rastrear/EI1234567890', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+        self.assertEqual(json.loads(response.data)['status'], 'coletado')
+
+class TestRastreamentoLote(ExpressoItaporangaTestCase):
+    """Testes para o rastreamento em lote"""
+    
+    def test_rastrear_lote(self):
+        """Testar lote com códigos existentes, inexistentes e repetidos"""
+        response = self.app.post('/api/rastrear/lote',
+                                 data=json.dumps({'codigos': ['EI1234567890', 'EI0000000000', 'EI1234567890']}),
+                                 content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        
+        data = json.loads(response.data)
+        self.assertEqual(data['total'], 2)
+        self.assertTrue(data['data']['EI1234567890']['encontrado'])
+        self.assertEqual(data['data']['EI1234567890']['status'], 'pendente')
+        self.assertEqual(data['data']['EI0000000000'], {'encontrado': False})
+    
+    def test_rastrear_lote_consultas_em_blocos(self):
+        """Testar que o lote usa uma consulta IN por bloco de códigos"""
+        consultas = []
+        
+        def registrar(conn, cursor, statement, parameters, context, executemany):
+            consultas.append(statement)
+        
+        codigos = [f'EI{i:010d}' for i in range(1200)]
+        event.listen(db.engine, 'before_cursor_execute', registrar)
+        try:
+            response = self.app.post('/api/rastrear/lote',
+                                     data=json.dumps({'codigos': codigos}),
+                                     content_type='application/json')
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', registrar)
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len([sql for sql in consultas if 'FROM entrega' in sql]), 3)
+    
+    def test_rastrear_lote_invalido(self):
+        """Testar corpo inválido no rastreamento em lote"""
+        response = self.app.post('/api/rastrear/lote',
+                                 data=json.dumps({'codigos': 'EI1234567890'}),
+                                 content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        
+        # Corpo JSON que não é objeto
+        response = self.app.post('/api/rastrear/lote',
+                                 data=json.dumps(['EI1234567890']),
+                                 content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(json.loads(response.data)['success'])
+
+class TestImportacaoLote(ExpressoItaporangaTestCase):
+    """Testes para a importação de entregas em lote"""
+    
+    def registro(self, i):
+        return {
+            'remetente_nome': f'Remetente {i}',
+            'remetente_endereco': 'Rua A, 1',
+            'remetente_cidade': 'Recife/PE',
+            'destinatario_nome': f'Destinatário {i}',
+            'destinatario_endereco': 'Rua B, 2',
+            'destinatario_cidade': 'Itaporanga/PB',
+            'tipo_produto': 'Documentos',
+            'peso': '1.5'
+        }
+    
+    def test_importar_json_com_erros_por_linha(self):
+        """Testar importação JSON com linhas válidas e inválidas"""
+        registros = [self.registro(i) for i in range(3)]
+        registros.append({'remetente_nome': 'Incompleto'})
+        
+        response = self.app.post('/api/entregas/lote',
+                                 data=json.dumps(registros),
+                                 content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        
+        resultado = json.loads(response.data)['data']
+        self.assertEqual(resultado['inseridas'], 3)
+        self.assertEqual(resultado['erros'][0]['linha'], 4)
+        self.assertEqual(Entrega.query.count(), 4)
+        self.assertEqual(len({e['codigo_rastreamento'] for e in resultado['entregas']}), 3)
+    
+    def test_importar_texto_invalido_por_linha(self):
+        """Testar campos que não são texto ou excedem o tamanho da coluna como erros por linha"""
+        registros = [self.registro(i) for i in range(5)]
+        registros[1]['remetente_nome'] = 'R' * 101
+        registros[2]['tipo_produto'] = 42
+        registros[3]['destinatario_cidade'] = ['Itaporanga/PB']
+        registros[4]['observacoes'] = {'fragil': True}
+        
+        response = self.app.post('/api/entregas/lote',
+                                 data=json.dumps(registros),
+                                 content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        
+        resultado = json.loads(response.data)['data']
+        self.assertEqual(resultado['inseridas'], 1)
+        self.assertEqual([erro['linha'] for erro in resultado['erros']], [2, 3, 4, 5])
+        self.assertEqual(resultado['erros'][0]['erro'], 'Campo remetente_nome excede 100 caracteres')
+        self.assertEqual(resultado['erros'][1]['erro'], 'Campo tipo_produto deve ser texto')
+    
+    def test_importar_csv(self):
+        """Testar importação de manifesto CSV"""
+        linhas = ['remetente_nome,remetente_endereco,remetente_cidade,destinatario_nome,'
+                  'destinatario_endereco,destinatario_cidade,tipo_produto,peso,valor_declarado']
+        linhas += [f'R{i},Rua A,Recife/PE,D{i},Rua B,Itaporanga/PB,Livros,2,' for i in range(5)]
+        
+        response = self.app.post('/api/entregas/lote',
+                                 data='\n'.join(linhas),
+                                 content_type='text/csv')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(json.loads(response.data)['data']['inseridas'], 5)
+        
+        entrega = Entrega.query.filter_by(remetente_nome='R0').first()
+        self.assertEqual(entrega.peso, 2.0)
+        self.assertIsNone(entrega.valor_declarado)
+        self.assertEqual(entrega.status, 'pendente')
+    
+    def test_importar_estrito(self):
+        """Testar que o modo estrito não insere nada se houver erro"""
+        registros = [self.registro(0), {'peso': 'x'}]
+        response = self.app.post('/api/entregas/lote?estrito=1',
+                                 data=json.dumps(registros),
+                                 content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Entrega.query.count(), 1)
+
+class TestAlocadorCodigos(ExpressoItaporangaTestCase):
+    """Testes para o alocador de códigos de rastreamento"""
+    
+    def test_codigos_unicos_com_digito_verificador(self):
+        """Testar unicidade entre blocos e dígito verificador"""
+        alocador = AlocadorCodigos('teste', tamanho_bloco=10)
+        codigos = alocador.gerar(25) + [alocador.proximo() for _ in range(5)]
+        
+        self.assertEqual(len(set(codigos)), 30)
+        for codigo in codigos:
+            self.assertTrue(codigo.startswith('EI'))
+            self.assertEqual(len(codigo), 13)
+            self.assertFalse(codigo_rastreio_invalido(codigo))
+    
+    def test_prefixo(self):
+        """Testar prefixo opcional do alocador"""
+        codigo = AlocadorCodigos('teste_prefixo', tamanho_bloco=10, prefixo='W').proximo()
+        self.assertTrue(codigo.startswith('EIW'))
+        self.assertFalse(codigo_rastreio_invalido(codigo))
+    
+    def test_digito_verificador_detecta_erro(self):
+        """Testar que um dígito trocado é detectado"""
+        sequencia = '0000001234'
+        codigo = 'EI' + sequencia + digito_verificador(sequencia)
+        errado = codigo[:-2] + str((int(codigo[-2]) + 1) % 10) + codigo[-1]
+        
+        self.assertFalse(codigo_rastreio_invalido(codigo))
+        self.assertTrue(codigo_rastreio_invalido(errado))
+        self.assertFalse(json.loads(self.app.get(f'/api/rastrear/{errado}').data)['encontrado'])
+    
+    def test_sem_consulta_por_entrega(self):
+        """Testar que criar várias entregas reserva no máximo uma faixa"""
+        consultas = []
+        
+        def registrar(conn, cursor, statement, parameters, context, executemany):
+            consultas.append(statement)
+        
+        alocador = AlocadorCodigos('teste_consultas', tamanho_bloco=100)
+        event.listen(db.engine, 'before_cursor_execute', registrar)
+        try:
+            for _ in range(20):
+                alocador.proximo()
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', registrar)
+        
+        self.assertLessEqual(len(consultas), 3)
+
+class TestListagemGestao(ExpressoItaporangaTestCase):
+    """Testes para a paginação da listagem de gestão"""
+    
+    def criar_entregas(self, quantidade, **campos):
+        for i in range(quantidade):
+            dados = dict(
+                codigo_rastreamento=f'EIGES{campos.get("status", "x")}{i:05d}',
+                remetente_nome='Remetente', remetente_endereco='Rua A',
+                remetente_cidade='Recife/PE', destinatario_nome='Destinatário',
+                destinatario_endereco='Rua B', destinatario_cidade='Campina Grande/PB',
+                tipo_produto='Livros'
+            )
+            dados.update(campos)
+            db.session.add(Entrega(**dados))
+        db.session.commit()
+    
+    def test_paginas_limitadas(self):
+        """Testar que cada página traz no máximo POR_PAGINA_GESTAO entregas"""
+        self.criar_entregas(POR_PAGINA_GESTAO + 10)
+        
+        primeira = paginar_entregas({})
+        self.assertEqual(len(primeira['entregas']), POR_PAGINA_GESTAO)
+        self.assertEqual(primeira['paginacao']['total'], POR_PAGINA_GESTAO + 11)
+        self.assertEqual(primeira['paginacao']['total_paginas'], 2)
+        
+        segunda = paginar_entregas({'pagina': '2'})
+        self.assertEqual(len(segunda['entregas']), 11)
+    
+    def test_filtros_e_ordenacao(self):
+        """Testar filtros por status e cidade e a ordenação"""
+        self.criar_entregas(3, status='entregue')
+        
+        pagina = paginar_entregas({'status': 'entregue', 'cidade': 'Campina Grande/PB',
+                                   'ordenar': 'codigo_rastreamento', 'direcao': 'asc'})
+        codigos = [entrega.codigo_rastreamento for entrega in pagina['entregas']]
+        self.assertEqual(pagina['paginacao']['total'], 3)
+        self.assertEqual(codigos, sorted(codigos))
+        self.assertEqual(pagina['filtros']['status'], 'entregue')
+    
+    def test_data_invalida(self):
+        """Testar filtro de data inválido"""
+        with self.assertRaises(ValueError):
+            paginar_entregas({'data_inicio': '31/12/2024'})
+
+class TestBuscaEntregas(ExpressoItaporangaTestCase):
+    """Testes para a busca textual de entregas"""
+    
+    def setUp(self):
+        super().setUp()
+        with db.engine.begin() as conexao:
+            migracao_indice_busca(conexao)
+        with self.app.session_transaction() as sess:
+            sess['user_id'] = 1
+    
+    def buscar(self, termo):
+        response = self.app.get(f'/api/entregas/busca?q={termo}')
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.data)
+    
+    def test_busca_por_nome_sem_acento(self):
+        """Testar busca por nome do destinatário ignorando acentos"""
+        data = self.buscar('maria santos')
+        self.assertEqual([item['codigo_rastreamento'] for item in data['data']], ['EI1234567890'])
+    
+    def test_busca_por_prefixo(self):
+        """Testar busca por prefixo de palavra e de código"""
+        self.assertEqual(len(self.buscar('Itapor')['data']), 1)
+        self.assertEqual(len(self.buscar('EI123456')['data']), 1)
+        self.assertEqual(len(self.buscar('inexistente')['data']), 0)
+    
+    def test_indice_acompanha_novas_entregas(self):
+        """Testar que entregas criadas depois do índice aparecem na busca"""
+        self.app.post('/api/entregas',
+                      data=json.dumps({
+                          'remetente_nome': 'Gabriela Nóbrega',
+                          'remetente_endereco': 'Rua do Sol, 10',
+                          'remetente_cidade': 'Recife/PE',
+                          'destinatario_nome': 'Otávio Lins',
+                          'destinatario_endereco': 'Av. Epitácio Pessoa, 200',
+                          'destinatario_cidade': 'João Pessoa/PB',
+                          'tipo_produto': 'Livros'
+                      }),
+                      content_type='application/json')
+        
+        data = self.buscar('epitacio')
+        self.assertEqual(len(data['data']), 1)
+        self.assertEqual(data['data'][0]['destinatario_nome'], 'Otávio Lins')
+    
+    def test_busca_exige_login(self):
+        """Testar que a busca exige login"""
+        with self.app.session_transaction() as sess:
+            sess.clear()
+        self.assertEqual(self.app.get('/api/entregas/busca?q=maria').status_code, 401)
+
+    def test_migracao_sem_privilegio_para_pg_trgm(self):
+        """Testar que a falta do pg_trgm não aborta a migração do índice no Postgres"""
+        from sqlalchemy.exc import ProgrammingError
+        
+        executados = []
+        def executar(comando):
+            executados.append(str(comando))
+            if 'CREATE EXTENSION' in str(comando):
+                raise ProgrammingError(str(comando), {}, Exception('permission denied to create extension "pg_trgm"'))
+        
+        conexao = mock.MagicMock()
+        conexao.dialect.name = 'postgresql'
+        conexao.execute.side_effect = executar
+        with self.assertLogs(app.logger, 'WARNING'):
+            migracao_indice_busca(conexao)
+        
+        conexao.begin_nested.assert_called_once()
+        self.assertTrue(any('ix_entrega_busca_texto' in comando for comando in executados))
+        self.assertFalse(any('gin_trgm_ops' in comando for comando in executados))
+
+class TestHistoricoStatus(ExpressoItaporangaTestCase):
+    """Testes para o histórico de status das entregas"""
+    
+    def atualizar(self, status):
+        return self.app.put('/api/entregas/EI1234567890/status',
+                            data=json.dumps({'status': status}),
+                            content_type='application/json')
+    
+    def test_eventos_registrados(self):
+        """Testar que cada mudança de status gera um evento"""
+        self.atualizar('coletado')
+        self.atualizar('em_transito')
+        self.atualizar('em_transito')
+        
+        response = self.app.get('/api/entregas/EI1234567890/historico')
+        self.assertEqual(response.status_code, 200)
+        
+        eventos = json.loads(response.data)['data']['eventos']
+        self.assertEqual([(e['status_anterior'], e['status']) for e in eventos],
+                         [('pendente', 'coletado'), ('coletado', 'em_transito')])
+    
+    def test_latencia_por_etapa(self):
+        """Testar agregação do tempo gasto em cada etapa"""
+        entrega = Entrega.query.first()
+        entrega.data_atualizacao = datetime.utcnow() - timedelta(hours=2)
+        db.session.commit()
+        self.atualizar('coletado')
+        
+        etapas = calcular_latencia_etapas()
+        self.assertEqual(len(etapas), 1)
+        self.assertEqual((etapas[0]['de'], etapas[0]['para']), ('pendente', 'coletado'))
+        self.assertAlmostEqual(etapas[0]['media_horas'], 2, places=1)
+        
+        response = self.app.get('/api/estatisticas/etapas')
+        self.assertEqual(json.loads(response.data)['data'], etapas)
+    
+    def test_historico_usa_indice(self):
+        """Testar que a consulta do histórico usa o índice (entrega_id, data_evento)"""
+        sql = StatusEvento.query.filter_by(entrega_id=1).order_by(StatusEvento.data_evento).statement.compile(
+            db.engine, compile_kwargs={'literal_binds': True})
+        plano = ' '.join(linha[-1] for linha in db.session.execute(text(f'EXPLAIN QUERY PLAN {sql}')))
+        self.assertIn('ix_status_evento_entrega_data', plano)
+        self.assertNotIn('TEMP B-TREE', plano)
+
+class TestAtualizacaoStatusLote(ExpressoItaporangaTestCase):
+    """Testes para a atualização de status em lote"""
+    
+    def setUp(self):
+        super().setUp()
+        for i in range(3):
+            db.session.add(Entrega(
+                codigo_rastreamento=f'EILOTE{i:04d}',
+                remetente_nome='Remetente', remetente_endereco='Rua A',
+                remetente_cidade='Recife/PE', destinatario_nome='Destinatário',
+                destinatario_endereco='Rua B', destinatario_cidade='Itaporanga/PB',
+                tipo_produto='Livros', status='pendente'
+            ))
+        db.session.commit()
+    
+    def enviar(self, atualizacoes):
+        response = self.app.post('/api/entregas/status/lote',
+                                 data=json.dumps({'atualizacoes': atualizacoes}),
+                                 content_type='application/json')
+        return response.status_code, json.loads(response.data)
+    
+    def test_resultado_por_codigo(self):
+        """Testar atualizações válidas, status inválido e código inexistente"""
+        codigo_http, data = self.enviar([
+            {'codigo': 'EILOTE0000', 'status': 'coletado'},
+            {'codigo': 'EILOTE0001', 'status': 'em_transito'},
+            {'codigo': 'EILOTE0002', 'status': 'voando'},
+            {'codigo': 'EI0000000000', 'status': 'coletado'},
+            {'codigo': 'EI1234567890', 'status': 'pendente'}
+        ])
+        
+        self.assertEqual(codigo_http, 200)
+        self.assertEqual(data['atualizadas'], 2)
+        self.assertTrue(data['data']['EILOTE0000']['alterado'])
+        self.assertFalse(data['data']['EILOTE0002']['success'])
+        self.assertFalse(data['data']['EI0000000000']['success'])
+        self.assertFalse(data['data']['EI1234567890']['alterado'])
+        
+        self.assertEqual(Entrega.query.filter_by(codigo_rastreamento='EILOTE0001').first().status, 'em_transito')
+        self.assertEqual(Entrega.query.filter_by(codigo_rastreamento='EILOTE0002').first().status, 'pendente')
+        self.assertEqual(StatusEvento.query.count(), 2)
+    
+    def test_itens_sem_codigo_valido(self):
+        """Testar que itens sem código válido voltam como erro pela posição na lista"""
+        codigo_http, data = self.enviar([
+            {'status': 'coletado'},
+            {'codigo': 'EILOTE0000', 'status': 'coletado'},
+            {'codigo': '', 'status': 'coletado'},
+            {'codigo': 123, 'status': 'coletado'},
+            'EILOTE0001'
+        ])
+        
+        self.assertEqual(codigo_http, 200)
+        self.assertEqual(data['atualizadas'], 1)
+        self.assertEqual(list(data['data']), ['EILOTE0000'])
+        self.assertEqual([erro['indice'] for erro in data['erros']], [0, 2, 3, 4])
+        self.assertTrue(all(not erro['success'] for erro in data['erros']))
+        self.assertEqual(Entrega.query.filter_by(codigo_rastreamento='EILOTE0001').first().status, 'pendente')
+    
+    def test_um_update_por_status(self):
+        """Testar que o lote faz um UPDATE por status de destino"""
+        consultas = []
+        
+        def registrar(conn, cursor, statement, parameters, context, executemany):
+            consultas.append(statement)
+        
+        event.listen(db.engine, 'before_cursor_execute', registrar)
+        try:
+            self.enviar([{'codigo': f'EILOTE{i:04d}', 'status': 'entregue'} for i in range(3)])
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', registrar)
+        
+        self.assertEqual(len([sql for sql in consultas if sql.startswith('UPDATE entrega')]), 1)
+        self.assertEqual(Entrega.query.filter_by(status='entregue').count(), 3)
+    
+    def test_corpo_invalido(self):
+        """Testar corpo inválido"""
+        codigo_http, _ = self.enviar('EILOTE0000')
+        self.assertEqual(codigo_http, 400)
+
+class TestEventosTempoReal(ExpressoItaporangaTestCase):
+    """Testes para o stream SSE de mudanças de status"""
+    
+    def test_stream_recebe_mudanca_de_status(self):
+        """Testar estado inicial e evento publicado após a atualização"""
+        response = self.app.get('/api/rastrear/EI1234567890/stream')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'text/event-stream')
+        
+        self.app.put('/api/entregas/EI1234567890/status',
+                     data=json.dumps({'status': 'coletado'}),
+                     content_type='application/json')
+        
+        partes = (parte.decode() for parte in response.response)
+        self.assertTrue(next(partes).startswith('retry:'))
+        self.assertIn('"status": "pendente"', next(partes))
+        self.assertIn('"status": "coletado"', next(partes))
+        
+        response.close()
+        self.assertEqual(barramento_eventos.total_assinantes(), 0)
+    
+    def test_feed_operacao_recebe_lote(self):
+        """Testar que o feed da operação recebe as mudanças em lote"""
+        with self.app.session_transaction() as sess:
+            sess['user_id'] = 1
+        
+        response = self.app.get('/api/eventos/stream')
+        self.app.post('/api/entregas/status/lote',
+                      data=json.dumps({'atualizacoes': [{'codigo': 'EI1234567890', 'status': 'entregue'}]}),
+                      content_type='application/json')
+        
+        partes = (parte.decode() for parte in response.response)
+        next(partes)
+        evento = next(partes)
+        self.assertTrue(evento.startswith('event: status'))
+        self.assertIn('EI1234567890', evento)
+        response.close()
+    
+    def test_ouvinte_postgres_repassa_notify(self):
+        """Testar que a thread do LISTEN entrega ao barramento os NOTIFY de outros workers"""
+        notificacao = mock.Mock(payload=json.dumps([
+            {'codigo': 'EI1234567890', 'status': 'entregue', 'data_atualizacao': '2024-01-01T00:00:00'}
+        ]))
+        pendentes = [notificacao]
+        driver = mock.Mock(notifies=[])
+        driver.poll.side_effect = lambda: driver.notifies.extend(pendentes.pop() for _ in list(pendentes))
+        engine_ouvinte = mock.MagicMock()
+        engine_ouvinte.connect.return_value.__enter__.return_value.connection.driver_connection = driver
+        engine_postgres = mock.Mock()
+        engine_postgres.dialect.name = 'postgresql'
+        
+        def select_falso(leitura, escrita, excecao, timeout):
+            time.sleep(0.01)
+            return leitura, [], []
+        
+        fila = barramento_eventos.assinar('entrega:EI1234567890')
+        with mock.patch('app.SSE_POSTGRES_NOTIFY', True), \
+                mock.patch('app.criar_engine_ouvinte', return_value=engine_ouvinte) as criar, \
+                mock.patch('select.select', side_effect=select_falso):
+            garantir_ouvinte_postgres(engine_postgres)
+            try:
+                evento = fila.get(timeout=2)
+            finally:
+                app_modulo._parar_ouvinte.set()
+                app_modulo._ouvinte_postgres.join(timeout=2)
+                barramento_eventos.cancelar('entrega:EI1234567890', fila)
+        
+        criar.assert_called_once_with(engine_postgres)
+        engine_ouvinte.connect.return_value.__enter__.return_value.exec_driver_sql.assert_called_once_with(
+            'LISTEN entregas_status'
+        )
+        self.assertEqual(evento['status'], 'entregue')
+        self.assertFalse(app_modulo._ouvinte_postgres.is_alive())
+    
+    def test_limite_de_streams_responde_503(self):
+        """Testar que streams acima do limite recebem 503 em vez de ocupar outra thread"""
+        with mock.patch('app.SSE_MAXIMO_CONEXOES', 1):
+            aberto = self.app.get('/api/rastrear/EI1234567890/stream')
+            recusado = self.app.get('/api/rastrear/EI1234567890/stream')
+            
+            self.assertEqual(aberto.status_code, 200)
+            self.assertEqual(recusado.status_code, 503)
+            self.assertEqual(recusado.headers['Retry-After'], '30')
+            
+            aberto.close()
+            reaberto = self.app.get('/api/rastrear/EI1234567890/stream')
+            self.assertEqual(reaberto.status_code, 200)
+            reaberto.close()
+    
+    def test_stream_codigo_inexistente(self):
+        """Testar stream de código inexistente e feed sem login"""
+        self.assertEqual(self.app.get('/api/rastrear/EI0000000000/stream').status_code, 404)
+        self.assertEqual(self.app.get('/api/eventos/stream').status_code, 401)
+
+class TestEstatisticaDiaria(ExpressoItaporangaTestCase):
+    """Testes para o rollup diário de estatísticas"""
+    
+    def contagem_direta(self):
+        return dict(db.session.query(Entrega.status, func.count(Entrega.id)).group_by(Entrega.status).all())
+    
+    def test_rollup_acompanha_escritas(self):
+        """Testar o rollup após criação, importação e mudanças de status"""
+        dados = {
+            'remetente_nome': 'Remetente', 'remetente_endereco': 'Rua A', 'remetente_cidade': 'Recife/PE',
+            'destinatario_nome': 'Destinatário', 'destinatario_endereco': 'Rua B',
+            'destinatario_cidade': 'Patos/PB', 'tipo_produto': 'Livros'
+        }
+        codigo = json.loads(self.app.post('/api/entregas', data=json.dumps(dados),
+                                          content_type='application/json').data)['data']['codigo_rastreamento']
+        self.app.post('/api/entregas/lote', data=json.dumps([dados, dados]), content_type='application/json')
+        self.app.put(f'/api/entregas/{codigo}/status', data=json.dumps({'status': 'coletado'}),
+                     content_type='application/json')
+        self.app.post('/api/entregas/status/lote',
+                      data=json.dumps({'atualizacoes': [{'codigo': 'EI1234567890', 'status': 'entregue'}]}),
+                      content_type='application/json')
+        
+        self.assertEqual(calcular_estatisticas_status()['por_status'], self.contagem_direta())
+        
+        estatisticas = json.loads(self.app.get('/api/estatisticas').data)['data']
+        self.assertEqual(estatisticas['top_cidades_destino'][0], {'cidade': 'Patos/PB', 'total': 3})
+    
+    def test_rollup_acompanha_comandos_em_lote_do_orm(self):
+        """Testar Query.update()/Query.delete() e update(Entrega), que não passam pelos listeners por objeto"""
+        Entrega.query.filter_by(codigo_rastreamento='EI1234567890').update({'status': 'entregue'})
+        db.session.commit()
+        self.assertEqual(calcular_estatisticas_status()['por_status'], self.contagem_direta())
+        
+        db.session.execute(db.update(Entrega).values(destinatario_cidade='Natal/RN'))
+        db.session.commit()
+        self.assertEqual(calcular_top_cidades(5)[0].destinatario_cidade, 'Natal/RN')
+        
+        Entrega.query.delete()
+        db.session.commit()
+        self.assertEqual(calcular_estatisticas_status()['total'], 0)
+    
+    def test_reconstruir(self):
+        """Testar que a reconstrução reproduz a contagem direta"""
+        db.session.execute(EstatisticaDiaria.__table__.delete())
+        db.session.commit()
+        self.assertEqual(calcular_estatisticas_status()['total'], 0)
+        
+        with db.engine.begin() as conexao:
+            reconstruir_estatistica_diaria(conexao)
+        self.assertEqual(calcular_estatisticas_status()['por_status'], self.contagem_direta())
+
+class ClienteRedisFalso:
+    """Substituto local de um cliente Redis (get/set/incr)"""
+    
+    def __init__(self):
+        self.dados = {}
+    
+    def get(self, chave):
+        return self.dados.get(chave)
+    
+    def set(self, chave, valor, ex=None):
+        self.dados[chave] = valor
+    
+    def incr(self, chave):
+        self.dados[chave] = int(self.dados.get(chave, 0)) + 1
+        return self.dados[chave]
+
+class TestCacheRespostas(ExpressoItaporangaTestCase):
+    """Testes para o cache de respostas das estatísticas"""
+    
+    def test_estatisticas_usam_cache(self):
+        """Testar que a segunda consulta é servida do cache sem acessar o banco"""
+        self.app.get('/api/estatisticas')
+        
+        consultas = []
+        registrar = lambda *args: consultas.append(args[2])
+        event.listen(db.engine, 'before_cursor_execute', registrar)
+        try:
+            response = self.app.get('/api/estatisticas')
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', registrar)
+        
+        self.assertEqual(json.loads(response.data)['data']['total_entregas'], 1)
+        self.assertEqual(consultas, [])
+        self.assertEqual(cache_respostas.hits, 1)
+    
+    def test_escrita_invalida_cache(self):
+        """Testar que criar entrega e atualizar status invalidam as estatísticas"""
+        self.app.get('/api/estatisticas')
+        self.app.post('/api/entregas', data=json.dumps({
+            'remetente_nome': 'Loja Centro', 'remetente_telefone': '83999990000',
+            'remetente_endereco': 'Rua A, 1', 'remetente_cidade': 'Itaporanga',
+            'destinatario_nome': 'Maria', 'destinatario_telefone': '83988880000',
+            'destinatario_endereco': 'Rua B, 2', 'destinatario_cidade': 'Patos',
+            'tipo_produto': 'documento'
+        }), content_type='application/json')
+        
+        data = json.loads(self.app.get('/api/estatisticas').data)['data']
+        self.assertEqual(data['total_entregas'], 2)
+        
+        self.app.put('/api/entregas/EI1234567890/status',
+                     data=json.dumps({'status': 'entregue'}),
+                     content_type='application/json')
+        data = json.loads(self.app.get('/api/estatisticas').data)['data']
+        self.assertEqual(data['entregas_por_status']['entregue'], 1)
+    
+    def test_taxa_acerto_exposta(self):
+        """Testar a taxa de acerto em /api/cache/estatisticas"""
+        self.app.get('/api/estatisticas')
+        self.app.get('/api/estatisticas')
+        
+        data = json.loads(self.app.get('/api/cache/estatisticas').data)['data']['respostas']
+        self.assertEqual(data['backend'], 'memoria')
+        self.assertEqual(data['taxa_acerto'], 0.5)
+    
+    def test_backend_redis(self):
+        """Testar o backend compatível com Redis usando um cliente local"""
+        cache = CacheRespostas(BackendCacheRedis(ClienteRedisFalso()), ttl=60)
+        chamadas = []
+        gerar = lambda: chamadas.append(1) or {'total': len(chamadas)}
+        
+        self.assertEqual(cache.obter_ou_gerar('resumo', gerar), {'total': 1})
+        self.assertEqual(cache.obter_ou_gerar('resumo', gerar), {'total': 1})
+        cache.invalidar()
+        self.assertEqual(cache.obter_ou_gerar('resumo', gerar), {'total': 2})
+        self.assertEqual(cache.estatisticas()['hits'], 1)
+    
+    def test_backend_indisponivel(self):
+        """Testar que falhas do backend caem para o cálculo direto"""
+        class BackendQuebrado(BackendCacheMemoria):
+            def geracao(self, chave):
+                raise ConnectionError('sem conexão')
+        
+        cache = CacheRespostas(BackendQuebrado(capacidade=2, ttl=60), ttl=60)
+        self.assertEqual(cache.obter_ou_gerar('resumo', lambda: 42), 42)
+        self.assertEqual(cache.estatisticas()['erros'], 1)
+
+class TestPoolConexoes(ExpressoItaporangaTestCase):
+    """Testes para a configuração e as métricas do pool de conexões"""
+    
+    def test_opcoes_do_ambiente(self):
+        """Testar SQLALCHEMY_ENGINE_OPTIONS lidas das variáveis DB_*"""
+        ambiente = {'DB_POOL_SIZE': '12', 'DB_MAX_OVERFLOW': '3', 'DB_POOL_RECYCLE': '120',
+                    'DB_POOL_PRE_PING': 'false', 'DB_STATEMENT_TIMEOUT_MS': '5000'}
+        with mock.patch.dict(os.environ, ambiente):
+            opcoes = opcoes_engine('postgresql://usuario@banco/expresso')
+        
+        self.assertEqual(opcoes['pool_size'], 12)
+        self.assertEqual(opcoes['max_overflow'], 3)
+        self.assertEqual(opcoes['pool_recycle'], 120)
+        self.assertFalse(opcoes['pool_pre_ping'])
+        self.assertIs(opcoes['poolclass'], PoolMedido)
+        self.assertEqual(opcoes['connect_args'], {'options': '-c statement_timeout=5000'})
+    
+    def test_padroes_sqlite(self):
+        """Testar pre-ping ligado e sem statement_timeout fora do Postgres"""
+        with mock.patch.dict(os.environ, {'DB_STATEMENT_TIMEOUT_MS': '5000'}):
+            opcoes = opcoes_engine('sqlite:///:memory:')
+        
+        self.assertTrue(opcoes['pool_pre_ping'])
+        self.assertNotIn('poolclass', opcoes)
+        self.assertNotIn('connect_args', opcoes)
+    
+    def test_espera_e_timeout(self):
+        """Testar a contagem de esperas e timeouts do pool"""
+        caminho = os.path.join(tempfile.mkdtemp(), 'pool.db')
+        engine = create_engine(f'sqlite:///{caminho}', poolclass=PoolMedido,
+                               pool_size=1, max_overflow=0, pool_timeout=0.05)
+        try:
+            with engine.connect():
+                self.assertEqual(engine.pool.metricas()['em_uso'], 1)
+                with self.assertRaises(PoolTimeoutError):
+                    engine.connect()
+            
+            metricas = engine.pool.metricas()
+            self.assertEqual(metricas['esperas'], 2)
+            self.assertEqual(metricas['timeouts'], 1)
+            self.assertGreaterEqual(metricas['espera_maxima_segundos'], 0.05)
+        finally:
+            engine.dispose()
+    
+    def test_endpoint_metricas(self):
+        """Testar o pool exposto em /metrics no formato do Prometheus"""
+        response = self.app.get('/metrics')
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content_type.startswith('text/plain'))
+        corpo = response.get_data(as_text=True)
+        self.assertIn('# TYPE expresso_db_pool_checkedout gauge', corpo)
+        self.assertIn('expresso_db_pool_wait_seconds_total ', corpo)
+
+class TestMetricasRequisicoes(ExpressoItaporangaTestCase):
+    """Testes para as métricas de requisições em /metrics"""
+    
+    def setUp(self):
+        super().setUp()
+        registro_metricas.limpar()
+    
+    def test_requisicao_registrada_por_rota(self):
+        """Testar contador, histograma e consultas SQL da rota de rastreamento"""
+        self.app.get('/api/rastrear/EI1234567890')
+        corpo = self.app.get('/metrics').get_data(as_text=True)
+        
+        rotulos = 'method="GET",route="/api/rastrear/<codigo>"'
+        self.assertIn(f'expresso_http_requests_total{{{rotulos},status="200"}} 1', corpo)
+        self.assertIn(f'expresso_http_request_duration_seconds_bucket{{{rotulos},le="+Inf"}} 1', corpo)
+        self.assertIn(f'expresso_http_request_duration_seconds_count{{{rotulos}}} 1', corpo)
+        self.assertIn(f'expresso_db_queries_total{{{rotulos}}} 1', corpo)
+        self.assertIn('expresso_http_requests_in_flight 1', corpo)
+    
+    def test_rota_inexistente(self):
+        """Testar que URLs sem rota não criam rótulos novos"""
+        self.app.get('/nao/existe/123')
+        self.app.get('/nao/existe/456')
+        corpo = self.app.get('/metrics').get_data(as_text=True)
+        
+        self.assertIn('expresso_http_requests_total{method="GET",route="sem_rota",status="404"} 2', corpo)
+        self.assertNotIn('/nao/existe', corpo)
+    
+    def test_histograma_acumulado(self):
+        """Testar buckets cumulativos, soma e contagem do histograma"""
+        registro = RegistroMetricas(buckets=(0.1, 1.0))
+        for duracao in (0.05, 0.5, 5):
+            registro.registrar('GET', '/x', 200, duracao, 2, 0.01)
+        corpo = '\n'.join(registro.exportar())
+        
+        self.assertIn('expresso_http_request_duration_seconds_bucket{method="GET",route="/x",le="0.1"} 1', corpo)
+        self.assertIn('expresso_http_request_duration_seconds_bucket{method="GET",route="/x",le="1.0"} 2', corpo)
+        self.assertIn('expresso_http_request_duration_seconds_bucket{method="GET",route="/x",le="+Inf"} 3', corpo)
+        self.assertIn('expresso_http_request_duration_seconds_sum{method="GET",route="/x"} 5.550000', corpo)
+        self.assertIn('expresso_db_queries_total{method="GET",route="/x"} 6', corpo)
+
+class TestPerfilSQL(ExpressoItaporangaTestCase):
+    """Testes para o perfil de SQL por requisição e o detector de N+1"""
+    
+    def tearDown(self):
+        app.config['PERFIL_SQL'] = False
+        app.config['PERFIL_SQL_REPETICOES'] = 3
+        super().tearDown()
+    
+    def test_desligado_por_padrao(self):
+        """Testar que sem PERFIL_SQL não há cabeçalho Server-Timing"""
+        response = self.app.get('/api/rastrear/EI1234567890')
+        self.assertNotIn('Server-Timing', response.headers)
+    
+    def test_server_timing(self):
+        """Testar o resumo das consultas no cabeçalho Server-Timing"""
+        app.config['PERFIL_SQL'] = True
+        response = self.app.get('/api/rastrear/EI1234567890')
+        
+        self.assertRegex(response.headers['Server-Timing'], r'^sql;dur=[\d.]+;desc="1 consultas"$')
+    
+    def test_repeticao_registrada_no_log(self):
+        """Testar o aviso de N+1 com o local de chamada"""
+        app.config['PERFIL_SQL'] = True
+        app.config['PERFIL_SQL_REPETICOES'] = 1
+        with self.assertLogs(app.logger, level='WARNING') as logs:
+            response = self.app.get('/api/rastrear/EI1234567890')
+        
+        self.assertIn('sql-repetidas', response.headers['Server-Timing'])
+        self.assertIn('api_rastrear:', logs.output[0])
+    
+    def test_analise_de_consultas(self):
+        """Testar a detecção de consultas repetidas e lentas"""
+        consultas = [{'sql': 'SELECT * FROM status_evento WHERE entrega_id = ?', 'duracao_ms': 1.0,
+                      'local': 'listar:10'} for _ in range(4)]
+        consultas.append({'sql': 'SELECT count(*) FROM entrega', 'duracao_ms': 250.0, 'local': 'contar:20'})
+        
+        perfil = analisar_consultas(consultas, limite_lenta_ms=100, limite_repeticoes=3)
+        
+        self.assertEqual(perfil['total'], 5)
+        self.assertEqual(perfil['tempo_ms'], 254.0)
+        self.assertEqual(perfil['repetidas'], [{'sql': consultas[0]['sql'], 'vezes': 4, 'local': 'listar:10'}])
+        self.assertEqual([lenta['local'] for lenta in perfil['lentas']], ['contar:20'])
+    
+    def test_limite_de_consultas_por_endpoint(self):
+        """Testar o número máximo de consultas dos endpoints de leitura"""
+        with self.app.session_transaction() as sess:
+            sess['user_id'] = 1
+        
+        self.assertMaximoConsultas(1, '/api/rastrear/EI1234567890')
+        self.assertMaximoConsultas(1, '/api/rastrear/lote', metodo='post',
+                                   data=json.dumps({'codigos': ['EI1234567890', 'EI0000000001']}),
+                                   content_type='application/json')
+        self.assertMaximoConsultas(2, '/api/estatisticas')
+        self.assertMaximoConsultas(1, '/api/entregas')
+        self.assertMaximoConsultas(1, '/api/entregas/EI1234567890')
+        self.assertMaximoConsultas(2, '/api/entregas/EI1234567890/historico')
+
+DEPENDENCIAS_ASYNC = all(importlib.util.find_spec(modulo) for modulo in ('aiosqlite', 'a2wsgi'))
+
+def chamar_asgi(metodo, caminho, corpo=b'', cabecalhos=None):
+    """Executa uma requisição em app_async e retorna (status, cabeçalhos, corpo)"""
+    async def executar():
+        mensagens = []
+        entradas = [{'type': 'http.request', 'body': corpo, 'more_body': False}]
+        
+        async def receive():
+            return entradas.pop(0) if entradas else {'type': 'http.disconnect'}
+        
+        async def send(mensagem):
+            mensagens.append(mensagem)
+        
+        scope = {
+            'type': 'http', 'method': metodo, 'path': caminho, 'query_string': b'',
+            'http_version': '1.1', 'scheme': 'http',
+            'headers': [(nome.lower().encode(), valor.encode()) for nome, valor in (cabecalhos or {}).items()]
+        }
+        try:
+            await app_async(scope, receive, send)
+        finally:
+            await app_async.encerrar()
+        return mensagens
+    
+    mensagens = asyncio.run(executar())
+    cabecalhos_resposta = {nome.decode(): valor.decode() for nome, valor in mensagens[0]['headers']}
+    return mensagens[0]['status'], cabecalhos_resposta, b''.join(m.get('body', b'') for m in mensagens[1:])
+
+class TestModoAssincrono(ExpressoItaporangaTestCase):
+    """Testes para os endpoints públicos servidos por app_async"""
+    
+    def test_url_do_driver_async(self):
+        """Testar a troca do driver síncrono pelo equivalente asyncio"""
+        self.assertEqual(url_banco_async(make_url('postgresql://u:s@banco/expresso')).drivername,
+                         'postgresql+asyncpg')
+        self.assertEqual(url_banco_async(make_url('sqlite:///expresso.db')).drivername, 'sqlite+aiosqlite')
+        with self.assertRaises(ValueError):
+            url_banco_async(make_url('mysql://u:s@banco/expresso'))
+    
+    @unittest.skipUnless(DEPENDENCIAS_ASYNC, 'aiosqlite/a2wsgi não instalados')
+    def test_rastreamento_igual_ao_sincrono(self):
+        """Testar a paridade do rastreamento e a resposta condicional"""
+        status, cabecalhos, corpo = chamar_asgi('GET', '/api/rastrear/EI1234567890')
+        sincrono = self.app.get('/api/rastrear/EI1234567890')
+        
+        self.assertEqual(status, 200)
+        self.assertEqual(json.loads(corpo), json.loads(sincrono.data))
+        self.assertEqual(cabecalhos['etag'], sincrono.headers['ETag'])
+        self.assertEqual(cabecalhos['x-content-type-options'], 'nosniff')
+        
+        status, _, corpo = chamar_asgi('GET', '/api/rastrear/EI1234567890',
+                                       cabecalhos={'If-None-Match': cabecalhos['etag']})
+        self.assertEqual(status, 304)
+        self.assertEqual(corpo, b'')
+    
+    @unittest.skipUnless(DEPENDENCIAS_ASYNC, 'aiosqlite/a2wsgi não instalados')
+    def test_lote_e_estatisticas_iguais_ao_sincrono(self):
+        """Testar a paridade do rastreamento em lote e das estatísticas"""
+        corpo_lote = json.dumps({'codigos': ['EI1234567890', 'EI0000000000']})
+        _, _, corpo = chamar_asgi('POST', '/api/rastrear/lote', corpo_lote.encode(),
+                                  {'Content-Type': 'application/json'})
+        sincrono = self.app.post('/api/rastrear/lote', data=corpo_lote, content_type='application/json')
+        self.assertEqual(json.loads(corpo), json.loads(sincrono.data))
+        
+        status, _, corpo = chamar_asgi('POST', '/api/rastrear/lote', b'{}', {'Content-Type': 'application/json'})
+        self.assertEqual(status, 400)
+        status, _, corpo = chamar_asgi('POST', '/api/rastrear/lote', b'["EI1234567890"]',
+                                       {'Content-Type': 'application/json'})
+        self.assertEqual(status, 400)
+        
+        _, _, corpo = chamar_asgi('GET', '/api/estatisticas')
+        cache_respostas.limpar()
+        self.assertEqual(json.loads(corpo), json.loads(self.app.get('/api/estatisticas').data))
+    
+    @unittest.skipUnless(DEPENDENCIAS_ASYNC, 'aiosqlite/a2wsgi não instalados')
+    def test_cors_igual_ao_flask(self):
+        """Testar que as origens aceitas são as mesmas do flask-cors, incluindo o padrão do Railway"""
+        permitidas = {}
+        for origem in ['https://painel.railway.app', 'http://localhost:3000',
+                       'https://painel.railway.app.exemplo.com', 'https://exemplo.com']:
+            _, cabecalhos, _ = chamar_asgi('GET', '/api/estatisticas', cabecalhos={'Origin': origem})
+            sincrono = self.app.get('/api/estatisticas', headers={'Origin': origem})
+            self.assertEqual(cabecalhos.get('access-control-allow-origin'),
+                             sincrono.headers.get('Access-Control-Allow-Origin'), origem)
+            permitidas[origem] = 'access-control-allow-origin' in cabecalhos
+        
+        self.assertEqual(permitidas, {'https://painel.railway.app': True, 'http://localhost:3000': True,
+                                      'https://painel.railway.app.exemplo.com': False, 'https://exemplo.com': False})
+    
+    @unittest.skipUnless(DEPENDENCIAS_ASYNC, 'aiosqlite/a2wsgi não instalados')
+    def test_cache_consultado_fora_do_event_loop(self):
+        """Testar que o cache de respostas (possivelmente Redis) não bloqueia o event loop"""
+        threads = []
+        original = cache_respostas.buscar
+        def buscar(*args):
+            threads.append(threading.current_thread())
+            return original(*args)
+        
+        with mock.patch.object(cache_respostas, 'buscar', side_effect=buscar):
+            status, _, _ = chamar_asgi('GET', '/api/estatisticas')
+        self.assertEqual(status, 200)
+        self.assertEqual(len(threads), 1)
+        self.assertIsNot(threads[0], threading.main_thread())
+
+    @unittest.skipUnless(DEPENDENCIAS_ASYNC, 'aiosqlite/a2wsgi não instalados')
+    def test_demais_rotas_no_flask(self):
+        """Testar que as rotas não assíncronas seguem para o Flask"""
+        status, _, corpo = chamar_asgi('GET', '/api/entregas/EI1234567890')
+        
+        self.assertEqual(status, 200)
+        self.assertEqual(json.loads(corpo)['data']['codigo_rastreamento'], 'EI1234567890')
+    
+    @unittest.skipUnless(DEPENDENCIAS_ASYNC, 'aiosqlite/a2wsgi não instalados')
+    def test_metricas_do_modo_assincrono(self):
+        """Testar que as requisições assíncronas entram em /metrics"""
+        registro_metricas.limpar()
+        chamar_asgi('GET', '/api/rastrear/EI1234567890')
+        
+        corpo = self.app.get('/metrics').get_data(as_text=True)
+        rotulos = 'method="GET",route="/api/rastrear/<codigo>"'
+        self.assertIn(f'expresso_http_requests_total{{{rotulos},status="200"}} 1', corpo)
+        self.assertIn(f'expresso_db_queries_total{{{rotulos}}} 1', corpo)
+
+DEPENDENCIAS_ANALISE = all(importlib.util.find_spec(modulo) for modulo in ('pandas', 'matplotlib'))
+DEPENDENCIAS_SNAPSHOT = DEPENDENCIAS_ANALISE and importlib.util.find_spec('pyarrow') is not None
+
+def recriar_entrega_legada(conexao):
+    """Recria a tabela entrega vazia como antes da migração 7, com data_criacao aceitando NULL"""
+    metadata = MetaData()
+    Usuario.__table__.to_metadata(metadata)
+    legada = Entrega.__table__.to_metadata(metadata)
+    legada.c.data_criacao.nullable = True
+    legada.drop(conexao)
+    legada.create(conexao)
+
+def preparar_banco_analise(caminho, legado=False):
+    """Entregas com contagens distintas por rota, dia e mês, mais histórico de status"""
+    engine = create_engine(f'sqlite:///{caminho}')
+    db.metadata.create_all(engine)
+    if legado:
+        with engine.begin() as conexao:
+            recriar_entrega_legada(conexao)
+    cidades = ['Recife - PE', 'Patos - PB', 'Itaporanga - PB', 'Natal - RN']
+    produtos = ['Documentos', 'Roupas', 'Alimentos']
+    status = ['pendente', 'em_transito', 'entregue', 'cancelado']
+    base = datetime(2024, 1, 1, 8, 30)
+    entregas = []
+    for i in range(300):
+        criacao = base + timedelta(days=(i * i) % 90, hours=i % 11)
+        entregas.append({
+            'codigo_rastreamento': f'EI{i:010d}', 'remetente_nome': 'R', 'remetente_endereco': 'Rua A',
+            'remetente_cidade': cidades[min(i % 7, 3)], 'destinatario_nome': 'D',
+            'destinatario_endereco': 'Rua B', 'destinatario_cidade': cidades[(i // 3) % 4],
+            'tipo_produto': produtos[min(i % 5, 2)],
+            'peso': (i % 17) + 0.25 if i % 9 else None, 'valor_declarado': (i * 37 % 500) + 0.5,
+            'status': status[min(i % 6, 3)], 'data_criacao': criacao,
+            'data_atualizacao': criacao + timedelta(minutes=i * 13)
+        })
+    eventos = [{
+        'entrega_id': i + 1, 'status_anterior': 'pendente', 'status': status[1 + i % 3],
+        'data_evento': base + timedelta(days=i % 60), 'duracao_segundos': float(i * 600)
+    } for i in range(120)]
+    with engine.begin() as conexao:
+        conexao.execute(Entrega.__table__.insert(), entregas)
+        conexao.execute(StatusEvento.__table__.insert(), eventos)
+    engine.dispose()
+
+class TestCarregamentoAnalise(ExpressoItaporangaTestCase):
+    """Testes da leitura em lotes da análise no pandas"""
+    
+    @unittest.skipUnless(DEPENDENCIAS_ANALISE, 'pandas/matplotlib não instalados')
+    def test_filtro_periodo_com_data_final_inclusiva(self):
+        """Testar que o período vai do início do primeiro dia ao fim do último"""
+        sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+        from analise_avancada_entregas import filtro_periodo
+        
+        self.assertEqual(filtro_periodo('data_criacao', None, None), ('', {}))
+        where, parametros = filtro_periodo('data_criacao', datetime(2024, 1, 15, 13, 45), '2024-02-29')
+        self.assertEqual(where, 'WHERE data_criacao >= :data_inicio AND data_criacao < :data_fim')
+        self.assertEqual(parametros, {'data_inicio': datetime(2024, 1, 15), 'data_fim': datetime(2024, 3, 1)})
+    
+    @unittest.skipUnless(DEPENDENCIAS_ANALISE, 'pandas/matplotlib não instalados')
+    def test_lotes_com_tipos_compactos_e_periodo(self):
+        """Testar tipos category/float32 e o filtro de período na leitura em lotes"""
+        sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+        import analise_avancada_entregas as analise
+        
+        with tempfile.TemporaryDirectory() as diretorio:
+            caminho = os.path.join(diretorio, 'analise.db')
+            preparar_banco_analise(caminho)
+            engine = create_engine(f'sqlite:///{caminho}')
+            with engine.connect() as conexao:
+                esperadas = conexao.execute(text(
+                    "SELECT COUNT(*) FROM entrega WHERE data_criacao >= '2024-01-15' AND data_criacao < '2024-03-01'"
+                )).scalar()
+            engine.dispose()
+            
+            with mock.patch('sys.stdout', new=mock.MagicMock()):
+                analisador = analise.AnalisadorEntregas(caminho, '2024-01-15', '2024-02-29', tamanho_lote=7)
+                lotes = list(analisador.lotes_entregas())
+                vazio = analise.AnalisadorEntregas(caminho, '2030-01-01', '2030-01-31')
+            
+            self.assertEqual(analisador.agregados.total, esperadas)
+            self.assertEqual(sum(len(lote) for lote in lotes), esperadas)
+            self.assertTrue(all(len(lote) <= 7 for lote in lotes))
+            self.assertGreaterEqual(analisador.agregados.data_minima, datetime(2024, 1, 15))
+            self.assertLess(analisador.agregados.data_maxima, datetime(2024, 3, 1))
+            for lote in lotes:
+                for coluna in analise.COLUNAS_CATEGORIA:
+                    self.assertEqual(lote[coluna].dtype, 'category', coluna)
+                for coluna in ('peso', 'valor_declarado'):
+                    self.assertEqual(lote[coluna].dtype, 'float32', coluna)
+                self.assertEqual(lote['data_criacao'].dtype, 'datetime64[ns]')
+            
+            self.assertEqual(vazio.agregados.total, 0)
+    
+    @unittest.skipUnless(DEPENDENCIAS_ANALISE, 'pandas/matplotlib não instalados')
+    def test_relatorio_por_lotes_igual_ao_dataframe_inteiro(self):
+        """Testar os agregados somados lote a lote contra o cálculo no DataFrame inteiro"""
+        sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+        import pandas as pd
+        import analise_avancada_entregas as analise
+        
+        with tempfile.TemporaryDirectory() as diretorio:
+            caminho = os.path.join(diretorio, 'analise.db')
+            preparar_banco_analise(caminho)
+            
+            with mock.patch.object(analise, 'CAMINHO_RELATORIO', os.path.join(diretorio, 'relatorio.json')), \
+                    mock.patch('sys.stdout', new=mock.MagicMock()):
+                # Lotes pequenos: cada lote traz só parte das categorias
+                analisador = analise.AnalisadorEntregas(caminho, tamanho_lote=7)
+                relatorio = analisador.gerar_relatorio_completo()
+                inteiro = analise.AnalisadorEntregas(caminho, tamanho_lote=10000).gerar_relatorio_completo()
+                performance = analisador.analise_performance()
+                vazio = analise.AnalisadorEntregas(caminho, '2030-01-01', '2030-01-31').gerar_relatorio_completo()
+            
+            df = pd.read_sql_query('SELECT * FROM entrega', f'sqlite:///{caminho}',
+                                   parse_dates=['data_criacao', 'data_atualizacao'])
+            df['tempo_processamento'] = (df['data_atualizacao'] - df['data_criacao']).dt.total_seconds() / 3600
+            
+            for chave in ['total_entregas', 'distribuicao_status', 'distribuicao_produtos', 'rotas_principais',
+                          'entregas_por_dia_semana', 'entregas_por_mes', 'latencia_etapas']:
+                self.assertEqual(relatorio[chave], inteiro[chave], chave)
+            self.assertEqual(relatorio['total_entregas'], len(df))
+            self.assertEqual(relatorio['distribuicao_status'], df['status'].value_counts().to_dict())
+            self.assertEqual(relatorio['entregas_por_mes'],
+                             df['data_criacao'].dt.strftime('%Y-%m').value_counts().sort_index().to_dict())
+            indicadores = {
+                'tempo_medio_processamento': df['tempo_processamento'].mean(),
+                'total_valor_declarado': df['valor_declarado'].sum(),
+                'peso_total': df['peso'].sum()
+            }
+            for chave, valor in indicadores.items():
+                self.assertAlmostEqual(relatorio['indicadores'][chave], valor, delta=abs(valor) * 1e-6, msg=chave)
+            
+            # Média, desvio, mínimo e máximo por status combinados entre os lotes
+            esperado = df.groupby('status')['tempo_processamento'].agg(['mean', 'std', 'min', 'max']).round(2)
+            pd.testing.assert_frame_equal(performance, esperado, check_names=False)
+            
+            self.assertIsNone(vazio)
+
+class TestAnaliseSQL(ExpressoItaporangaTestCase):
+    """Testes de paridade entre a análise no pandas e a agregação no banco"""
+    
+    @unittest.skipUnless(DEPENDENCIAS_ANALISE, 'pandas/matplotlib não instalados')
+    def test_relatorio_sql_igual_ao_pandas(self):
+        """Testar que AnalisadorSQL produz o mesmo relatório de AnalisadorEntregas"""
+        sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+        import analise_avancada_entregas as analise
+        
+        with tempfile.TemporaryDirectory() as diretorio:
+            caminho = os.path.join(diretorio, 'analise.db')
+            preparar_banco_analise(caminho)
+            
+            with mock.patch.object(analise, 'CAMINHO_RELATORIO', os.path.join(diretorio, 'relatorio.json')), \
+                    mock.patch('sys.stdout', new=mock.MagicMock()):
+                for periodo in [(None, None), ('2024-01-15', '2024-02-29')]:
+                    pandas = analise.AnalisadorEntregas(caminho, *periodo).gerar_relatorio_completo()
+                    sql = analise.AnalisadorSQL(caminho, *periodo).gerar_relatorio_completo()
+                    
+                    for chave in ['total_entregas', 'distribuicao_status', 'distribuicao_produtos',
+                                  'rotas_principais', 'entregas_por_dia_semana', 'latencia_etapas']:
+                        self.assertEqual(sql[chave], pandas[chave], chave)
+                    self.assertEqual(list(sql['entregas_por_mes'].items()), list(pandas['entregas_por_mes'].items()))
+                    for chave, valor in pandas['indicadores'].items():
+                        # O pandas guarda peso e valor em float32
+                        self.assertAlmostEqual(sql['indicadores'][chave], valor, delta=abs(valor) * 1e-6, msg=chave)
+            
+            vazio = analise.AnalisadorSQL(caminho, '2030-01-01', '2030-01-31')
+            with mock.patch('sys.stdout', new=mock.MagicMock()):
+                self.assertIsNone(vazio.gerar_relatorio_completo())
+
+class TestAnaliseIncremental(ExpressoItaporangaTestCase):
+    """Testes da análise incremental (agregados parciais e marca d'água)"""
+    maxDiff = None
+    
+    def comparavel(self, resultados):
+        """Relatório sem as chaves exclusivas de cada backend, com somas arredondadas"""
+        resultados = {chave: valor for chave, valor in resultados.items()
+                      if chave not in ('data_analise', 'tempo_por_status')}
+        resultados['rotas_principais'] = list(resultados['rotas_principais'].items())
+        resultados['indicadores'] = {chave: round(valor, 6) for chave, valor in resultados['indicadores'].items()}
+        resultados['latencia_etapas'] = sorted(resultados['latencia_etapas'],
+                                               key=lambda etapa: (str(etapa['status_anterior']), etapa['status']))
+        return resultados
+    
+    @unittest.skipUnless(DEPENDENCIAS_ANALISE, 'pandas/matplotlib não instalados')
+    def test_welford_adiciona_e_remove(self):
+        """Testar média e desvio do Welford contra o módulo statistics após remoções"""
+        sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+        import statistics
+        from analise_avancada_entregas import Welford
+        
+        valores = [(i * 7919 % 101) / 3 for i in range(50)]
+        acumulado = Welford()
+        for valor in valores:
+            acumulado.adicionar(valor)
+        for valor in valores[10:30]:
+            acumulado.remover(valor)
+        restantes = valores[:10] + valores[30:]
+        
+        self.assertEqual(acumulado.n, len(restantes))
+        self.assertAlmostEqual(acumulado.media, statistics.mean(restantes), places=9)
+        self.assertAlmostEqual(acumulado.desvio(), statistics.stdev(restantes), places=9)
+        
+        # Estado salvo e restaurado, e remoção até esvaziar
+        restaurado = Welford(*acumulado.para_lista())
+        for valor in restantes:
+            restaurado.remover(valor)
+        self.assertEqual((restaurado.n, restaurado.media), (0, 0.0))
+        self.assertIsNone(restaurado.desvio())
+    
+    @unittest.skipUnless(DEPENDENCIAS_ANALISE, 'pandas/matplotlib não instalados')
+    def test_relatorio_incremental_igual_ao_recalculo_completo(self):
+        """Testar o relatório incremental contra o recálculo completo após inserções e mudanças de status"""
+        sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+        import analise_avancada_entregas as analise
+        
+        with tempfile.TemporaryDirectory() as diretorio:
+            caminho = os.path.join(diretorio, 'analise.db')
+            estado = os.path.join(diretorio, 'estado.db')
+            # Banco anterior à migração 7, que ainda aceita data_criacao nula
+            preparar_banco_analise(caminho, legado=True)
+            engine = create_engine(f'sqlite:///{caminho}')
+            with engine.begin() as conexao:
+                # Entregas antigas sem datas contam nos totais, mas não no tempo de processamento
+                conexao.execute(text(
+                    "UPDATE entrega SET data_atualizacao = NULL WHERE codigo_rastreamento IN ('EI0000000001', 'EI0000000002')"
+                ))
+                conexao.execute(text("UPDATE entrega SET data_criacao = NULL WHERE codigo_rastreamento = 'EI0000000003'"))
+            
+            with mock.patch.object(analise, 'CAMINHO_RELATORIO', os.path.join(diretorio, 'relatorio.json')), \
+                    mock.patch('sys.stdout', new=mock.MagicMock()):
+                incremental = analise.AnalisadorIncremental(caminho, caminho_estado=estado, tamanho_lote=64)
+                completo = self.comparavel(analise.AnalisadorSQL(caminho).gerar_relatorio_completo())
+                self.assertEqual(self.comparavel(incremental.gerar_relatorio()), completo)
+                # Reler a margem antes da marca d'água não conta as mesmas entregas de novo
+                self.assertEqual(self.comparavel(incremental.gerar_relatorio()), completo)
+                incremental.estado.close()
+                
+                agora = '2030-01-01 00:00:00.000000'
+                with engine.begin() as conexao:
+                    conexao.execute(text(
+                        "UPDATE entrega SET status = 'entregue', data_atualizacao = :agora "
+                        "WHERE codigo_rastreamento IN ('EI0000000004', 'EI0000000010', 'EI0000000005')"
+                    ), {'agora': agora})
+                    conexao.execute(text(
+                        "UPDATE entrega SET status = 'cancelado', data_atualizacao = :agora WHERE codigo_rastreamento = 'EI0000000002'"
+                    ), {'agora': agora})
+                    conexao.execute(Entrega.__table__.insert(), [{
+                        'codigo_rastreamento': f'EN{i:010d}', 'remetente_nome': 'R', 'remetente_endereco': 'Rua A',
+                        'remetente_cidade': 'Natal - RN', 'destinatario_nome': 'D', 'destinatario_endereco': 'Rua B',
+                        'destinatario_cidade': 'Patos - PB', 'tipo_produto': 'Roupas', 'peso': 1.5,
+                        'valor_declarado': 20.0, 'status': 'pendente', 'data_criacao': datetime(2029, 12, 1 + i),
+                        'data_atualizacao': datetime(2029, 12, 31, 23, 58)
+                    } for i in range(5)])
+                    conexao.execute(StatusEvento.__table__.insert(), [{
+                        'entrega_id': 5, 'status_anterior': 'em_transito', 'status': 'entregue',
+                        'data_evento': datetime(2030, 1, 1), 'duracao_segundos': 7200.0
+                    }])
+                engine.dispose()
+                
+                # Nova instância: os agregados vêm do arquivo de estado e só as alteradas são relidas
+                incremental = analise.AnalisadorIncremental(caminho, caminho_estado=estado, tamanho_lote=64)
+                processadas = incremental.atualizar()
+                # As 9 alteradas, mais as poucas dentro da margem de releitura; nunca o histórico inteiro
+                self.assertGreaterEqual(processadas, 9)
+                self.assertLess(processadas, 20)
+                self.assertEqual(self.comparavel(incremental.gerar_relatorio()),
+                                 self.comparavel(analise.AnalisadorSQL(caminho).gerar_relatorio_completo()))
+                incremental.estado.close()
+
+    @unittest.skipUnless(DEPENDENCIAS_ANALISE, 'pandas/matplotlib não instalados')
+    def test_evento_com_id_menor_confirmado_depois(self):
+        """Testar que eventos de transações confirmadas depois, com id menor, entram nas etapas"""
+        sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+        import sqlite3
+        import analise_avancada_entregas as analise
+        
+        with tempfile.TemporaryDirectory() as diretorio:
+            caminho = os.path.join(diretorio, 'analise.db')
+            estado = os.path.join(diretorio, 'estado.db')
+            preparar_banco_analise(caminho)
+            engine = create_engine(f'sqlite:///{caminho}')
+            
+            def inserir_evento(id_evento, data_evento):
+                with engine.begin() as conexao:
+                    conexao.execute(StatusEvento.__table__.insert(), [{
+                        'id': id_evento, 'entrega_id': 7, 'status_anterior': 'em_transito', 'status': 'entregue',
+                        'data_evento': data_evento, 'duracao_segundos': 3600.0
+                    }])
+            
+            def etapas(caminho_estado=estado):
+                incremental = analise.AnalisadorIncremental(caminho, caminho_estado=caminho_estado)
+                try:
+                    return self.comparavel(incremental.gerar_relatorio())['latencia_etapas']
+                finally:
+                    incremental.estado.close()
+            
+            with mock.patch.object(analise, 'CAMINHO_RELATORIO', os.path.join(diretorio, 'relatorio.json')), \
+                    mock.patch('sys.stdout', new=mock.MagicMock()):
+                inserir_evento(1000, datetime(2030, 1, 1))
+                self.assertEqual(etapas(), self.comparavel(analise.AnalisadorSQL(caminho).gerar_relatorio_completo())['latencia_etapas'])
+                
+                # Id alocado antes do evento 1000, mas confirmado só depois da execução anterior
+                inserir_evento(500, datetime(2029, 12, 31, 23, 58))
+                completo = self.comparavel(analise.AnalisadorSQL(caminho).gerar_relatorio_completo())['latencia_etapas']
+                self.assertEqual(etapas(), completo)
+                self.assertEqual(etapas(), completo)
+                
+                # Só os ids dentro da janela de releitura ficam no estado
+                with sqlite3.connect(estado) as conexao:
+                    self.assertEqual(sorted(id_evento for (id_evento,) in conexao.execute('SELECT id FROM evento_contado')),
+                                     [500, 1000])
+                
+                # Banco sem histórico de status: etapas vazias, sem erro
+                with engine.begin() as conexao:
+                    conexao.execute(text('DROP TABLE status_evento'))
+                self.assertEqual(etapas(os.path.join(diretorio, 'outro_estado.db')), [])
+            engine.dispose()
+
+class TestSnapshotParquet(ExpressoItaporangaTestCase):
+    """Testes do snapshot Parquet usado pela análise"""
+    maxDiff = None
+    
+    def relatorio(self, analise, *args, **kwargs):
+        """Relatório sem data_analise, com as etapas em ordem estável"""
+        with mock.patch('sys.stdout', new=mock.MagicMock()):
+            resultados = analise.AnalisadorEntregas(*args, **kwargs).gerar_relatorio_completo()
+        resultados.pop('data_analise')
+        # Somas em float dependem da ordem das linhas
+        resultados['indicadores'] = {chave: round(valor, 6) for chave, valor in resultados['indicadores'].items()}
+        resultados['latencia_etapas'].sort(key=lambda etapa: (str(etapa['status_anterior']), etapa['status']))
+        return resultados
+    
+    @unittest.skipUnless(DEPENDENCIAS_SNAPSHOT, 'pandas/matplotlib/pyarrow não instalados')
+    def test_snapshot_igual_ao_banco_e_reexportacao_por_mes(self):
+        """Testar a leitura do snapshot e a reexportação só dos meses alterados"""
+        sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+        import analise_avancada_entregas as analise
+        from exportar_snapshot_entregas import ExportadorSnapshot
+        
+        with tempfile.TemporaryDirectory() as diretorio:
+            caminho = os.path.join(diretorio, 'analise.db')
+            snapshot = os.path.join(diretorio, 'snapshot')
+            preparar_banco_analise(caminho)
+            
+            with mock.patch.object(analise, 'CAMINHO_RELATORIO', os.path.join(diretorio, 'relatorio.json')), \
+                    mock.patch('sys.stdout', new=mock.MagicMock()):
+                resumo = ExportadorSnapshot(caminho, snapshot).exportar()
+                self.assertEqual(resumo['entrega'], (3, 300))
+                self.assertTrue(os.path.exists(os.path.join(snapshot, 'entrega', 'mes=2024-02', 'dados.parquet')))
+                
+                for periodo in [(None, None), ('2024-01-15', '2024-02-29')]:
+                    self.assertEqual(self.relatorio(analise, caminho, *periodo, snapshot=snapshot),
+                                     self.relatorio(analise, caminho, *periodo))
+                
+                # Mudança de status numa entrega de janeiro e remoção de todas as de março
+                engine = create_engine(f'sqlite:///{caminho}')
+                with engine.begin() as conexao:
+                    conexao.execute(text(
+                        "UPDATE entrega SET status = 'entregue', data_atualizacao = :agora WHERE codigo_rastreamento = 'EI0000000000'"
+                    ), {'agora': '2030-01-01 00:00:00.000000'})
+                    conexao.execute(text("DELETE FROM entrega WHERE data_criacao >= '2024-03-01'"))
+                engine.dispose()
+                
+                resumo = ExportadorSnapshot(caminho, snapshot).exportar()
+                self.assertEqual(resumo['entrega'][0], 1)
+                self.assertFalse(os.path.exists(os.path.join(snapshot, 'entrega', 'mes=2024-03')))
+                self.assertEqual(self.relatorio(analise, caminho, snapshot=snapshot), self.relatorio(analise, caminho))
+
+class TestGraficosAnalise(ExpressoItaporangaTestCase):
+    """Testes da renderização dos gráficos da análise"""
+    
+    @unittest.skipUnless(importlib.util.find_spec('matplotlib'), 'matplotlib não instalado')
+    def test_so_renderiza_graficos_com_dados_alterados(self):
+        """Testar que gráficos sem mudança nos dados são mantidos"""
+        sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+        import gerar_graficos_analise
+        from gerar_graficos_analise import gerar_graficos
+        
+        dados = {
+            'distribuicao_status': {'entregue': 3, 'pendente': 1},
+            'distribuicao_produtos': {'Documentos': 2, 'Roupas': 2},
+            'entregas_por_dia_semana': {'Monday': 4},
+            'indicadores': {'taxa_sucesso': 75.0, 'tempo_medio_processamento': 10.0,
+                            'total_valor_declarado': 100.0, 'peso_total': 5.0}
+        }
+        with tempfile.TemporaryDirectory() as diretorio:
+            gerados, falhas = gerar_graficos([(dados, diretorio)], processos=2, dpi=20)
+            self.assertEqual((len(gerados), falhas), (4, []))
+            self.assertTrue(all(os.path.exists(caminho) for caminho in gerados))
+            
+            self.assertEqual(gerar_graficos([(dados, diretorio)], processos=2, dpi=20), ([], []))
+            
+            dados['distribuicao_produtos']['Alimentos'] = 1
+            gerados, _ = gerar_graficos([(dados, diretorio)], processos=2, dpi=20)
+            self.assertEqual(sorted(os.path.basename(caminho) for caminho in gerados),
+                             ['dashboard_resumo.png', 'distribuicao_produtos.png'])
+            
+            # Outra resolução invalida todos
+            self.assertEqual(len(gerar_graficos([(dados, diretorio)], processos=2, dpi=30)[0]), 4)
+            
+            # Mudança no código do módulo (ex.: rotacionar_rotulos) também
+            with mock.patch.object(gerar_graficos_analise, 'VERSAO_CODIGO', 'outra versão'):
+                self.assertEqual(len(gerar_graficos([(dados, diretorio)], processos=2, dpi=30)[0]), 4)
+    
+    @unittest.skipUnless(importlib.util.find_spec('matplotlib'), 'matplotlib não instalado')
+    def test_falha_em_um_grafico_preserva_os_demais(self):
+        """Testar que os hashes dos gráficos renderizados são gravados mesmo com falha em outro"""
+        sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+        from gerar_graficos_analise import gerar_graficos
+        
+        # Sem indicadores só o dashboard falha
+        dados = {
+            'distribuicao_status': {'entregue': 3, 'pendente': 1},
+            'distribuicao_produtos': {'Documentos': 2, 'Roupas': 2},
+            'entregas_por_dia_semana': {'Monday': 4}
+        }
+        with tempfile.TemporaryDirectory() as diretorio:
+            gerados, falhas = gerar_graficos([(dados, diretorio)], processos=2, dpi=20)
+            self.assertEqual(len(gerados), 3)
+            self.assertEqual([(nome, saida) for nome, saida, _ in falhas], [('dashboard_resumo', diretorio)])
+            self.assertIsInstance(falhas[0][2], KeyError)
+            
+            dados['indicadores'] = {'taxa_sucesso': 75.0, 'tempo_medio_processamento': 10.0,
+                                    'total_valor_declarado': 100.0, 'peso_total': 5.0}
+            gerados, falhas = gerar_graficos([(dados, diretorio)], processos=2, dpi=20)
+            self.assertEqual(([os.path.basename(caminho) for caminho in gerados], falhas),
+                             (['dashboard_resumo.png'], []))
+
 class TestAPIContato(ExpressoItaporangaTestCase):
     """Testes para a API de contato"""
     
@@ -67,6 +67,52 @@ async function rastrearEntrega(codigo) {
     }
 }
 
+// Acompanhar mudanças de status de uma entrega em tempo real (Server-Sent Events).
+// Só é aberto a pedido do usuário: cada stream ocupa uma thread do servidor.
+// Sem EventSource, ou com o servidor no limite de streams (503), consulta a cada 30 segundos.
+const INTERVALO_CONSULTA_STATUS = 30000;
+
+function acompanharEntrega(codigo, aoMudarStatus) {
+    let consulta = null;
+    
+    function consultarPeriodicamente() {
+        if (consulta) {
+            return;
+        }
+        consulta = setInterval(async function() {
+            const resultado = await rastrearEntrega(codigo);
+            if (resultado.encontrado) {
+                aoMudarStatus(resultado);
+            }
+        }, INTERVALO_CONSULTA_STATUS);
+    }
+    
+    let eventos = null;
+    if (window.EventSource) {
+        eventos = new EventSource(`${API_BASE_URL}/api/rastrear/${encodeURIComponent(codigo)}/stream`);
+        eventos.addEventListener('status', function(e) {
+            aoMudarStatus(JSON.parse(e.data));
+        });
+        eventos.addEventListener('error', function() {
+            // Resposta diferente de 200 encerra o EventSource sem reconectar
+            if (eventos.readyState === EventSource.CLOSED) {
+                consultarPeriodicamente();
+            }
+        });
+    } else {
+        consultarPeriodicamente();
+    }
+    
+    return {
+        close: function() {
+            if (eventos) {
+                eventos.close();
+            }
+            clearInterval(consulta);
+        }
+    };
+}
+
 // Enviar formulário de contato
 async function enviarContato(formData) {
     try {
@@ -155,6 +201,7 @@ function mostrarSucesso(mensagem) {
  */
 document.addEventListener('DOMContentLoaded', function() {
     // Configurar formulário de rastreamento
+    let acompanhamentoAtual = null;
     const formRastreamento = document.querySelector('#form-rastreamento');
     if (formRastreamento) {
         formRastreamento.addEventListener('submit', async function(e) {
@@ -170,17 +217,32 @@ document.addEventListener('DOMContentLoaded', function() {
             
             const resultadoDiv = document.querySelector('#resultado-rastreamento');
             if (resultadoDiv) {
+                if (acompanhamentoAtual) {
+                    acompanhamentoAtual.close();
+                    acompanhamentoAtual = null;
+                }
+                
                 if (resultado.encontrado) {
                     resultadoDiv.innerHTML = `
                         <div class="rastreamento-sucesso">
                             <h3>Entrega Encontrada!</h3>
                             <p><strong>Código:</strong> ${resultado.codigo}</p>
-                            <p><strong>Status:</strong> ${resultado.status}</p>
+                            <p><strong>Status:</strong> <span id="status-rastreamento">${resultado.status}</span></p>
                             <p><strong>Destinatário:</strong> ${resultado.destinatario}</p>
                             <p><strong>Cidade:</strong> ${resultado.cidade_destino}</p>
                             <p><strong>Data:</strong> ${resultado.data_criacao}</p>
+                            <button type="button" class="btn-primary" id="acompanhar-rastreamento" style="margin-top: 1rem;">Acompanhar em tempo real</button>
                         </div>
                     `;
+                    
+                    // Atualizar o status na tela sem precisar consultar de novo (só a pedido do usuário)
+                    document.querySelector('#acompanhar-rastreamento').addEventListener('click', function() {
+                        this.disabled = true;
+                        this.textContent = 'Acompanhando...';
+                        acompanhamentoAtual = acompanharEntrega(resultado.codigo, function(evento) {
+                            document.querySelector('#status-rastreamento').textContent = evento.status;
+                        });
+                    });
                 } else {
                     resultadoDiv.innerHTML = `
                         <div class="rastreamento-erro">